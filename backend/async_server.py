@@ -0,0 +1,413 @@
+## Asyncio version of the file server: one event loop instead of one thread per client
+
+# import libraries
+import asyncio
+import os
+import shutil
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics_logger import StatisticsLogger
+from partial_upload import PartialUpload
+from hash_cache import HashCache
+from metrics import Metrics, serve_metrics
+from directory_cache import DirectoryCache, parse_dir_options
+from path_locks import AsyncPathLocks
+from server import format_size, storage_path, STORAGE_ROOT, UPLOAD_SPOOL
+from auth import MemoryUserStore, SessionTokens, DEFAULT_USERS, TOKEN_TTL
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import AsyncFramedConnection, ProtocolError, STATUS_ERROR, TOKEN_PREFIX
+from transfer import DEFAULT_CHUNK_SIZE, DEFAULT_HASH, HASH_ALGORITHMS, new_hasher, hash_file
+
+
+class AsyncFileServer:
+    # Constructor
+    def __init__(self, host='0.0.0.0', port=5000, backlog=100, max_connections=1000,
+                 io_workers=8, chunk_size=DEFAULT_CHUNK_SIZE, metrics_port=None, user_store=None,
+                 token_ttl=TOKEN_TTL, storage_root=STORAGE_ROOT):
+        self.host = host
+        self.port = port
+        self.backlog = backlog  # pending connections the kernel queues for us
+        self.max_connections = max_connections  # clients served at once, the rest are turned away
+        self.chunk_size = chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=io_workers)  # all blocking file I/O runs here
+        self.storage_root = os.path.normpath(storage_root)  # one root only; several need the threaded server
+        self.current_client_dir = {}
+        self.locks = AsyncPathLocks(self.storage_root)  # the threaded server's PathLocks, for tasks
+        self.metrics = Metrics()  # live counters and latency histograms, see STATS
+        self.metrics_port = metrics_port  # optional Prometheus endpoint on localhost
+        self.logger = StatisticsLogger("server_statistics.csv", metrics=self.metrics)  # streamed to disk as records come in
+        self.hash_cache = HashCache(os.path.join(self.storage_root, ".hashes.db"))
+        self.dir_cache = DirectoryCache()
+        self.users = user_store if user_store is not None else MemoryUserStore(DEFAULT_USERS)
+        self.tokens = SessionTokens(token_ttl)
+        self.client_users = {}  # username of each session
+        self.server = None
+        self.stopping = None
+
+    # Function to start server
+    def start_server(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.stopping = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 backlog=self.backlog)
+        print(f"Async server listening on {self.host}:{self.port}")
+        if self.metrics_port is not None:
+            serve_metrics(self.metrics, self.metrics_port)
+
+        # Setup signal handler for graceful shutdown
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, self.stopping.set)
+
+        await self.stopping.wait()
+        await self.shutdown_server()
+
+    # Graceful shutdown method
+    async def shutdown_server(self):
+        print("Shutting down server...")
+        self.server.close()  # Stop accepting new connections
+        for conn in list(self.current_client_dir):  # Close active connections
+            await conn.close()
+        await self.server.wait_closed()
+        self.executor.shutdown()
+        self.logger.close()  # Flush the last records
+        print("Server stopped gracefully. Logs saved.")
+
+    async def run_io(self, func, *args):
+        """Run a blocking file system call on the bounded executor."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # Function to handle client
+    async def handle_client(self, reader, writer):
+        conn = AsyncFramedConnection(reader, writer, self.executor, self.chunk_size)
+        if len(self.current_client_dir) >= self.max_connections:
+            await conn.send_message("Server busy, try again later.\n", STATUS_ERROR)
+            await conn.close()
+            return
+        print(f"New connection from {writer.get_extra_info('peername')}")
+        self.current_client_dir[conn] = self.storage_root
+        try:
+            username = await self.authenticate(conn)
+            if username is not None:
+                self.client_users[conn] = username
+                self.metrics.session_started()
+                try:
+                    await self.command_loop(conn)
+                finally:
+                    self.metrics.session_ended()
+        except (ConnectionError, asyncio.IncompleteReadError, ProtocolError) as e:
+            print(f"Error: {e}")
+        finally:
+            self.current_client_dir.pop(conn, None)
+            self.client_users.pop(conn, None)
+            await conn.close()
+
+    async def authenticate(self, conn):
+        """Ask for username and password, or a session token; returns the username or None."""
+        username, secret = await conn.recv_credentials()
+        start = time.perf_counter()
+        if secret.startswith(TOKEN_PREFIX):
+            command = "AUTH_TOKEN"
+            valid = self.tokens.check(secret[len(TOKEN_PREFIX):]) == username
+        else:
+            command = "AUTH"
+            valid = await self.run_io(self.users.verify, username, secret)  # hashing is slow on purpose
+        if valid:
+            await conn.send_message("Authentication successful.\n")
+            self.metrics.observe_command(command, time.perf_counter() - start)
+            return username
+        await conn.send_message("Authentication failed.\n", STATUS_ERROR)
+        self.metrics.observe_command(command, time.perf_counter() - start, failed=True)
+        return None
+
+    async def command_loop(self, conn):
+        while True:
+            request = await conn.recv_command()
+            if not request:
+                break
+            command, *args = request.split()
+            if command.lower() == "quit":
+                break
+            if command.lower() == "shutdown":
+                await conn.send_message("Server Shutdown\n")
+                self.stopping.set()
+                break
+            start = time.perf_counter()
+            failed = True
+            try:
+                await self.process_command(conn, command, args)
+                failed = False
+            except (ConnectionError, asyncio.IncompleteReadError, ProtocolError):
+                raise
+            except Exception as e:
+                print(f"Error: {e}")
+                await conn.send_message("An error occurred.", STATUS_ERROR)
+                break
+            finally:
+                self.metrics.observe_command(command.upper(), time.perf_counter() - start, failed)
+
+    # Function to process commands
+    async def process_command(self, conn, command, args):
+        command = command.upper()
+        if command == "UPLOAD":
+            await self.upload_file(conn, args[0], int(args[1]) if len(args) > 1 else 0,
+                                   args[2] if len(args) > 2 else DEFAULT_HASH)
+        elif command == "OFFSET":
+            await self.upload_offset(conn, args[0])
+        elif command == "DOWNLOAD":
+            await self.download_file(conn, args[0], int(args[1]) if len(args) > 1 else 0,
+                                     args[2] if len(args) > 2 else DEFAULT_HASH)
+        elif command == "DELETE":
+            await self.delete_file(conn, args[0])
+        elif command == "DIR":
+            await self.list_files(conn, args)
+        elif command == "STATS":
+            await conn.send_message(self.metrics.prometheus() if args and args[0].lower() == "prometheus"
+                                    else self.metrics.summary())
+        elif command == "TOKEN":
+            await self.session_token(conn, args)
+        elif command == "SUBFOLDER":
+            await self.sub_folder(conn, args[0], args[1])
+        elif command == "CD":
+            await self.change_directory(conn, args[0])
+        else:
+            await conn.send_message("Invalid command.\n", STATUS_ERROR)
+
+    # Function to hand out or revoke session tokens
+    async def session_token(self, conn, args):
+        """TOKEN replies "<token> <seconds valid>"; TOKEN REVOKE <token> ends one of the user's tokens."""
+        username = self.client_users[conn]
+        if not args:
+            await conn.send_message(f"{self.tokens.issue(username)} {self.tokens.ttl}")
+        elif args[0].upper() == "REVOKE" and len(args) == 2 and self.tokens.check(args[1]) == username:
+            self.tokens.revoke(args[1])
+            await conn.send_message("Token revoked.\n")
+        else:
+            await conn.send_message("Unknown token.\n" if args[0].upper() == "REVOKE"
+                                    else "Usage: TOKEN [REVOKE token]\n", STATUS_ERROR)
+
+    async def client_path(self, conn, name):
+        """FileServer.client_path: the path a client names, or None after telling it the name is invalid."""
+        path = storage_path(self.current_client_dir[conn], name, self.storage_root)
+        if path is None or path == self.storage_root:
+            await conn.send_message("Invalid file name.\n", STATUS_ERROR)
+            return None
+        return path
+
+    # Function to upload file
+    async def upload_file(self, conn, filename, offset=0, algorithm=DEFAULT_HASH):
+        """Handles file upload from client, locked and spooled like FileServer.receive_file.
+        A non-zero offset resumes a partial upload."""
+        filepath = await self.client_path(conn, filename)
+        if filepath is None:
+            return
+        if not await self.check_algorithm(conn, algorithm):
+            return
+        directory = os.path.dirname(filepath)
+        async with self.locks.shared(directory):
+            if not await self.run_io(os.path.isdir, directory):
+                await conn.send_message("Folder not found.\n", STATUS_ERROR)
+                return
+            exists = await self.run_io(os.path.exists, filepath)
+        if exists:
+            response = (await conn.prompt("File exists. Overwrite? (y/n): ")).strip().lower()
+            if response != 'y':
+                await conn.send_message("Upload cancelled.\n", STATUS_ERROR)
+                return
+        partial = self.partial_upload(filepath, algorithm)
+        if offset:
+            committed = await self.run_io(partial.committed)
+            if committed is None or committed[0] != offset:
+                await conn.send_message("No partial upload at that offset.\n", STATUS_ERROR)
+                return
+        await conn.send_message("Ready to receive file.\n")
+        start_time = self.logger.start_timer()
+        # Uploads of one name share the partial file, so they take turns; nothing else waits for the body
+        async with self.locks.alone(partial.part_path):
+            await self.run_io(partial.open, offset)
+            try:
+                file_size, first_byte_at = await conn.recv_file(partial)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                await self.run_io(partial.abort)
+                raise
+            async with self.locks.exclusive(filepath):
+                if not await self.run_io(os.path.isdir, directory):
+                    await self.run_io(partial.discard)  # deleted while the body was on its way
+                    await conn.send_trailer("Upload failed: folder not found.\n", STATUS_ERROR)
+                    return
+                await self.run_io(partial.finish)
+                self.dir_cache.invalidate(directory)
+                digest = partial.hasher.hexdigest()
+                await self.run_io(self.hash_cache.put, filepath, partial.algorithm, digest)
+        elapsed_time = time.time() - start_time
+
+        response_message = f"File uploaded of size {format_size(file_size)} successfully in {elapsed_time:.3f} seconds!\n"
+        await conn.send_trailer(response_message, size=file_size, offset=offset, elapsed=elapsed_time,
+                                algorithm=algorithm, digest=digest)
+        self.logger.end_timer(
+            start_time=start_time,
+            operation="UPLOAD",
+            filename=filename,
+            file_size=file_size,
+            elapsed_time=elapsed_time,
+            response_time=first_byte_at - start_time
+        )
+
+    def partial_upload(self, filepath, algorithm=DEFAULT_HASH):
+        """The PartialUpload of a file, spooled in the storage root as on the threaded server."""
+        return PartialUpload(filepath, algorithm, os.path.join(self.storage_root, UPLOAD_SPOOL))
+
+    # Function to report how far a partial upload got
+    async def upload_offset(self, conn, filename):
+        """Handles OFFSET: reply "<offset> <algorithm> <digest of those bytes>" for a partial upload."""
+        filepath = await self.client_path(conn, filename)
+        if filepath is None:
+            return
+        committed = await self.run_io(self.partial_upload(filepath).committed)
+        if committed is None:
+            await conn.send_message("No partial upload.\n", STATUS_ERROR)
+            return
+        await conn.send_message(" ".join(str(field) for field in committed))
+
+    async def check_algorithm(self, conn, algorithm):
+        if algorithm in HASH_ALGORITHMS:
+            return True
+        await conn.send_message(f"Unknown hash algorithm. Use one of: {', '.join(HASH_ALGORITHMS)}\n", STATUS_ERROR)
+        return False
+
+    # Function to download file
+    async def download_file(self, conn, filename, offset=0, algorithm=DEFAULT_HASH):
+        """Handles file download to client, starting at `offset` to resume an interrupted one."""
+        filepath = await self.client_path(conn, filename)
+        if filepath is None:
+            return
+        # Held until the body is out, so an upload or delete of the file waits instead of tearing it
+        async with self.locks.shared(filepath):
+            if not await self.run_io(os.path.isfile, filepath):
+                await conn.send_message("File not found.\n", STATUS_ERROR)
+                return
+            if not await self.check_algorithm(conn, algorithm):
+                return
+
+            file_size = await self.run_io(os.path.getsize, filepath)
+            if offset < 0 or offset > file_size:
+                await conn.send_message("Offset is past the end of the file.\n", STATUS_ERROR)
+                return
+            # The body goes out with loop.sendfile and is never seen, so a fresh download only reports a
+            # cached digest; a resumed one cannot be checked without it and has the file hashed first
+            digest = await self.run_io(self.hash_cache.get, filepath, algorithm)
+            if digest is None and offset:
+                digest = await self.run_io(self.hash_whole_file, filepath, algorithm)
+            start_time = self.logger.start_timer()
+            await conn.send_message("Ready to send file.")
+            f = await self.run_io(open, filepath, 'rb')
+            try:
+                await self.run_io(f.seek, offset)
+                await conn.send_file(f, file_size - offset)
+            finally:
+                await self.run_io(f.close)
+        file_size -= offset
+        elapsed_time = time.time() - start_time
+
+        self.logger.end_timer(
+            start_time=start_time,
+            operation="DOWNLOAD",
+            filename=filename,
+            file_size=file_size,
+            elapsed_time=elapsed_time,
+            response_time=elapsed_time
+        )
+        response_message = f"File downloaded of size {format_size(file_size)} successfully in {elapsed_time:.3f} seconds!\n"
+        stats = {"algorithm": algorithm, "digest": digest} if digest else {}
+        await conn.send_trailer(response_message, size=file_size, offset=offset, elapsed=elapsed_time, **stats)
+
+    def hash_whole_file(self, filepath, algorithm):
+        """Digest of a stored file, computed and cached (runs on the executor)."""
+        stat = os.stat(filepath)
+        with open(filepath, 'rb') as f:
+            digest = hash_file(f, new_hasher(algorithm), chunk_size=self.chunk_size).hexdigest()
+        self.hash_cache.put(filepath, algorithm, digest, stat)
+        return digest
+
+    # Function to delete file
+    async def delete_file(self, conn, filename):
+        """Handles file deletion"""
+        filepath = await self.client_path(conn, filename)
+        if filepath is None:
+            return
+        async with self.locks.exclusive(filepath):
+            if not await self.run_io(os.path.isfile, filepath):
+                await conn.send_message("File not found.\n", STATUS_ERROR)
+                return
+            await self.run_io(os.remove, filepath)
+            self.dir_cache.invalidate(os.path.dirname(filepath))
+        await conn.send_message("File deleted successfully.\n")
+
+    # Function to list files
+    async def list_files(self, conn, args=()):
+        """Handles DIR like FileServer.list_files; scanning and sorting run on the executor."""
+        try:
+            options = parse_dir_options(args)
+        except ValueError as e:
+            await conn.send_message(f"{e}\n", STATUS_ERROR)
+            return
+        offset, limit = options.pop("offset"), options.pop("limit")
+        directory = self.current_client_dir[conn]
+        async with self.locks.shared(directory):
+            if not await self.run_io(os.path.isdir, directory):
+                await conn.send_message("Folder not found.\n", STATUS_ERROR)
+                return
+            listing = await self.run_io(self.dir_cache.listing, directory)
+        total, count, pages = await self.run_io(lambda: listing.pages(offset, limit, **options))
+        for page in pages:
+            await conn.send_list(page)
+        await conn.send_trailer(f"{count} of {total} entries.\n", total=total, offset=offset, count=count,
+                                next=offset + count if offset + count < total else None)
+
+    async def sub_folder(self, conn, command, path):
+        """Create or delete a sub folder."""
+        path = storage_path(self.storage_root, path.lower(), self.storage_root)
+        if path is None or path == self.storage_root:
+            await conn.send_message("Invalid folder name.\n", STATUS_ERROR)
+            return
+        if command == 'CREATE':
+            async with self.locks.exclusive(path):
+                if await self.run_io(os.path.exists, path):
+                    await conn.send_message("Folder already exists!\n", STATUS_ERROR)
+                    return
+                if not await self.run_io(os.path.isdir, os.path.dirname(path)):
+                    await conn.send_message("Parent folder not found.\n", STATUS_ERROR)
+                    return
+                await self.run_io(os.mkdir, path)
+                self.dir_cache.invalidate_tree(path)
+            await conn.send_message("Folder created successfully.\n")
+        elif command == 'DELETE':
+            # Waits for the operations inside the folder; uploads still receiving a body fail at their rename
+            async with self.locks.exclusive(path):
+                if not await self.run_io(os.path.isdir, path):
+                    await conn.send_message("Folder not found.\n", STATUS_ERROR)
+                    return
+                await self.run_io(shutil.rmtree, path)
+                self.dir_cache.invalidate_tree(path)
+            await conn.send_message("Folder deleted successfully.\n")
+
+    async def change_directory(self, conn, directory):
+        filepath = self.current_client_dir[conn]
+        directory = directory.lower()
+        if directory == "..":
+            if filepath == self.storage_root:
+                await conn.send_message("You are already at the root directory!\n", STATUS_ERROR)
+            else:
+                new_path = os.path.dirname(filepath)
+                self.current_client_dir[conn] = new_path
+                await conn.send_message("File path changed to: " + new_path + "\n")
+        else:
+            filepath = os.path.join(filepath, directory)
+            if await self.run_io(os.path.exists, filepath):
+                self.current_client_dir[conn] = filepath
+                await conn.send_message("File path changed to: " + filepath + "\n")
+            else:
+                await conn.send_message("File path not found.\n", STATUS_ERROR)
@@ -0,0 +1,161 @@
+## Accounts and session tokens: salted password hashes checked in constant time
+
+# import libraries
+import functools
+import getpass
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+
+ITERATIONS = 100_000  # PBKDF2 rounds per stored hash, about 50 ms per password login
+TOKEN_TTL = 3600  # seconds a session token stays valid after it was issued
+DEFAULT_USERS = {"user": "pass"}  # the account the server has always accepted
+
+
+def client_hash(password):
+    """What a client sends instead of its password: the SHA-256 hex digest of it."""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def make_record(password_hash, iterations=ITERATIONS):
+    """The stored form of a password: a random salt and PBKDF2-SHA256 of the client's hash."""
+    salt = os.urandom(16)
+    derived = hashlib.pbkdf2_hmac("sha256", password_hash.encode(), salt, iterations)
+    return {"salt": salt.hex(), "iterations": iterations, "hash": derived.hex()}
+
+
+def check_record(record, password_hash):
+    """Whether password_hash matches a stored record, compared in constant time."""
+    derived = hashlib.pbkdf2_hmac("sha256", password_hash.encode(), bytes.fromhex(record["salt"]),
+                                  record["iterations"])
+    return hmac.compare_digest(derived, bytes.fromhex(record["hash"]))
+
+
+@functools.lru_cache(maxsize=1)
+def dummy_record():
+    # Checked for unknown users, so they take as long as a wrong password
+    return make_record(secrets.token_hex(32))
+
+
+class UserStore:
+    """Where the server looks up accounts. Subclasses implement lookup();
+    any object with a verify(username, password_hash) method can stand in."""
+
+    def lookup(self, username):
+        """The stored record of username (see make_record), or None."""
+        raise NotImplementedError
+
+    def verify(self, username, password_hash):
+        record = self.lookup(username)
+        matches = check_record(record or dummy_record(), password_hash)
+        return matches and record is not None
+
+
+class MemoryUserStore(UserStore):
+    """Accounts kept in memory, e.g. for tests or the default account."""
+
+    def __init__(self, users=None):
+        self.lock = threading.Lock()
+        self.records = {}  # username -> record
+        for username, password in (users or {}).items():
+            self.add_user(username, password)
+
+    def lookup(self, username):
+        with self.lock:
+            return self.records.get(username)
+
+    def add_user(self, username, password):
+        """Create or change an account; the password is only kept as a salted hash."""
+        record = make_record(client_hash(password))
+        with self.lock:
+            self.records[username] = record
+
+    def remove_user(self, username):
+        with self.lock:
+            return self.records.pop(username, None) is not None
+
+
+class JsonUserStore(MemoryUserStore):
+    """Accounts in a JSON file {username: record}, rewritten atomically on every change."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        try:
+            with open(path) as f:
+                self.records = json.load(f)
+        except FileNotFoundError:
+            pass
+
+    def add_user(self, username, password):
+        super().add_user(username, password)
+        self.save()
+
+    def remove_user(self, username):
+        removed = super().remove_user(username)
+        self.save()
+        return removed
+
+    def save(self):
+        with self.lock:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.records, f, indent=1)
+            os.replace(temp_path, self.path)
+
+
+class SessionTokens:
+    """Tokens handed out after a login, so a client can reconnect without its password.
+
+    A token is random and only its SHA-256 is kept, so looking one up leaks
+    nothing useful through timing and a memory dump holds no usable tokens.
+    Tokens expire `ttl` seconds after they were issued and are forgotten then.
+    """
+
+    def __init__(self, ttl=TOKEN_TTL):
+        self.ttl = ttl
+        self.tokens = {}  # sha256 of token -> (username, expiry time)
+        self.lock = threading.Lock()
+
+    def issue(self, username):
+        token = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self.lock:
+            for key in [key for key, (_, expires) in self.tokens.items() if expires <= now]:
+                del self.tokens[key]
+            self.tokens[self.key(token)] = (username, now + self.ttl)
+        return token
+
+    def check(self, token):
+        """The username a valid token was issued to, or None."""
+        with self.lock:
+            entry = self.tokens.get(self.key(token))
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def revoke(self, token):
+        with self.lock:
+            return self.tokens.pop(self.key(token), None) is not None
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+
+# Manage a user file: python auth.py users.json alice [--remove]
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python auth.py {users.json} {username} [--remove]")
+        sys.exit(1)
+    store = JsonUserStore(sys.argv[1])
+    if "--remove" in sys.argv[3:]:
+        print("User removed." if store.remove_user(sys.argv[2]) else "No such user.")
+    else:
+        store.add_user(sys.argv[2], getpass.getpass("Password: "))
+        print("User saved.")
@@ -0,0 +1,158 @@
+## Token-bucket bandwidth shaping: per session, per user and for the whole server
+
+# import libraries
+import threading
+import time
+
+SCOPES = ("global", "user", "session")
+BURST_SECONDS = 0.05  # a bucket holds this much of its rate, so short bursts go out at full speed
+SLICE_SECONDS = 0.02  # a transfer asks for at most this much of its tightest rate at a time
+MIN_SLICE = 4096  # ...but never for less than this many bytes
+UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_rate(text):
+    """Parse a rate in bytes/s like "500K", "10M" or "1.5G"; "off", "none" and "0" mean unlimited (None)."""
+    text = text.strip().lower().removesuffix("/s").removesuffix("b")
+    if text in ("off", "none", "0", ""):
+        return None
+    unit = text[-1] if text[-1] in UNITS else ""
+    try:
+        rate = float(text[:len(text) - len(unit)]) * UNITS[unit]
+    except ValueError:
+        rate = 0
+    if not 0 < rate < float("inf"):
+        raise ValueError(f"Invalid rate {text}, expected bytes/s like 500K or 10M")
+    return rate
+
+
+def format_rate(rate):
+    if rate is None:
+        return "off"
+    for unit in ("G", "M", "K"):
+        if rate >= UNITS[unit.lower()]:
+            return f"{rate / UNITS[unit.lower()]:.2f} {unit}B/s"
+    return f"{rate:.0f} B/s"
+
+
+class TokenBucket:
+    """A token bucket of `rate` bytes/s that holds at most BURST_SECONDS of tokens.
+
+    Kept as a virtual clock instead of a token count: `ready_at` is the time the
+    bytes handed out so far are paid for. reserve() books the next bytes after
+    them and says when they may go, so nobody sleeps under the lock and
+    reservations are served strictly in the order they were made.
+    """
+
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.rate = None
+        self.ready_at = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Change the rate (None for unlimited); bytes booked from now on pay the new rate."""
+        with self.lock:
+            self.rate = rate
+            self.ready_at = min(self.ready_at, time.monotonic())
+
+    def reserve(self, n, not_before):
+        """Book n bytes that cannot go before `not_before` and return the time they may be sent."""
+        with self.lock:
+            if self.rate is None:
+                return not_before
+            send_at = max(not_before, self.ready_at - BURST_SECONDS)  # up to a burst may be owed
+            self.ready_at = max(self.ready_at, send_at) + n / self.rate
+            return send_at
+
+
+class Throttle:
+    """Paces the transfers of one session through its session, user and global buckets.
+
+    Connections call it as throttle(n) before moving up to n bytes; it returns how
+    many of them may go now, having slept as long as the buckets require. Each
+    call asks for one slice, so every active transfer waits its turn in the
+    buckets it shares with others: that is what shares them fairly.
+    """
+
+    def __init__(self, shaper, username, session_bucket, user_bucket):
+        self.shaper = shaper
+        self.username = username
+        self.buckets = (session_bucket, user_bucket, shaper.global_bucket)
+
+    def __call__(self, n):
+        rates = [bucket.rate for bucket in self.buckets if bucket.rate is not None]
+        if not rates:
+            return n
+        n = min(n, max(MIN_SLICE, int(min(rates) * SLICE_SECONDS)))
+        now = time.monotonic()
+        at = now
+        for bucket in self.buckets:  # narrowest first, so wider buckets book the bytes when they really go
+            at = bucket.reserve(n, at)
+        if at > now:
+            time.sleep(at - now)
+            self.shaper.add_wait(at - now)
+        return n
+
+
+class BandwidthShaper:
+    """The buckets of a server: one global, one per user and one per session.
+
+    Rates are bytes/s or None for unlimited and can be changed at any time with
+    set_rate(); buckets of sessions already open change with them. Only file data
+    is paced: commands, prompts and listings never queue behind bulk transfers.
+    """
+
+    def __init__(self, rate=None, user_rate=None, session_rate=None):
+        self.rates = {"global": rate, "user": user_rate, "session": session_rate}
+        self.global_bucket = TokenBucket(rate)
+        self.users = {}  # username -> [TokenBucket, open sessions]
+        self.sessions = set()  # open Throttles
+        self.lock = threading.Lock()
+        self.waited = 0.0  # seconds transfers spent sleeping, over all sessions
+
+    def open_session(self, username):
+        """Return the Throttle of a new session of `username`."""
+        with self.lock:
+            user = self.users.get(username)
+            if user is None:
+                user = self.users[username] = [TokenBucket(self.rates["user"]), 0]
+            user[1] += 1
+            throttle = Throttle(self, username, TokenBucket(self.rates["session"]), user[0])
+            self.sessions.add(throttle)
+        return throttle
+
+    def close_session(self, throttle):
+        with self.lock:
+            self.sessions.discard(throttle)
+            user = self.users[throttle.username]
+            user[1] -= 1
+            if user[1] == 0:
+                del self.users[throttle.username]
+
+    def set_rate(self, scope, rate):
+        """Set the limit of a scope ("global", "user" or "session"), applied to every bucket of that scope."""
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown scope {scope}, expected one of {', '.join(SCOPES)}")
+        with self.lock:
+            self.rates[scope] = rate
+            if scope == "global":
+                buckets = [self.global_bucket]
+            elif scope == "user":
+                buckets = [bucket for bucket, _ in self.users.values()]
+            else:
+                buckets = [throttle.buckets[0] for throttle in self.sessions]
+        for bucket in buckets:
+            bucket.set_rate(rate)
+
+    def add_wait(self, seconds):
+        with self.lock:
+            self.waited += seconds
+
+    def describe(self):
+        """One line per scope with its limit, then who is being shaped."""
+        with self.lock:
+            lines = [f"{scope:<8} {format_rate(self.rates[scope])}" for scope in SCOPES]
+            lines.append(f"{len(self.sessions)} session(s) of {len(self.users)} user(s), "
+                         f"{self.waited:.1f} s spent waiting for bandwidth")
+        return "\n".join(lines) + "\n"
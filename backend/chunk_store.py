@@ -0,0 +1,249 @@
+## Content-addressed chunk store: every distinct chunk is kept once, files become manifests
+
+# import libraries
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from chunking import MAX_CHUNK
+
+# First line of a stored file that is a manifest rather than plain data
+MANIFEST_MAGIC = b"FSMANIFEST1\n"
+DIGEST = re.compile(r"[0-9a-f]{64}")  # chunk names are SHA-256 hex digests and nothing else
+
+
+def check_chunks(chunks):
+    """Raise ValueError unless chunks is a list of [sha256 hex digest, size up to MAX_CHUNK] pairs.
+
+    Digests become file names in the store, so one like "../secret" must never get that far.
+    """
+    if not isinstance(chunks, list):
+        raise ValueError("Chunk list expected")
+    for chunk in chunks:
+        if not isinstance(chunk, list) or len(chunk) != 2:
+            raise ValueError("Chunks must be [digest, size] pairs")
+        digest, size = chunk
+        if not isinstance(digest, str) or not DIGEST.fullmatch(digest):
+            raise ValueError("Invalid chunk digest")
+        if type(size) is not int or size < 0 or size > MAX_CHUNK:
+            raise ValueError("Invalid chunk size")
+
+
+class ChunkStore:
+    """Chunks live in <root>/.chunks/<first two hex digits>/<sha256>.
+
+    A logical file that was uploaded deduplicated is a small manifest at its usual
+    path listing its chunks, so DIR, CD and SUBFOLDER see it like any other file.
+    Every chunk keeps a reference count (one per occurrence in a manifest), and a
+    chunk is deleted as soon as no manifest uses it any more.
+
+    The counts are saved in refs.json. If that file is missing or unreadable they
+    are counted again from the manifests under `roots` (all storage roots, default
+    just `root`) before any chunk is collected, so losing it never loses chunks.
+    """
+
+    def __init__(self, root="server_storage", roots=None):
+        self.chunk_dir = os.path.join(root, ".chunks")
+        self.refs_path = os.path.join(self.chunk_dir, "refs.json")
+        self.lock = threading.Lock()
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        try:
+            with open(self.refs_path) as f:
+                self.refs = json.load(f)
+            if not isinstance(self.refs, dict):
+                raise ValueError("refs.json is not an object")
+        except (OSError, ValueError):
+            self.refs = self.count_refs(roots or [root])
+            self._save_refs()
+        self.collect_garbage()
+
+    def chunk_path(self, digest):
+        if not isinstance(digest, str) or not DIGEST.fullmatch(digest):
+            raise ValueError("Invalid chunk digest")
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    # Chunks
+    def missing(self, digests):
+        """Return the digests (in order, without repeats) that are not stored yet."""
+        result = []
+        seen = set()
+        for digest in digests:
+            if digest not in seen and not os.path.exists(self.chunk_path(digest)):
+                result.append(digest)
+            seen.add(digest)
+        return result
+
+    def put(self, digest, data):
+        """Store one chunk after checking that its content matches its name."""
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest[:12]} does not match its hash")
+        path = self.chunk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    # Manifests
+    def is_manifest(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(MANIFEST_MAGIC)) == MANIFEST_MAGIC
+        except OSError:
+            return False
+
+    def read_manifest(self, path):
+        """Return {"size": ..., "chunks": [[digest, size], ...]} or None for a plain file."""
+        with open(path, 'rb') as f:
+            if f.read(len(MANIFEST_MAGIC)) != MANIFEST_MAGIC:
+                return None
+            return json.loads(f.read())
+
+    def write_manifest(self, path, chunks):
+        """Make `path` the manifest of the given [digest, size] chunks, taking references on them.
+
+        Raises ValueError if a chunk is malformed or its size is not the stored chunk's.
+        """
+        check_chunks(chunks)
+        manifest = {"size": sum(size for _, size in chunks), "chunks": chunks}
+        with self.lock:
+            # A concurrent delete may have collected a chunk we were told exists
+            for digest, size in chunks:
+                try:
+                    stored_size = os.path.getsize(self.chunk_path(digest))
+                except FileNotFoundError:
+                    raise FileNotFoundError(f"Chunk {digest[:12]} is missing") from None
+                if stored_size != size:
+                    raise ValueError(f"Chunk {digest[:12]} is {stored_size} bytes, not {size}")
+            for digest, _ in chunks:
+                self.refs[digest] = self.refs.get(digest, 0) + 1
+            # Saved before the manifest exists: after a crash a chunk may be counted once too often, never too few
+            self._save_refs()
+            old = self.read_manifest(path) if os.path.exists(path) else None
+            # Hidden, so neither DIR nor a rebalance of the storage roots picks it up halfway
+            temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{threading.get_ident()}.tmp")
+            with open(temp_path, 'wb') as f:
+                f.write(MANIFEST_MAGIC + json.dumps(manifest).encode())
+            os.replace(temp_path, path)
+            if old is not None:
+                self._release(old)
+            self._save_refs()
+        return manifest
+
+    def release(self, path):
+        """Drop the references held by `path` if it is a manifest (before it is deleted or replaced)."""
+        if not os.path.isfile(path):
+            return
+        with self.lock:
+            manifest = self.read_manifest(path)
+            if manifest is not None:
+                self._release(manifest)
+                self._save_refs()
+
+    def release_tree(self, directory):
+        """Drop the references of every manifest below a folder that is about to be removed."""
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                self.release(os.path.join(dirpath, filename))
+
+    def open_manifest(self, manifest, offset=0):
+        return ManifestReader(self, manifest["chunks"], offset)
+
+    # Reference counting
+    def _release(self, manifest):
+        for digest, _ in manifest["chunks"]:
+            if not isinstance(digest, str) or not DIGEST.fullmatch(digest):
+                continue  # written before digests were checked; never names a file
+            count = self.refs.get(digest, 0) - 1
+            if count > 0:
+                self.refs[digest] = count
+            else:
+                self.refs.pop(digest, None)
+                try:
+                    os.remove(self.chunk_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def _save_refs(self):
+        temp_path = self.refs_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.refs, f)
+        os.replace(temp_path, self.refs_path)
+
+    def count_refs(self, roots):
+        """Count the chunk references of every manifest stored below the roots."""
+        refs = {}
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [name for name in dirnames if not name.startswith(".")]  # the chunks themselves, spools
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    if filename.startswith(".") or not self.is_manifest(path):
+                        continue
+                    try:
+                        manifest = self.read_manifest(path)
+                    except (OSError, ValueError):
+                        continue
+                    for digest, _ in manifest["chunks"]:
+                        if isinstance(digest, str) and DIGEST.fullmatch(digest):
+                            refs[digest] = refs.get(digest, 0) + 1
+        return refs
+
+    def collect_garbage(self):
+        """Remove chunks that no manifest references, e.g. left by an upload that never finished."""
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.chunk_dir):
+            for filename in filenames:
+                if dirpath != self.chunk_dir and filename not in self.refs:
+                    os.remove(os.path.join(dirpath, filename))
+                    removed += 1
+        return removed
+
+
+class ManifestReader:
+    """Read-only file object that stitches the chunks of a manifest back together."""
+
+    def __init__(self, store, chunks, offset=0):
+        self.store = store
+        self.chunks = list(chunks)
+        self.index = 0
+        self.current = None
+        # Skip whole chunks before the start offset
+        while self.index < len(self.chunks) and offset >= self.chunks[self.index][1]:
+            offset -= self.chunks[self.index][1]
+            self.index += 1
+        self.skip = offset
+
+    def readinto(self, view):
+        while True:
+            if self.current is None:
+                if self.index >= len(self.chunks):
+                    return 0
+                self.current = open(self.store.chunk_path(self.chunks[self.index][0]), 'rb')
+                self.current.seek(self.skip)
+                self.skip = 0
+            n = self.current.readinto(view)
+            if n:
+                return n
+            self.current.close()
+            self.current = None
+            self.index += 1
+
+    def read(self, size):
+        buffer = bytearray(size)
+        n = self.readinto(memoryview(buffer))
+        return bytes(buffer[:n])
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
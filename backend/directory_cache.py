@@ -0,0 +1,287 @@
+## Cached directory listings for DIR: scanned once with os.scandir, served in pages
+
+# import libraries
+import fnmatch
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+SORT_KEYS = ("name", "size", "mtime", "none")  # "none" keeps the order the file system returned
+KINDS = {"file": 0, "dir": 1}
+PAGE_SIZE = 1000  # entries per OP_LIST frame
+SCAN_BATCH = 1000  # entries a scan yields at a time, so the first page can go out before it ends
+MAX_VIEWS = 8  # sorted/filtered orders kept per listing
+
+
+def parse_dir_options(args):
+    """Parse DIR's key=value options: sort, order (asc/desc), match (glob), type (file/dir), offset, limit.
+
+    Returns a dict of them, with offset and limit alongside the view arguments of
+    Listing.view; raises ValueError for anything unknown or malformed.
+    """
+    options = {"sort": "name", "reverse": False, "match": None, "kind": None, "offset": 0, "limit": None}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        key = key.lower()
+        if not sep:
+            raise ValueError(f"Expected key=value, got {arg}")
+        if key == "sort" and value in SORT_KEYS:
+            options["sort"] = value
+        elif key == "order" and value in ("asc", "desc"):
+            options["reverse"] = value == "desc"
+        elif key == "match":
+            options["match"] = value
+        elif key == "type" and value in KINDS:
+            options["kind"] = value
+        elif key in ("offset", "limit") and value.isdigit():
+            options[key] = int(value)
+        else:
+            raise ValueError(f"Invalid DIR option {arg}")
+    return options
+
+
+def window(total, offset, limit):
+    """Number of entries a page request at offset with at most limit entries gets out of total."""
+    end = total if limit is None else min(total, offset + limit)
+    return max(0, end - offset)
+
+
+class Listing:
+    """One scan of a directory, stored as columns: 1M entries take ~90 MB instead of ~280 MB as dicts."""
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version  # st_mtime_ns of the directory (in every storage root) when the scan started
+        self.names = []
+        self.kinds = bytearray()  # KINDS values
+        self.sizes = array("q")
+        self.mtimes = array("d")
+        self.views = OrderedDict()  # (sort, reverse, match, kind) -> array of entry indexes
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def entry(self, i):
+        """[name, "f" or "d", size, mtime] as sent to the client."""
+        return [self.names[i], "d" if self.kinds[i] else "f", self.sizes[i], self.mtimes[i]]
+
+    def view(self, sort="name", reverse=False, match=None, kind=None):
+        """Entry indexes in the requested order, or None for all entries in scan order."""
+        if sort == "none" and not reverse and match is None and kind is None:
+            return None
+        key = (sort, reverse, match, kind)
+        with self.lock:
+            order = self.views.get(key)
+            if order is not None:
+                self.views.move_to_end(key)
+                return order
+        if sort == "none":
+            order = range(len(self))
+        elif key != (sort, False, None, None):
+            order = self.view(sort)  # filtered and reversed views start from the cached sort
+        else:
+            column = {"name": self.names, "size": self.sizes, "mtime": self.mtimes}[sort]
+            order = sorted(range(len(self)), key=column.__getitem__)
+        if reverse:
+            order = order[::-1]
+        if kind is not None:
+            kinds = self.kinds
+            wanted = KINDS[kind]
+            order = [i for i in order if kinds[i] == wanted]
+        if match is not None:
+            names = self.names
+            matches = re.compile(fnmatch.translate(match)).match
+            order = [i for i in order if matches(names[i])]
+        order = array("q", order)
+        with self.lock:
+            self.views[key] = order
+            while len(self.views) > MAX_VIEWS:
+                self.views.popitem(last=False)
+        return order
+
+    def pages(self, offset=0, limit=None, **view):
+        """Return (total, count, pages): the size of a view and PAGE_SIZE entry lists of one window of it."""
+        order = self.view(**view)
+        total = len(self) if order is None else len(order)
+        count = window(total, offset, limit)
+        indexes = range(offset, offset + count) if order is None else order[offset:offset + count]
+
+        def generate():
+            for start in range(0, count, PAGE_SIZE):
+                yield [self.entry(i) for i in indexes[start:start + PAGE_SIZE]]
+        return total, count, generate()
+
+
+class DirectoryCache:
+    """Listings of recently listed directories.
+
+    A listing is used while the directory's mtime is unchanged, which catches
+    entries added or removed behind the server's back. Handlers that change a
+    directory also call invalidate(), since file systems with coarse timestamps
+    can miss two changes within one tick and a file rewritten in place does not
+    touch the directory's mtime at all.
+
+    With several storage roots, mirrors(path) returns the directory in every root,
+    the primary one first. A listing then merges them and is cached under the
+    primary path, whichever root's path it is asked for.
+    """
+
+    def __init__(self, max_dirs=64, size_of=None, mirrors=None):
+        self.max_dirs = max_dirs
+        self.size_of = size_of  # optional size_of(path) for files whose logical size is not st_size
+        self.mirrors = mirrors
+        self.listings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def folders(self, path):
+        """The directories making up the listing of path; the first is its cache key."""
+        path = os.path.normpath(path)
+        return [path] if self.mirrors is None else self.mirrors(path)
+
+    @staticmethod
+    def version(folders):
+        """The mtimes of a listing's directories. The first must exist, the others may not yet."""
+        version = [os.stat(folders[0]).st_mtime_ns]
+        for folder in folders[1:]:
+            try:
+                version.append(os.stat(folder).st_mtime_ns)
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    def get(self, path):
+        """Return the cached Listing of a directory, or None if it is missing or stale."""
+        folders = self.folders(path)
+        path = folders[0]
+        with self.lock:
+            listing = self.listings.get(path)
+        if listing is None:
+            return None
+        try:
+            if self.version(folders) != listing.version:
+                raise FileNotFoundError
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+        with self.lock:
+            if path in self.listings:
+                self.listings.move_to_end(path)
+        return listing
+
+    def listing(self, path, on_batch=None):
+        """Return a Listing of a directory, scanning it if needed. See scan() for on_batch."""
+        listing = self.get(path)
+        if listing is None:
+            listing = self.scan(path, on_batch)
+        elif on_batch is not None:
+            for start in range(0, len(listing), SCAN_BATCH):
+                on_batch([listing.entry(i) for i in range(start, min(start + SCAN_BATCH, len(listing)))])
+        return listing
+
+    def scan(self, path, on_batch=None):
+        """Scan a directory into a new Listing and cache it unless the directory changed meanwhile.
+
+        on_batch(entries) is called with every SCAN_BATCH [name, kind, size, mtime]
+        entries as they are read, so a caller can send them before the scan ends.
+        A folder, which exists in every storage root, is listed once.
+        """
+        folders = self.folders(path)
+        path = folders[0]
+        listing = Listing(path, self.version(folders))
+        size_of = self.size_of
+        seen = set() if len(folders) > 1 else None
+        first = 0
+        for folder in folders:
+            try:
+                entries = os.scandir(folder)
+            except FileNotFoundError:  # a root that does not have the folder yet
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.startswith("."):  # partial uploads, journals, caches
+                        continue
+                    if seen is not None and entry.name in seen:
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                        stat = entry.stat()
+                    except FileNotFoundError:  # deleted (or moved to another root) while we scanned
+                        continue
+                    if seen is not None:
+                        seen.add(entry.name)
+                    size = 0 if is_dir else stat.st_size if size_of is None else size_of(entry.path)
+                    listing.names.append(entry.name)
+                    listing.kinds.append(is_dir)
+                    listing.sizes.append(size)
+                    listing.mtimes.append(stat.st_mtime)
+                    if on_batch is not None and len(listing) - first >= SCAN_BATCH:
+                        on_batch([listing.entry(i) for i in range(first, len(listing))])
+                        first = len(listing)
+        if on_batch is not None and len(listing) > first:
+            on_batch([listing.entry(i) for i in range(first, len(listing))])
+        if self.version(folders) == listing.version:
+            with self.lock:
+                self.listings[path] = listing
+                self.listings.move_to_end(path)
+                while len(self.listings) > self.max_dirs:
+                    self.listings.popitem(last=False)
+        return listing
+
+    def stream(self, path, send_page, offset=0, limit=None, sort="name", reverse=False, match=None, kind=None):
+        """Send a window of a directory listing as pages and return (total, count).
+
+        A cached listing is sorted and filtered from memory. Without one, a request
+        in scan order is answered while the directory is still being read, so the
+        first page of a huge directory goes out after one batch instead of one scan.
+        """
+        listing = self.get(path)
+        if listing is None and sort == "none" and not reverse:
+            wanted = KINDS.get(kind)
+            matches = re.compile(fnmatch.translate(match)).match if match is not None else None
+            seen = [0]  # entries of the view scanned so far
+
+            def send_batch(entries):
+                if wanted is not None:
+                    entries = [e for e in entries if (e[1] == "d") == wanted]
+                if matches is not None:
+                    entries = [e for e in entries if matches(e[0])]
+                start = seen[0]
+                seen[0] += len(entries)
+                end = seen[0] if limit is None else min(seen[0], offset + limit)
+                entries = entries[max(0, offset - start):max(0, end - start)]
+                if entries:
+                    send_page(entries)
+            self.scan(path, send_batch)
+            return seen[0], window(seen[0], offset, limit)
+
+        if listing is None:
+            listing = self.scan(path)
+        total, count, pages = listing.pages(offset, limit, sort=sort, reverse=reverse, match=match, kind=kind)
+        for page in pages:
+            send_page(page)
+        return total, count
+
+    def snapshot(self, path, offset=0, limit=None, **view):
+        """Return (total, count, pages) of a window of a directory listing, see Listing.pages.
+
+        The pages come from a listing that no longer changes, so they can be sent
+        after the caller has let go of the directory.
+        """
+        return self.listing(path).pages(offset, limit, **view)
+
+    def invalidate(self, path):
+        """Forget the listing of a directory, e.g. after a file in it changed."""
+        with self.lock:
+            self.listings.pop(self.folders(path)[0], None)
+
+    def invalidate_tree(self, path):
+        """Forget a directory, everything below it and its parent (after rmtree or mkdir)."""
+        path = self.folders(path)[0]
+        prefix = path + os.sep
+        with self.lock:
+            for cached in [p for p in self.listings if p == path or p.startswith(prefix)]:
+                del self.listings[cached]
+            self.listings.pop(os.path.dirname(path), None)
@@ -0,0 +1,139 @@
+## Hot-file cache: files downloaded again and again are kept in memory and sent from there
+
+# import libraries
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+SEEN_PATHS = 4096  # recently missed paths remembered for admission
+
+
+def parse_size(text):
+    """Parse a size in bytes like "512K", "256M" or "1G"; "0" and "off" give 0."""
+    text = text.strip().lower().removesuffix("b")
+    if text in ("off", "none", ""):
+        return 0
+    unit = text[-1] if text[-1] in UNITS else ""
+    try:
+        size = int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+    except ValueError:
+        size = -1
+    if size < 0:
+        raise ValueError(f"Invalid size {text}, expected bytes like 512K or 256M")
+    return size
+
+
+def map_file(path):
+    """Map a whole file read-only. Pages are read on first use and shared with the page cache.
+
+    Safe because the server never rewrites a stored file in place: uploads go to
+    a temp file that replaces it, and the mapping keeps the old one readable.
+    """
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class FileCache:
+    """Size-bounded LRU of whole files, each kept as one buffer and handed out as a memoryview.
+
+    An entry is keyed by path and only used while the file's mtime and size are
+    unchanged; handlers that replace or delete files also invalidate it. A file
+    is admitted on its second miss among the last SEEN_PATHS, so a single
+    download of a big file does not push the popular ones out, and files above
+    max_file_size are never cached. max_bytes 0 turns the cache off.
+
+    Evicted buffers are only dropped, never closed: a transfer still sending
+    from one keeps it alive until it is done. Hits, misses and evictions are
+    counted in the StatisticsLogger given as `logger`.
+    """
+
+    def __init__(self, max_bytes=0, max_file_size=None, logger=None):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_bytes // 4 if max_file_size is None else max_file_size
+        self.logger = logger
+        self.entries = OrderedDict()  # path -> ((mtime_ns, st_size), memoryview)
+        self.seen = OrderedDict()  # path -> None, paths that missed recently
+        self.size = 0  # bytes held by entries
+        self.lock = threading.Lock()
+
+    def get(self, path, size, load=map_file):
+        """Return a memoryview of a whole stored file, or None if it should be read from disk.
+
+        size is the file's logical size; load(path) returns its contents for
+        files that are not stored as they are sent (default: map the file).
+        """
+        if not 0 < size <= self.max_file_size:
+            return None
+        path = os.path.normpath(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.entries.move_to_end(path)
+                hit = True
+            else:
+                hit = False
+                admit = path in self.seen
+                if admit:
+                    del self.seen[path]
+                else:
+                    self.seen[path] = None
+                    if len(self.seen) > SEEN_PATHS:
+                        self.seen.popitem(last=False)
+        self.count("file_cache_hits" if hit else "file_cache_misses")
+        if hit:
+            return entry[1]
+        if not admit:
+            return None
+
+        # Loaded outside the lock; the key is from before, so a file replaced meanwhile is reloaded next time
+        view = memoryview(load(path))
+        evicted = 0
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[path] = (key, view)
+            self.size += len(view)
+            while self.size > self.max_bytes:
+                _, (_, dropped) = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+                evicted += 1
+        if evicted:
+            self.count("file_cache_evictions", evicted)
+        return view
+
+    def invalidate(self, path):
+        """Forget a file, e.g. after it was replaced or deleted."""
+        with self.lock:
+            entry = self.entries.pop(os.path.normpath(path), None)
+            if entry is not None:
+                self.size -= len(entry[1])
+
+    def invalidate_tree(self, path):
+        """Forget every file below a directory (after rmtree)."""
+        prefix = os.path.normpath(path) + os.sep
+        with self.lock:
+            for cached in [p for p in self.entries if p.startswith(prefix)]:
+                self.size -= len(self.entries.pop(cached)[1])
+
+    def count(self, name, amount=1):
+        if self.logger is not None:
+            self.logger.count(name, amount)
+
+    def describe(self):
+        """One line for STATS, empty when the cache is off."""
+        if not self.max_bytes:
+            return ""
+        counters = self.logger.get_counters() if self.logger is not None else {}
+        with self.lock:
+            files, held = len(self.entries), self.size
+        return (f"file cache {files} files, {held / 2 ** 20:.1f} of {self.max_bytes / 2 ** 20:.0f} MB, "
+                f"hits {counters.get('file_cache_hits', 0)} misses {counters.get('file_cache_misses', 0)} "
+                f"evictions {counters.get('file_cache_evictions', 0)}\n")
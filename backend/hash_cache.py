@@ -0,0 +1,49 @@
+## Persistent cache of file digests so unchanged files are never hashed twice
+
+# import libraries
+import os
+import sqlite3
+import threading
+
+
+class HashCache:
+    """Digests of stored files, keyed by path and algorithm.
+
+    Every entry remembers the size and mtime the file had when it was hashed, and
+    only counts while the file still has them; anything that rewrites a file
+    (upload, stripe commit, dedup manifest) changes its mtime, so stale digests are
+    never served. The cache lives in a small SQLite database that survives restarts.
+    """
+
+    def __init__(self, path="server_storage/.hashes.db"):
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT, algorithm TEXT, size INTEGER,"
+                            " mtime_ns INTEGER, digest TEXT, PRIMARY KEY (path, algorithm))")
+
+    def get(self, path, algorithm):
+        """Return the cached digest of `path`, or None if it is unknown or out of date."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime_ns, digest FROM hashes WHERE path = ? AND algorithm = ?",
+                                  (os.path.normpath(path), algorithm)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return row[2]
+
+    def put(self, path, algorithm, digest, stat=None):
+        """Remember a digest. Pass the os.stat() taken before hashing if the file could change meanwhile."""
+        if stat is None:
+            stat = os.stat(path)
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                            (os.path.normpath(path), algorithm, stat.st_size, stat.st_mtime_ns, digest))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,312 @@
+## Live server metrics: latency histograms, throughput, bytes and sessions
+
+# import libraries
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets are log-linear like HdrHistogram: every power of two is split
+# into 2**SUB_BITS buckets, so any recorded value is off by at most 1/16 (6%)
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_BUCKETS = 64 * SUB_BUCKETS
+
+# Bucket bounds of the Prometheus histograms, in seconds
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                  0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# More distinct commands than this are counted as "OTHER", so junk input cannot grow the tables
+MAX_COMMANDS = 64
+
+# Observations queue up until this many are waiting, then the observer that notices folds them in
+DRAIN_AT = 1024
+
+
+def label(value):
+    """Escape a Prometheus label value; command names come straight from clients."""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def bucket_index(value):
+    """Bucket of a non-negative integer value."""
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_bounds(index):
+    """[low, high) of the values that fall into a bucket."""
+    if index < 2 * SUB_BUCKETS:
+        return index, index + 1
+    shift = index // SUB_BUCKETS - 1
+    low = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+    return low, low + (1 << shift)
+
+
+class Histogram:
+    """Counts values in log-linear buckets; `unit` is the resolution (1e-6 records seconds in microseconds).
+
+    Not thread-safe on its own: Metrics only touches its histograms while holding its drain lock.
+    """
+
+    def __init__(self, unit=1e-6):
+        self.unit = unit
+        self.counts = [0] * MAX_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.record_many((value,))
+
+    def record_many(self, values):
+        """Record a batch of values; bucket_index is inlined since this runs for every observation."""
+        counts = self.counts
+        unit = self.unit
+        last = MAX_BUCKETS - 1
+        direct = 2 * SUB_BUCKETS
+        for value in values:
+            v = int(value / unit)
+            if v < direct:
+                counts[v] += 1
+            else:
+                shift = v.bit_length() - SUB_BITS - 1
+                index = shift * SUB_BUCKETS + (v >> shift)
+                counts[index if index < last else last] += 1
+        self.count += len(values)
+        self.total += sum(values)
+        self.max = max(self.max, max(values))
+
+    def percentile(self, q):
+        """Value below which a fraction q of the recorded values lie (bucket midpoint)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                low, high = bucket_bounds(index)
+                return min((low + high) / 2 * self.unit, self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """Counts of values <= each bound (by bucket upper edge), for Prometheus buckets."""
+        counts = self.counts
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            limit = bound / self.unit
+            while index < MAX_BUCKETS and bucket_bounds(index)[1] <= limit:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class Metrics:
+    """Everything the server measures while it runs.
+
+    Recording a command or transfer only appends a tuple to a deque, which needs no
+    lock. The queued observations are folded into the histograms in batches, by the
+    observer that finds DRAIN_AT of them waiting or by a report, so handler threads
+    never wait on each other to record.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()  # guards the session counters
+        self.drain_lock = threading.Lock()  # guards everything below pending_*
+        self.pending_commands = deque()
+        self.pending_transfers = deque()
+        self.commands = {}  # command -> Histogram of latency in seconds
+        self.errors = {}  # command -> handler exceptions
+        self.ttfb = {}  # transfer operation -> Histogram of time to first byte
+        self.throughput = {}  # transfer operation -> Histogram of bytes/s per transfer
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.wire_bytes_in = 0
+        self.wire_bytes_out = 0
+        self.active_sessions = 0
+        self.peak_sessions = 0
+        self.sessions_total = 0
+
+    # Recording
+    def observe_command(self, command, seconds, failed=False):
+        self.pending_commands.append((command, seconds, failed))
+        if len(self.pending_commands) >= DRAIN_AT:
+            self._help_drain()
+
+    def observe_transfer(self, operation, file_size, wire_size, elapsed_time, response_time):
+        """Called for every logged transfer; uploads count as bytes in, everything else as bytes out."""
+        self.pending_transfers.append((operation, file_size, wire_size, elapsed_time, response_time))
+        if len(self.pending_transfers) >= DRAIN_AT:
+            self._help_drain()
+
+    def session_started(self):
+        with self.lock:
+            self.active_sessions += 1
+            self.sessions_total += 1
+            self.peak_sessions = max(self.peak_sessions, self.active_sessions)
+
+    def session_ended(self):
+        with self.lock:
+            self.active_sessions -= 1
+
+    # Folding queued observations into the histograms
+    def _help_drain(self):
+        if self.drain_lock.acquire(blocking=False):  # somebody else is on it otherwise
+            try:
+                self._drain()
+            finally:
+                self.drain_lock.release()
+
+    def _histogram(self, table, key, unit):
+        histogram = table.get(key)
+        if histogram is None:
+            if len(table) >= MAX_COMMANDS:
+                key = "OTHER"
+            histogram = table.setdefault(key, Histogram(unit))
+        return histogram
+
+    def _drain(self):
+        """Record everything queued so far; the caller holds drain_lock."""
+        pending = self.pending_commands
+        latencies = {}
+        for _ in range(len(pending)):
+            command, seconds, failed = pending.popleft()
+            latencies.setdefault(command, []).append(seconds)
+            if failed:
+                self.errors[command] = self.errors.get(command, 0) + 1
+        for command, values in latencies.items():
+            self._histogram(self.commands, command, 1e-6).record_many(values)
+
+        pending = self.pending_transfers
+        ttfbs = {}
+        rates = {}
+        for _ in range(len(pending)):
+            operation, file_size, wire_size, elapsed_time, response_time = pending.popleft()
+            ttfbs.setdefault(operation, []).append(response_time if response_time > 0 else 0.0)
+            if elapsed_time > 0:
+                rates.setdefault(operation, []).append(file_size / elapsed_time)
+            if operation.startswith("UPLOAD"):
+                self.bytes_in += file_size
+                self.wire_bytes_in += wire_size
+            else:
+                self.bytes_out += file_size
+                self.wire_bytes_out += wire_size
+        for operation, values in ttfbs.items():
+            self._histogram(self.ttfb, operation, 1e-6).record_many(values)
+        for operation, values in rates.items():
+            self._histogram(self.throughput, operation, 1024).record_many(values)
+
+    # Reporting
+    def summary(self):
+        """Human readable report for the STATS command."""
+        with self.drain_lock:
+            self._drain()
+            return self._summary()
+
+    def prometheus(self):
+        """Prometheus text exposition format."""
+        with self.drain_lock:
+            self._drain()
+            return self._prometheus()
+
+    def _summary(self):
+        uptime = time.time() - self.started
+        lines = [f"uptime {uptime:.0f} s, sessions active {self.active_sessions} peak {self.peak_sessions} "
+                 f"total {self.sessions_total}",
+                 f"bytes in {self.bytes_in} (wire {self.wire_bytes_in}), "
+                 f"out {self.bytes_out} (wire {self.wire_bytes_out})",
+                 f"{'command':<16} {'count':>8} {'errors':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for command, histogram in sorted(self.commands.items()):
+            lines.append(f"{command:<16} {histogram.count:>8} {self.errors.get(command, 0):>6} "
+                         + " ".join(f"{histogram.percentile(q) * 1000:9.3f}" for q in (0.5, 0.9, 0.99))
+                         + f" {histogram.max * 1000:9.3f}")
+        for operation, histogram in sorted(self.ttfb.items()):
+            rates = self.throughput.get(operation)
+            line = (f"{operation:<16} first byte p50 {histogram.percentile(0.5) * 1000:.3f} ms "
+                    f"p99 {histogram.percentile(0.99) * 1000:.3f} ms")
+            if rates is not None:
+                line += (f", throughput p50 {rates.percentile(0.5) / 1e6:.1f} MB/s "
+                         f"p99 {rates.percentile(0.99) / 1e6:.1f} MB/s")
+            lines.append(line)
+        return "\n".join(lines) + "\n"
+
+    def _prometheus(self):
+        lines = []
+
+        def histogram_family(name, help_text, label_name, table, bounds):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(table.items()):
+                key = label(key)
+                for bound, count in zip(bounds, histogram.cumulative(bounds)):
+                    lines.append(f'{name}_bucket{{{label_name}="{key}",le="{bound:g}"}} {count}')
+                lines.append(f'{name}_bucket{{{label_name}="{key}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{{label_name}="{key}"}} {histogram.total}')
+                lines.append(f'{name}_count{{{label_name}="{key}"}} {histogram.count}')
+
+        def quantile_family(name, help_text, label_name, table):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, histogram in sorted(table.items()):
+                key = label(key)
+                for q in QUANTILES:
+                    lines.append(f'{name}{{{label_name}="{key}",quantile="{q}"}} {histogram.percentile(q)}')
+
+        def single(name, kind, help_text, value):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+
+        histogram_family("fileserver_command_duration_seconds", "Time to handle a command.", "command",
+                         self.commands, LATENCY_BOUNDS)
+        quantile_family("fileserver_command_duration_quantile_seconds", "Command latency percentiles.", "command",
+                        self.commands)
+        histogram_family("fileserver_first_byte_seconds", "Time to first byte of a transfer.", "operation",
+                         self.ttfb, LATENCY_BOUNDS)
+        quantile_family("fileserver_throughput_quantile_bytes_per_second", "Per-transfer throughput percentiles.",
+                        "operation", self.throughput)
+        lines.append("# HELP fileserver_command_errors_total Commands that ended in an exception.")
+        lines.append("# TYPE fileserver_command_errors_total counter")
+        for command, count in sorted(self.errors.items()):
+            lines.append(f'fileserver_command_errors_total{{command="{label(command)}"}} {count}')
+        single("fileserver_received_bytes_total", "counter", "File bytes uploaded.", self.bytes_in)
+        single("fileserver_sent_bytes_total", "counter", "File bytes downloaded.", self.bytes_out)
+        single("fileserver_received_wire_bytes_total", "counter", "Upload bytes on the wire.", self.wire_bytes_in)
+        single("fileserver_sent_wire_bytes_total", "counter", "Download bytes on the wire.", self.wire_bytes_out)
+        single("fileserver_active_sessions", "gauge", "Connected clients.", self.active_sessions)
+        single("fileserver_peak_sessions", "gauge", "Most clients connected at once.", self.peak_sessions)
+        single("fileserver_sessions_total", "counter", "Clients that connected.", self.sessions_total)
+        single("fileserver_uptime_seconds", "gauge", "Seconds since the server started.", time.time() - self.started)
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    """Serve metrics.prometheus() at http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # scrapes would flood the console
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,108 @@
+## Partial upload journal: uploads land in a hidden .part file until they are complete
+
+# import libraries
+import hashlib
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from transfer import DEFAULT_HASH, new_hasher
+
+# How many bytes may arrive between two journal checkpoints
+CHECKPOINT_INTERVAL = 16 * 1024 * 1024
+
+
+class PartialUpload:
+    """An upload in progress for `filepath`.
+
+    The data goes to ".<name>.part" next to the target and ".<name>.part.json"
+    records how many bytes are committed and their digest, so an interrupted
+    upload can continue where it stopped instead of starting at byte 0. The
+    running digest covers the whole file once the upload is complete.
+
+    With a `spool` folder the two files go there instead, named after the
+    target's path, so nothing is written into the target's folder before the
+    final rename (the spool must be on the same file system as the target).
+    """
+
+    def __init__(self, filepath, algorithm=DEFAULT_HASH, spool=None):
+        directory, name = os.path.split(filepath)
+        self.filepath = filepath
+        if spool is None:
+            self.part_path = os.path.join(directory, f".{name}.part")
+        else:
+            self.part_path = os.path.join(spool, f".{hashlib.sha256(filepath.encode()).hexdigest()[:32]}.part")
+        self.journal_path = self.part_path + ".json"
+        self.algorithm = algorithm
+        self.file = None
+        self.hasher = None
+        self.offset = 0
+        self.checkpointed = 0
+
+    def committed(self):
+        """Return (offset, algorithm, digest) of the committed prefix, or None if there is nothing to resume."""
+        try:
+            with open(self.journal_path) as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # The data may not have reached the disk if the server died; never trust more than exists
+        if not os.path.exists(self.part_path) or os.path.getsize(self.part_path) < journal["offset"]:
+            return None
+        if "digest" not in journal:  # journal written before the algorithm was recorded
+            return journal["offset"], "sha256", journal["sha256"]
+        return journal["offset"], journal["algorithm"], journal["digest"]
+
+    def open(self, offset=0):
+        """Start writing at `offset`, which must be 0 or the committed offset."""
+        self.hasher = new_hasher(self.algorithm)
+        os.makedirs(os.path.dirname(self.part_path) or ".", exist_ok=True)
+        if offset:
+            committed = self.committed()
+            if committed is None or committed[0] != offset:
+                raise ValueError(f"No partial upload at offset {offset}")
+            self.file = open(self.part_path, 'r+b')
+            self.file.truncate(offset)  # drop anything written after the last checkpoint
+            while chunk := self.file.read(1024 * 1024):
+                self.hasher.update(chunk)
+        else:
+            self.file = open(self.part_path, 'wb')
+        self.offset = self.checkpointed = offset
+        return self
+
+    def write(self, data):
+        self.file.write(data)
+        self.hasher.update(data)
+        self.offset += len(data)
+        if self.offset - self.checkpointed >= CHECKPOINT_INTERVAL:
+            self.checkpoint()
+        return len(data)
+
+    def checkpoint(self):
+        """Record everything written so far as committed."""
+        self.file.flush()
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"offset": self.offset, "algorithm": self.algorithm, "digest": self.hasher.hexdigest()}, f)
+        os.replace(temp_path, self.journal_path)
+        self.checkpointed = self.offset
+
+    def abort(self):
+        """Keep what arrived so the client can resume later."""
+        self.checkpoint()
+        self.file.close()
+
+    def finish(self):
+        """Move the complete file under its real name and forget the journal."""
+        self.file.close()
+        os.replace(self.part_path, self.filepath)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def discard(self):
+        """Drop the upload and its journal, e.g. when the target's folder is gone."""
+        self.file.close()
+        for path in (self.part_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,215 @@
+## Per-path reader/writer locks for the storage, so handlers on different paths never wait for each other
+
+# import libraries
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+SHARDS = 64  # the table of locks is split so that looking one up is not a global lock either
+
+
+class ReadWriteLock:
+    """Lock held shared by any number of readers or exclusively by one writer.
+
+    Waiting writers go first, so a steady stream of readers cannot starve them.
+    A thread that holds the lock shared may take it shared again, which nested
+    paths need (an upload holds its folder while it locks the file in it).
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = {}  # thread id -> times it holds the lock shared
+        self.writer = None
+        self.waiting_writers = 0
+
+    def acquire_shared(self):
+        me = threading.get_ident()
+        with self.condition:
+            if me in self.readers:
+                self.readers[me] += 1
+                return
+            while self.writer is not None or self.waiting_writers:
+                self.condition.wait()
+            self.readers[me] = 1
+
+    def release_shared(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.readers[me] > 1:
+                self.readers[me] -= 1
+                return
+            del self.readers[me]
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_exclusive(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer is not None or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = threading.get_ident()
+
+    def release_exclusive(self):
+        with self.condition:
+            self.writer = None
+            self.condition.notify_all()
+
+
+class AsyncReadWriteLock:
+    """ReadWriteLock for the tasks of one event loop: the same rules, with tasks in place of threads."""
+
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.readers = {}  # task -> times it holds the lock shared
+        self.writer = None
+        self.waiting_writers = 0
+
+    async def acquire_shared(self):
+        me = asyncio.current_task()
+        async with self.condition:
+            if me in self.readers:
+                self.readers[me] += 1
+                return
+            await self.condition.wait_for(lambda: self.writer is None and not self.waiting_writers)
+            self.readers[me] = 1
+
+    async def release_shared(self):
+        me = asyncio.current_task()
+        async with self.condition:
+            if self.readers[me] > 1:
+                self.readers[me] -= 1
+                return
+            del self.readers[me]
+            if not self.readers:
+                self.condition.notify_all()
+
+    async def acquire_exclusive(self):
+        async with self.condition:
+            self.waiting_writers += 1
+            try:
+                await self.condition.wait_for(lambda: self.writer is None and not self.readers)
+            finally:  # a cancelled task must not keep readers out
+                self.waiting_writers -= 1
+                self.condition.notify_all()
+            self.writer = asyncio.current_task()
+
+    async def release_exclusive(self):
+        async with self.condition:
+            self.writer = None
+            self.condition.notify_all()
+
+
+class PathLocks:
+    """A ReadWriteLock per path below `root`, created when first needed and dropped when unused.
+
+    Locking a path also locks every folder between it and the root shared,
+    always from the top down, so deleting a folder (exclusive) waits for the
+    operations inside it and keeps new ones out, while operations on unrelated
+    paths share no lock at all. The root itself is never locked.
+
+    With several storage roots, logical(path) maps a path in any of them to the
+    primary root, so a file has one lock wherever it is stored.
+    """
+
+    lock_type = ReadWriteLock
+
+    def __init__(self, root, logical=None):
+        self.root = os.path.normpath(root)
+        self.logical = logical
+        self.shards = [(threading.Lock(), {}) for _ in range(SHARDS)]  # path -> [ReadWriteLock, users]
+
+    def shared(self, path):
+        """Context manager holding `path` shared, for reading it."""
+        return self._hold(path, exclusive=False)
+
+    def exclusive(self, path):
+        """Context manager holding `path` exclusively, for replacing or removing it."""
+        return self._hold(path, exclusive=True)
+
+    def alone(self, path):
+        """Context manager holding `path` exclusively but not its folders.
+
+        For long work such as receiving a file body, which must not keep its
+        folder from being deleted; re-check the folder under a normal lock after.
+        Never take it while holding a lock on one of path's folders.
+        """
+        return self._hold(path, exclusive=True, folders=False)
+
+    def chain(self, path):
+        """The folders from the root down to path, then path itself; empty for the root and paths outside it."""
+        if self.logical is not None:
+            path = self.logical(path)
+        relative = os.path.relpath(os.path.normpath(path), self.root)
+        if relative == "." or relative.startswith(".."):
+            return []
+        parts = relative.split(os.sep)
+        return [os.path.join(self.root, *parts[:i]) for i in range(1, len(parts) + 1)]
+
+    @contextmanager
+    def _hold(self, path, exclusive, folders=True):
+        paths = self.chain(path)
+        if not folders:
+            paths = paths[-1:]
+        locks = [self._get(p) for p in paths]
+        held = []
+        try:
+            for i, lock in enumerate(locks):
+                if exclusive and i == len(locks) - 1:
+                    lock.acquire_exclusive()
+                    held.append(lock.release_exclusive)
+                else:
+                    lock.acquire_shared()
+                    held.append(lock.release_shared)
+            yield
+        finally:
+            for release in reversed(held):
+                release()
+            for p in paths:
+                self._put(p)
+
+    def _get(self, path):
+        table_lock, table = self.shards[hash(path) % SHARDS]
+        with table_lock:
+            entry = table.get(path)
+            if entry is None:
+                entry = table[path] = [self.lock_type(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _put(self, path):
+        table_lock, table = self.shards[hash(path) % SHARDS]
+        with table_lock:
+            entry = table[path]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del table[path]
+
+
+class AsyncPathLocks(PathLocks):
+    """PathLocks for the async server: the same paths and rules, held with `async with`."""
+
+    lock_type = AsyncReadWriteLock
+
+    @asynccontextmanager
+    async def _hold(self, path, exclusive, folders=True):
+        paths = self.chain(path)
+        if not folders:
+            paths = paths[-1:]
+        locks = [self._get(p) for p in paths]
+        held = []
+        try:
+            for i, lock in enumerate(locks):
+                if exclusive and i == len(locks) - 1:
+                    await lock.acquire_exclusive()
+                    held.append(lock.release_exclusive)
+                else:
+                    await lock.acquire_shared()
+                    held.append(lock.release_shared)
+            yield
+        finally:
+            for release in reversed(held):
+                await release()
+            for p in paths:
+                self._put(p)
@@ -1,290 +1,1293 @@
-## Create the server side of the application
-import signal
-# import libraries
-import socket
-import threading
-import os
-import hashlib
-import shutil
-import time
-import sys
-from statistics_logger import StatisticsLogger
-
-
-
-
-def format_size(size_in_bytes):
-    """Convert file size in bytes to a human-readable format."""
-    units = ['B', 'KB', 'MB', 'GB', 'TB']
-    size = size_in_bytes
-    unit_index = 0
-    while size >= 1024 and unit_index < len(units) - 1:
-        size /= 1024.0
-        unit_index += 1
-    return f"{size:.2f} {units[unit_index]}"
-
-
-class FileServer:
-    # Constructor
-    def __init__(self, host='0.0.0.0', port=5000):
-        self.host = host
-        self.port = port
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.clients = {}  # to track active clients
-        self.current_client_dir = {}
-        self.running = True
-        self.logger = StatisticsLogger()
-
-    # Function to start server
-    def start_server(self):
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
-        print(f"Server listening on {self.host}:{self.port}")
-
-        # Setup signal handler for graceful shutdown
-        signal.signal(signal.SIGINT, self.shutdown_server)
-
-        while self.running:
-            try:
-                # Shutdown the server
-                self.server_socket.settimeout(1)  # Avoid indefinite blocking
-                client_socket, client_address = self.server_socket.accept()
-                print(f"New connection from {client_address}")
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
-                self.clients[client_socket] = client_thread
-                self.current_client_dir[client_socket] = "server_storage"
-                client_thread.start()
-            except socket.timeout:
-                continue
-        self.shutdown_server()
-
-    # Graceful shutdown method
-    def shutdown_server(self, signum=None, frame=None):
-        print("Shutting down server...")
-        self.running = False  # Stop accepting new connections
-        for client_socket in list(self.clients.keys()):  # Close active connections
-            try:
-                client_socket.close()
-            except Exception as e:
-                print(f"Error closing client connection: {e}")
-
-        self.server_socket.close()
-        self.logger.save_to_file("server_statistics.csv")  # Save logs
-        print("Server stopped gracefully. Logs saved.")
-        sys.exit(0)
-
-    # Function to handle client
-    def handle_client(self, client_socket):
-        authenticated = self.authenticate(client_socket)
-        if not authenticated:
-            client_socket.close()
-            return
-        while True:
-            try:
-                request = client_socket.recv(1024).decode()
-                if not request:
-                    break
-                command, *args = request.split()
-                if command.lower() == "quit":
-                    # Client quit
-                    break
-                if command.lower() == "shutdown":
-                    self.running = False
-                    client_socket.send(b"Server Shutdown\n")
-                    break
-
-                self.process_command(client_socket, command, args)
-            except Exception as e:
-                print(f"Error: {e}")
-                client_socket.send(b"An error occurred.")
-                break
-
-        self.clients.pop(client_socket)
-        self.current_client_dir.pop(client_socket)
-        client_socket.close()
-
-
-    def authenticate(self, client_socket):
-        """Basic authentication: Ask for username and password."""
-        username = client_socket.recv(1024).decode().strip()
-        password_hash = client_socket.recv(1024).decode().strip()
-
-        # Check credentials
-        if username == "user" and password_hash == hashlib.sha256(b"pass").hexdigest():
-            client_socket.send(b"Authentication successful.\n")
-            return True
-        else:
-            client_socket.send(b"Authentication failed.\n")
-            client_socket.close()
-            return False
-
-    # Function to process commands
-    def process_command(self, client_socket, command, args):
-        command = command.upper()
-        if command == "UPLOAD":
-            self.upload_file(client_socket, args[0])
-        elif command == "DOWNLOAD":
-            self.download_file(client_socket, args[0])
-        elif command == "DELETE":
-            self.delete_file(client_socket, args[0])
-        elif command == "DIR":
-            self.list_files(client_socket)
-        elif command == "SUBFOLDER":
-            self.sub_folder(client_socket, args[0], args[1])
-        elif command == "CD":
-            self.change_directory(client_socket, args[0])
-        else:
-            client_socket.send(b"Invalid command.\n")
-
-    # Function to upload file
-    def upload_file(self, client_socket, filename):
-        """Handles file upload from client."""
-        filepath = self.current_client_dir[client_socket]
-        filepath = os.path.join(filepath, filename)
-        if os.path.exists(filepath):
-            client_socket.send(b"File exists. Overwrite? (y/n): ")
-            response = client_socket.recv(1024).decode().strip().lower()
-            if response != 'y':
-                client_socket.send(b"Upload cancelled.\n")
-                return
-        print("Ready to receive file")
-        client_socket.send(b"Ready to receive file.\n")
-        response_time = 0
-        file_size = 0
-        start_time = self.logger.start_timer()
-        with open(filepath, 'wb') as f:
-            buffer = b""
-            while True:
-                data = client_socket.recv(1024)
-                if response_time == 0:
-                    response_time = time.time() - start_time
-                if b"EOF" in data:
-                    buffer += data.split(b"EOF")[0]  # Write everything before "EOF"
-                    f.write(buffer)
-                    break
-                buffer += data
-                f.write(buffer)
-                file_size += len(data)
-                buffer = b""  # Reset buffer after writing to the file
-        print("File uploaded")
-
-        # End timer and calculate response time
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-
-        # Format file_size
-        formatted_size = format_size(file_size)
-
-        # Format the response string
-        response_message = f"File uploaded of size {formatted_size} successfully in {elapsed_time:.3f} seconds!\n"
-        client_socket.send(response_message.encode())
-
-        # Log the upload operation
-        self.logger.end_timer(
-            start_time=start_time,
-            operation="UPLOAD",
-            filename=filename,
-            file_size=file_size,
-            elapsed_time=elapsed_time,
-            response_time=response_time
-        )
-
-    # Function to download file
-    def download_file(self, client_socket, filename):
-        """Handles file download to client."""
-        filepath = self.current_client_dir[client_socket]
-        filepath = os.path.join(filepath, filename)
-        if not os.path.exists(filepath):
-            client_socket.send(b"File not found.\n")
-            return
-
-        file_size = os.path.getsize(filepath)
-        start_time = self.logger.start_timer()
-
-        client_socket.send(b"Ready to send file.")
-        with open(filepath, 'rb') as f:
-            while chunk := f.read(1024):
-                client_socket.send(chunk)
-
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-
-        # Log the operation
-        self.logger.end_timer(
-            start_time=start_time,
-            operation="DOWNLOAD",
-            filename=filename,
-            file_size=file_size,
-            elapsed_time=elapsed_time,
-            response_time=elapsed_time
-        )
-
-        client_socket.send(b"EOF")
-        # Format the response string
-        # Format file_size
-        time.sleep(0.5)
-        formatted_size = format_size(file_size)
-        response_message = f"File uploaded of size {formatted_size} successfully in {elapsed_time:.3f} seconds!\n"
-        client_socket.send(response_message.encode())
-
-    # Function to delete file
-    def delete_file(self, client_socket, filename):
-        """Handles file deletion"""
-        filepath = self.current_client_dir[client_socket]
-        filepath = os.path.join(filepath, filename)
-        if not os.path.exists(filepath):
-            client_socket.send(b"File not found.\n")
-            return
-
-        os.remove(filepath)
-        client_socket.send(b"File deleted successfully.\n")
-
-
-    # Function to list files
-    def list_files(self, client_socket):
-        """Lists files in the server's directory."""
-        filepath = self.current_client_dir[client_socket]
-        files = os.listdir(filepath)
-        file_list = "\n".join(files)
-        client_socket.send(file_list.encode() + b"\n")
-
-    def sub_folder(self, client_socket, command, path):
-        """Create or delete a sub folder."""
-        path = "server_storage/" + path.lower()
-        if command == 'CREATE':
-            if os.path.exists(path):
-                client_socket.send(b"Folder already exists!\n")
-                return
-            os.mkdir(path)
-            client_socket.send(b"Folder created successfully.\n")
-        elif command == 'DELETE':
-            if not os.path.exists(path):
-                client_socket.send(b"Folder not found.\n")
-                return
-            shutil.rmtree(path)
-            client_socket.send(b"Folder deleted successfully.\n")
-
-    def change_directory(self, client_socket, directory):
-        filepath = self.current_client_dir[client_socket]
-        directory = directory.lower()
-        if directory == "..":
-            if filepath == "server_storage":
-                client_socket.send(b"You are already at the root directory!\n")
-            else:
-                newPath = os.path.dirname(filepath)
-                self.current_client_dir[client_socket] = newPath
-                client_socket.send(b"File path changed to: "+newPath.encode()+b"\n")
-        else:
-            filepath = os.path.join(filepath, directory)
-            if os.path.exists(filepath):
-                client_socket.send(b"File path changed to: "+filepath.encode()+b"\n")
-                self.current_client_dir[client_socket] = filepath
-            else:
-                client_socket.send(b"File path not found.\n")
-
-# Driver code
-if __name__ == "__main__":
-    server_ip = '127.0.0.1'
-    # server_ip = '192.168.123.202'
-    file_server = FileServer(host=server_ip, port=4456)
-    file_server.start_server()
+## Create the server side of the application
+import signal
+# import libraries
+import argparse
+import errno
+import socket
+import threading
+import os
+import io
+import fnmatch
+import hashlib
+import secrets
+import shutil
+import time
+import sys
+from statistics_logger import StatisticsLogger
+from partial_upload import PartialUpload
+from chunk_store import ChunkStore, check_chunks
+from hash_cache import HashCache
+from metrics import Metrics, serve_metrics
+from directory_cache import DirectoryCache, parse_dir_options
+from bandwidth import BandwidthShaper, parse_rate
+from file_cache import FileCache, parse_size, map_file
+from path_locks import PathLocks
+from storage_roots import StorageRoots
+from auth import MemoryUserStore, JsonUserStore, SessionTokens, DEFAULT_USERS, TOKEN_TTL
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import FramedConnection, LegacyConnection, is_framed, STATUS_ERROR, TOKEN_PREFIX
+from compression import CODECS
+from transfer import (DEFAULT_CHUNK_SIZE, BATCH_POLICIES, DEFAULT_HASH, HASH_ALGORITHMS,
+                      should_transfer, new_hasher, hash_file)
+from sync import build_manifest, entries_to_manifest, diff_manifests
+
+STORAGE_ROOT = "server_storage"
+UPLOAD_SPOOL = ".uploads"  # hidden folder of every storage root that partial uploads are received into
+
+
+def storage_path(directory, name, root=STORAGE_ROOT):
+    """Join a client-supplied relative name to a directory, or None if it would leave the storage
+    below `root` or touch a hidden file (partial uploads, chunk store, caches)."""
+    path = os.path.normpath(os.path.join(directory, name))
+    relative = os.path.relpath(path, root)
+    if relative == ".":
+        return path
+    if relative.startswith("..") or os.path.isabs(name) or any(part.startswith(".") for part in relative.split(os.sep)):
+        return None
+    return path
+
+
+def ranges_cover(ranges, size):
+    """Check that the (offset, length) ranges together cover every byte of [0, size)."""
+    covered = 0
+    for offset, length in sorted(ranges):
+        if offset > covered:
+            return False
+        covered = max(covered, offset + length)
+    return covered >= size
+
+
+def format_size(size_in_bytes):
+    """Convert file size in bytes to a human-readable format."""
+    units = ['B', 'KB', 'MB', 'GB', 'TB']
+    size = size_in_bytes
+    unit_index = 0
+    while size >= 1024 and unit_index < len(units) - 1:
+        size /= 1024.0
+        unit_index += 1
+    return f"{size:.2f} {units[unit_index]}"
+
+
+class FileServer:
+    # Constructor
+    def __init__(self, host='0.0.0.0', port=5000, chunk_size=DEFAULT_CHUNK_SIZE, backlog=5, chunk_store=False,
+                 metrics_port=None, rate_limit=None, user_rate_limit=None, session_rate_limit=None,
+                 file_cache_size=0, user_store=None, token_ttl=TOKEN_TTL, storage_roots=(STORAGE_ROOT,)):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.chunk_size = chunk_size  # bytes per recv/send call during transfers
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.clients = {}  # to track active clients
+        self.current_client_dir = {}
+        self.running = True
+        self.metrics = Metrics()  # live counters and latency histograms, see STATS
+        self.metrics_port = metrics_port  # optional Prometheus endpoint on localhost
+        self.logger = StatisticsLogger("server_statistics.csv", metrics=self.metrics)  # streamed to disk as records come in
+        self.stripes = {}  # striped transfers in progress, by transfer id
+        # Files are spread over the roots by consistent hashing; sessions and handlers use paths in the first one
+        self.storage = StorageRoots(storage_roots)
+        root = self.storage.primary
+        self.chunk_store = ChunkStore(root, self.storage.roots) if chunk_store else None  # enables deduplicated DUPLOAD
+        self.stripes_lock = threading.Lock()
+        self.stripes_idle = threading.Condition(self.stripes_lock)  # notified when a STRIPE_PUT lets go of a temp file
+        self.hash_cache = HashCache(os.path.join(root, ".hashes.db"))  # digests of unchanged files, never rehashed
+        # DIR listings merged over the roots; manifests of the chunk store are listed with the size of their file
+        self.dir_cache = DirectoryCache(max_dirs=4096, size_of=self.stored_size if chunk_store else None,
+                                        mirrors=self.storage.mirrors)
+        # Bandwidth limits in bytes/s (None for unlimited), adjustable with LIMIT
+        self.shaper = BandwidthShaper(rate_limit, user_rate_limit, session_rate_limit)
+        self.file_cache = FileCache(file_cache_size, logger=self.logger)  # hot files served from memory, off at 0
+        # Readers hold a path shared, writers exclusively; folders above it are held shared
+        self.locks = PathLocks(root, self.storage.logical)
+        # Accounts: any object with verify(username, password_hash); see backend/auth.py
+        self.users = user_store if user_store is not None else MemoryUserStore(DEFAULT_USERS)
+        self.tokens = SessionTokens(token_ttl)  # TOKEN hands these out for reconnecting without the password
+        self.client_users = {}  # username of each session
+
+    # Function to start server
+    def start_server(self):
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(self.backlog)
+        print(f"Server listening on {self.host}:{self.port}")
+        if self.metrics_port is not None:
+            serve_metrics(self.metrics, self.metrics_port)
+
+        # Setup signal handler for graceful shutdown
+        signal.signal(signal.SIGINT, self.shutdown_server)
+
+        while self.running:
+            try:
+                # Shutdown the server
+                self.server_socket.settimeout(1)  # Avoid indefinite blocking
+                client_socket, client_address = self.server_socket.accept()
+                print(f"New connection from {client_address}")
+                client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
+                self.clients[client_socket] = client_thread
+                self.current_client_dir[client_socket] = self.storage.primary
+                client_thread.start()
+            except socket.timeout:
+                continue
+        self.shutdown_server()
+
+    # Graceful shutdown method
+    def shutdown_server(self, signum=None, frame=None):
+        print("Shutting down server...")
+        self.running = False  # Stop accepting new connections
+        for client_socket in list(self.clients.keys()):  # Close active connections
+            try:
+                client_socket.close()
+            except Exception as e:
+                print(f"Error closing client connection: {e}")
+
+        self.server_socket.close()
+        self.logger.close()  # Flush the last records
+        print("Server stopped gracefully. Logs saved.")
+        sys.exit(0)
+
+    # Pick the wire protocol for a new connection
+    def open_connection(self, client_socket):
+        """Wrap the socket in a framed connection, or the legacy one for old clients."""
+        if is_framed(client_socket):
+            return FramedConnection(client_socket, self.chunk_size)
+        print("Client is using the legacy protocol")
+        return LegacyConnection(client_socket)
+
+    # Function to handle client
+    def handle_client(self, client_socket):
+        conn = None
+        username = None
+        try:
+            conn = self.open_connection(client_socket)
+            username = self.authenticate(conn)
+            if username is None:
+                return
+            self.current_client_dir[conn] = self.current_client_dir.pop(client_socket)
+            self.client_users[conn] = username
+            self.metrics.session_started()
+            while True:
+                try:
+                    request = conn.recv_command()
+                    if not request:
+                        break
+                    command, *args = request.split()
+                    if command.lower() == "quit":
+                        # Client quit
+                        break
+                    if command.lower() == "shutdown":
+                        self.running = False
+                        conn.send_message("Server Shutdown\n")
+                        break
+
+                    self.timed_command(conn, command, args)
+                except Exception as e:
+                    print(f"Error: {e}")
+                    try:
+                        conn.send_message("An error occurred.", STATUS_ERROR)
+                    except OSError:
+                        pass
+                    break
+        except Exception as e:
+            # Peer went away or sent garbage during the handshake
+            print(f"Handshake failed: {e}")
+        finally:
+            if username is not None:
+                self.metrics.session_ended()
+                self.shaper.close_session(conn.throttle)
+                self.client_users.pop(conn, None)
+                self.abort_stripes(conn)
+            self.clients.pop(client_socket, None)
+            self.current_client_dir.pop(client_socket, None)
+            if conn is not None:
+                self.current_client_dir.pop(conn, None)
+                conn.close()
+            else:
+                client_socket.close()
+
+
+    def authenticate(self, conn):
+        """Ask for username and password, or a session token; returns the username or None."""
+        username, secret = conn.recv_credentials()
+        start = time.perf_counter()
+
+        # Check credentials
+        if secret.startswith(TOKEN_PREFIX):
+            command = "AUTH_TOKEN"
+            valid = self.tokens.check(secret[len(TOKEN_PREFIX):]) == username
+        else:
+            command = "AUTH"
+            valid = self.users.verify(username, secret)
+        if valid:
+            conn.throttle = self.shaper.open_session(username)  # file data of this session is paced from now on
+            conn.send_message("Authentication successful.\n")
+            self.metrics.observe_command(command, time.perf_counter() - start)
+            return username
+        else:
+            conn.send_message("Authentication failed.\n", STATUS_ERROR)
+            self.metrics.observe_command(command, time.perf_counter() - start, failed=True)
+            return None
+
+    # Function to time every command for the live metrics
+    def timed_command(self, conn, command, args):
+        """Run process_command and record how long it took, including failed commands."""
+        start = time.perf_counter()
+        failed = True
+        try:
+            self.process_command(conn, command, args)
+            failed = False
+        finally:
+            self.metrics.observe_command(command.upper(), time.perf_counter() - start, failed)
+
+    # Function to process commands
+    def process_command(self, conn, command, args):
+        command = command.upper()
+        if command == "UPLOAD":
+            self.upload_file(conn, args[0], int(args[1]) if len(args) > 1 else 0,
+                             args[2] if len(args) > 2 else DEFAULT_HASH)
+        elif command == "DOWNLOAD":
+            self.download_file(conn, args[0], int(args[1]) if len(args) > 1 else 0,
+                               args[2] if len(args) > 2 else DEFAULT_HASH, args[3] if len(args) > 3 else "none")
+        elif command == "CODECS":
+            conn.send_message(" ".join(CODECS))
+        elif command == "TOKEN":
+            self.session_token(conn, args)
+        elif command == "STATS":
+            conn.send_message(self.metrics.prometheus() if args and args[0].lower() == "prometheus"
+                              else self.metrics.summary() + self.file_cache.describe())
+        elif command == "LIMIT":
+            self.set_limit(conn, args)
+        elif command == "HASH":
+            self.send_hash(conn, args[0], args[1] if len(args) > 1 else DEFAULT_HASH)
+        elif command == "STAT":
+            self.send_stat(conn, args[0], args[1] if len(args) > 1 else DEFAULT_HASH)
+        elif command == "DUPLOAD":
+            self.dedup_upload(conn, args[0])
+        elif command == "OFFSET":
+            self.upload_offset(conn, args[0])
+        elif command == "MUPLOAD":
+            self.batch_upload(conn, args[0].lower())
+        elif command == "SYNC":
+            self.sync(conn, args[0].lower(), args[1], args[2] if len(args) > 2 else DEFAULT_HASH,
+                      [option.lower() for option in args[3:]])
+        elif command == "MDOWNLOAD":
+            self.batch_download(conn, args[0] if args else DEFAULT_HASH, args[1] if len(args) > 1 else "none")
+        elif command == "STRIPE_UPLOAD":
+            self.stripe_upload(conn, args[0], int(args[1]))
+        elif command == "STRIPE_DOWNLOAD":
+            self.stripe_download(conn, args[0])
+        elif command == "STRIPE_PUT":
+            self.stripe_put(conn, args[0], int(args[1]))
+        elif command == "STRIPE_GET":
+            self.stripe_get(conn, args[0], int(args[1]), int(args[2]))
+        elif command == "STRIPE_COMMIT":
+            self.stripe_commit(conn, args[0], args[1] if len(args) > 1 else None)
+        elif command == "DELETE":
+            self.delete_file(conn, args[0])
+        elif command == "DIR":
+            self.list_files(conn, args)
+        elif command == "SUBFOLDER":
+            self.sub_folder(conn, args[0], args[1])
+        elif command == "CD":
+            self.change_directory(conn, args[0])
+        elif command == "REBALANCE":
+            self.rebalance_command(conn, args)
+        else:
+            conn.send_message("Invalid command.\n", STATUS_ERROR)
+
+    # Function to show or change the bandwidth limits
+    def set_limit(self, conn, args):
+        """LIMIT shows the limits; LIMIT <global|user|session> <rate|off> changes one for every session."""
+        if args:
+            try:
+                if len(args) != 2:
+                    raise ValueError("Usage: LIMIT [global|user|session <rate|off>]")
+                self.shaper.set_rate(args[0].lower(), parse_rate(args[1]))
+            except ValueError as e:
+                conn.send_message(f"{e}\n", STATUS_ERROR)
+                return
+        conn.send_message(self.shaper.describe())
+
+    # Function to hand out or revoke session tokens
+    def session_token(self, conn, args):
+        """TOKEN replies "<token> <seconds valid>"; TOKEN REVOKE <token> ends one of the user's tokens."""
+        username = self.client_users[conn]
+        if not args:
+            conn.send_message(f"{self.tokens.issue(username)} {self.tokens.ttl}")
+        elif args[0].upper() == "REVOKE" and len(args) == 2 and self.tokens.check(args[1]) == username:
+            self.tokens.revoke(args[1])
+            conn.send_message("Token revoked.\n")
+        else:
+            conn.send_message("Unknown token.\n" if args[0].upper() == "REVOKE" else "Usage: TOKEN [REVOKE token]\n",
+                              STATUS_ERROR)
+
+    # Every file name from a client goes through here
+    def client_path(self, conn, name):
+        """The path of a file the client names in its current folder, or None after telling it the name is
+        invalid: one that leaves the storage, names the storage root or touches a hidden file."""
+        path = storage_path(self.current_client_dir[conn], name, self.storage.primary)
+        if path is None or path == self.storage.primary:
+            conn.send_message("Invalid file name.\n", STATUS_ERROR)
+            return None
+        return path
+
+    # Function to upload file
+    def upload_file(self, conn, filename, offset=0, algorithm=DEFAULT_HASH):
+        """Handles file upload from client. A non-zero offset resumes a partial upload."""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        if not self.check_algorithm(conn, algorithm):
+            return
+        filepath, exists = self.upload_target(filepath)
+        if filepath is None:
+            conn.send_message("Folder not found.\n", STATUS_ERROR)
+            return
+        if exists:
+            response = conn.prompt("File exists. Overwrite? (y/n): ").strip().lower()
+            if response != 'y':
+                conn.send_message("Upload cancelled.\n", STATUS_ERROR)
+                return
+        if offset:
+            committed = self.partial_upload(filepath).committed()
+            if committed is None or committed[0] != offset:
+                conn.send_message("No partial upload at that offset.\n", STATUS_ERROR)
+                return
+        print("Ready to receive file")
+        conn.send_message("Ready to receive file.\n")
+        self.receive_file(conn, filepath, filename, offset=offset, algorithm=algorithm)
+
+    def upload_target(self, filepath):
+        """Return (path to store a file at, whether it exists), or (None, False) if its folder does not exist.
+
+        Only the check holds the folder; the body is received without it and
+        finish_upload() checks again that the folder is still there.
+        """
+        directory = os.path.dirname(filepath)
+        with self.locks.shared(directory):
+            if not os.path.isdir(directory):
+                return None, False
+            filepath = self.storage.locate(filepath)  # the root it is in, or the one that owns a new file
+            return filepath, os.path.exists(filepath)
+
+    def partial_upload(self, filepath, algorithm=DEFAULT_HASH):
+        """The PartialUpload of a file, spooled in its storage root so deleting its folder does not race with it."""
+        root, _ = self.storage.split(filepath)
+        return PartialUpload(filepath, algorithm, os.path.join(root or self.storage.primary, UPLOAD_SPOOL))
+
+    # Function to report how far a partial upload got
+    def upload_offset(self, conn, filename):
+        """Handles OFFSET: reply "<offset> <algorithm> <digest of those bytes>" for a partial upload."""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        committed = self.partial_upload(self.storage.locate(filepath)).committed()
+        if committed is None:
+            conn.send_message("No partial upload.\n", STATUS_ERROR)
+            return
+        conn.send_message(" ".join(str(field) for field in committed))
+
+    # Receives one file body and reports it
+    def receive_file(self, conn, filepath, filename, mtime=None, offset=0, algorithm=DEFAULT_HASH):
+        """Stores the next file body from the client and answers with a trailer.
+
+        The body goes to a partial file first, so a dropped connection never leaves a
+        truncated file under the real name and the client can resume from the journal.
+        The digest of the whole file is computed on the way in and sent in the trailer.
+        Returns False if the file could not be stored, which the trailer reports.
+        """
+        start_time = self.logger.start_timer()
+        partial = self.partial_upload(filepath, algorithm)
+        # Uploads of one name share the partial file, so they take turns; nothing else waits for the body
+        with self.locks.alone(partial.part_path):
+            partial.open(offset)
+            try:
+                file_size, first_byte_at = conn.recv_file(partial)
+            except (ConnectionError, OSError):
+                partial.abort()
+                raise
+            with self.locks.exclusive(filepath):
+                if not os.path.isdir(os.path.dirname(filepath)):
+                    partial.discard()  # missing, or deleted while the body was on its way
+                    conn.send_trailer("Upload failed: folder not found.\n", STATUS_ERROR)
+                    return False
+                self.release_stored_file(filepath)
+                partial.finish()
+                self.drop_other_copies(filepath)
+                if mtime is not None:
+                    os.utime(filepath, (mtime, mtime))  # keep the client's mtime so "newer" works next time
+                self.dir_cache.invalidate(os.path.dirname(filepath))
+                self.file_cache.invalidate(filepath)
+                digest = partial.hasher.hexdigest()
+                self.hash_cache.put(filepath, algorithm, digest)
+        response_time = first_byte_at - start_time
+        print("File uploaded")
+
+        # End timer and calculate response time
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+
+        # Format file_size
+        formatted_size = format_size(file_size)
+
+        # Format the response string
+        wire_size = conn.last_wire_size
+        response_message = (f"File uploaded of size {formatted_size} successfully in {elapsed_time:.3f} seconds!"
+                            f"{self.wire_note(file_size, wire_size)}\n")
+        conn.send_trailer(response_message, size=file_size, wire_bytes=wire_size, offset=offset,
+                          elapsed=elapsed_time, algorithm=algorithm, digest=digest)
+
+        # Log the upload operation
+        self.logger.end_timer(
+            start_time=start_time,
+            operation="UPLOAD",
+            filename=filename,
+            file_size=file_size,
+            elapsed_time=elapsed_time,
+            response_time=response_time,
+            wire_size=wire_size
+        )
+        return True
+
+    # Function to download file
+    def download_file(self, conn, filename, offset=0, algorithm=DEFAULT_HASH, compression="none"):
+        """Handles file download to client, starting at `offset` to resume an interrupted one."""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        with self.locks.shared(filepath):
+            filepath = self.storage.locate(filepath)
+            if not os.path.isfile(filepath):
+                conn.send_message("File not found.\n", STATUS_ERROR)
+                return
+            if not self.check_algorithm(conn, algorithm):
+                return
+            if offset < 0 or offset > self.stored_size(filepath):
+                conn.send_message("Offset is past the end of the file.\n", STATUS_ERROR)
+                return
+
+            conn.send_message("Ready to send file.")
+            self.send_file_to_client(conn, filepath, filename, offset, algorithm, compression)
+
+    # Sends one file body and reports it
+    def send_file_to_client(self, conn, filepath, filename, offset=0, algorithm=DEFAULT_HASH, compression="none"):
+        """Streams a file (from `offset` on) to the client followed by its trailer.
+
+        The trailer carries the digest of the whole file. A cached digest lets the
+        body go out zero-copy; otherwise it is hashed as it is sent and cached.
+        compression is the setting the client asked for, see FramedConnection.send_file.
+        A file deleted since the caller found it gets an empty body and an error
+        trailer, which keeps a batch in step; returns False then.
+        """
+        # Held until the body is out: a chunk store file must keep its chunks, and nothing may replace it halfway
+        with self.locks.shared(filepath):
+            filepath = self.storage.locate(filepath)  # callers may name it by its path in the primary root
+            if not os.path.isfile(filepath):
+                conn.send_buffer(b"")
+                conn.send_trailer("File not found.\n", STATUS_ERROR)
+                return False
+            stat = os.stat(filepath)
+            file_size = self.stored_size(filepath) - offset
+            start_time = self.logger.start_timer()
+
+            digest = self.hash_cache.get(filepath, algorithm)
+            hasher = None if digest else new_hasher(algorithm)
+            cached = self.cached_file(filepath, file_size + offset)
+            if cached is not None:
+                if hasher:
+                    hasher.update(cached[:offset])
+                conn.send_buffer(cached[offset:], hasher, compression)
+            else:
+                with self.open_stored_file(filepath, 0 if hasher else offset) as f:
+                    if hasher:
+                        hash_file(f, hasher, offset)  # the skipped prefix still counts towards the digest
+                    conn.send_file(f, file_size, hasher, compression)
+            wire_size = conn.last_wire_size
+            if hasher:
+                digest = hasher.hexdigest()
+                self.hash_cache.put(filepath, algorithm, digest, stat)
+
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+
+        # Log the operation
+        self.logger.end_timer(
+            start_time=start_time,
+            operation="DOWNLOAD",
+            filename=filename,
+            file_size=file_size,
+            elapsed_time=elapsed_time,
+            response_time=elapsed_time,
+            wire_size=wire_size
+        )
+
+        # Format the response string
+        formatted_size = format_size(file_size)
+        response_message = (f"File downloaded of size {formatted_size} successfully in {elapsed_time:.3f} seconds!"
+                            f"{self.wire_note(file_size, wire_size)}\n")
+        conn.send_trailer(response_message, size=file_size, wire_bytes=wire_size, offset=offset,
+                          elapsed=elapsed_time, algorithm=algorithm, digest=digest)
+        return True
+
+    def wire_note(self, file_size, wire_size):
+        """Mention the bytes on the wire in the summary of compressed transfers."""
+        return f" ({format_size(wire_size)} on the wire)" if wire_size != file_size else ""
+
+    def check_algorithm(self, conn, algorithm):
+        if algorithm in HASH_ALGORITHMS:
+            return True
+        conn.send_message(f"Unknown hash algorithm. Use one of: {', '.join(HASH_ALGORITHMS)}\n", STATUS_ERROR)
+        return False
+
+    # Digest of a stored file, from the hash cache when the file has not changed
+    def file_digest(self, filepath, algorithm=DEFAULT_HASH):
+        with self.locks.shared(filepath):
+            filepath = self.storage.locate(filepath)
+            digest = self.hash_cache.get(filepath, algorithm)
+            if digest is None:
+                stat = os.stat(filepath)
+                with self.open_stored_file(filepath) as f:
+                    digest = hash_file(f, new_hasher(algorithm), chunk_size=self.chunk_size).hexdigest()
+                self.hash_cache.put(filepath, algorithm, digest, stat)
+        return digest
+
+    # Function to report the digest of a file
+    def send_hash(self, conn, filename, algorithm=DEFAULT_HASH):
+        """Handles HASH: reply "<algorithm> <digest>" for a stored file."""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        filepath = self.storage.locate(filepath)
+        if not os.path.isfile(filepath):
+            conn.send_message("File not found.\n", STATUS_ERROR)
+            return
+        if self.check_algorithm(conn, algorithm):
+            conn.send_message(f"{algorithm} {self.file_digest(filepath, algorithm)}")
+
+    # Function to report size, mtime and digest of a file
+    def send_stat(self, conn, filename, algorithm=DEFAULT_HASH):
+        """Handles STAT: reply "<size> <mtime> <algorithm> <digest>" for a stored file."""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        with self.locks.shared(filepath):  # not moved to another root between the digest and the stat
+            filepath = self.storage.locate(filepath)
+            if not os.path.isfile(filepath):
+                conn.send_message("File not found.\n", STATUS_ERROR)
+                return
+            if self.check_algorithm(conn, algorithm):
+                digest = self.file_digest(filepath, algorithm)
+                conn.send_message(f"{self.stored_size(filepath)} {os.path.getmtime(filepath)} {algorithm} {digest}")
+
+    # Function to upload many files at once
+    def batch_upload(self, conn, policy):
+        """Handles MUPLOAD: one plan for the whole batch, then every file back-to-back."""
+        # The client pipelines its file list right behind the command
+        entries = conn.recv_list()
+        if policy not in BATCH_POLICIES:
+            conn.send_message(f"Unknown overwrite policy. Use one of: {', '.join(BATCH_POLICIES)}\n", STATUS_ERROR)
+            return
+
+        directory = self.current_client_dir[conn]
+        plan = []
+        for entry in entries:
+            filepath = storage_path(directory, entry["name"], self.storage.primary)
+            action = ("upload" if filepath and should_transfer(self.storage.locate(filepath), entry.get("mtime"), policy)
+                      else "skip")
+            if entry.get("algorithm", DEFAULT_HASH) not in HASH_ALGORITHMS:
+                action = "skip"
+            plan.append({"name": entry["name"], "action": action})
+        conn.send_list(plan)
+
+        # Files arrive in plan order without waiting on each other; each gets its own trailer
+        uploaded = failed = 0
+        for entry, item in zip(entries, plan):
+            if item["action"] == "upload":
+                # Same locks as upload_file; a missing folder fails this file's trailer, not the batch
+                filepath, _ = self.upload_target(os.path.join(directory, entry["name"]))
+                if self.receive_file(conn, filepath or os.path.join(directory, entry["name"]), entry["name"],
+                                     entry.get("mtime"), algorithm=entry.get("algorithm", DEFAULT_HASH)):
+                    uploaded += 1
+                else:
+                    failed += 1
+        conn.send_message(f"Batch upload finished: {uploaded} uploaded, {failed} failed, "
+                          f"{len(plan) - uploaded - failed} skipped.\n")
+
+    # Function to download many files at once
+    def batch_download(self, conn, algorithm=DEFAULT_HASH, compression="none"):
+        """Handles MDOWNLOAD: expand names/globs, let the client choose, then stream every file."""
+        patterns = conn.recv_list()
+        if algorithm not in HASH_ALGORITHMS:
+            algorithm = DEFAULT_HASH  # the client notices from the algorithm named in each trailer
+        directory = self.current_client_dir[conn]
+
+        entries = []
+        seen = set()
+        for pattern in patterns:
+            # "sub/dir/*.csv" matches files of a sub-directory and names them by their path
+            folder, name_pattern = os.path.split(pattern)
+            folder_path = storage_path(directory, folder, self.storage.primary)
+            matches = []
+            if folder_path is not None and os.path.isdir(folder_path):
+                listing = self.dir_cache.listing(folder_path)
+                files = sorted(name for name, is_dir in zip(listing.names, listing.kinds) if not is_dir)
+                matches = [f"{folder}/{name}" if folder else name for name in fnmatch.filter(files, name_pattern)]
+            if not matches:
+                entries.append({"name": pattern, "error": "File not found."})
+            for name in matches:
+                if name not in seen:
+                    filepath = self.storage.locate(os.path.join(directory, name))
+                    try:
+                        entries.append({"name": name, "size": self.stored_size(filepath),
+                                        "mtime": os.path.getmtime(filepath)})
+                    except OSError:  # deleted since the listing was cached
+                        entries.append({"name": name, "error": "File not found."})
+                        continue
+                    seen.add(name)
+        conn.send_list(entries)
+
+        # The client answers with the names it wants after applying its overwrite policy
+        wanted = [name for name in conn.recv_list() if name in seen]
+        sent = 0
+        for name in wanted:
+            sent += self.send_file_to_client(conn, os.path.join(directory, name), name, algorithm=algorithm,
+                                             compression=compression)
+        conn.send_message(f"Batch download finished: {sent} sent, {len(wanted) - sent} failed.\n")
+
+    # Function to upload a file deduplicated against the chunk store
+    def dedup_upload(self, conn, filename):
+        """Handles DUPLOAD: the client lists its chunks and only sends the ones the server lacks."""
+        chunks = conn.recv_list()  # [[sha256, size], ...], pipelined right behind the command
+        if self.chunk_store is None:
+            conn.send_message("Deduplicated uploads are not enabled on this server.\n", STATUS_ERROR)
+            return
+        try:
+            check_chunks(chunks)
+        except ValueError as e:
+            conn.send_message(f"{e}\n", STATUS_ERROR)
+            return
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        filepath, exists = self.upload_target(filepath)
+        if filepath is None:
+            conn.send_message("Folder not found.\n", STATUS_ERROR)
+            return
+        if exists:
+            response = conn.prompt("File exists. Overwrite? (y/n): ").strip().lower()
+            if response != 'y':
+                conn.send_message("Upload cancelled.\n", STATUS_ERROR)
+                return
+
+        # Chunks live in the chunk store, not the folder, so they arrive without any path lock
+        missing = self.chunk_store.missing(digest for digest, _ in chunks)
+        conn.send_list(missing)
+        start_time = self.logger.start_timer()
+        sent_bytes = 0
+        sizes = dict(chunks)
+        for digest in missing:
+            data = io.BytesIO()
+            size, _ = conn.recv_file(data, max_size=sizes[digest])  # never more than the chunk said it was
+            sent_bytes += size
+            self.chunk_store.put(digest, data.getvalue())
+        directory = os.path.dirname(filepath)
+        with self.locks.exclusive(filepath):
+            if not os.path.isdir(directory):
+                conn.send_trailer("Upload failed: the folder was deleted meanwhile.\n", STATUS_ERROR)
+                return
+            try:
+                manifest = self.chunk_store.write_manifest(filepath, chunks)
+            except FileNotFoundError:
+                # A chunk the client was told to skip went with a file deleted meanwhile
+                conn.send_trailer("Upload failed: the server lost a chunk meanwhile, please retry.\n",
+                                  STATUS_ERROR)
+                return
+            except ValueError as e:  # a chunk's declared size is not its real one
+                conn.send_trailer(f"Upload failed: {e}\n", STATUS_ERROR)
+                return
+            self.drop_other_copies(filepath)
+            self.dir_cache.invalidate(directory)
+            self.file_cache.invalidate(filepath)
+        elapsed_time = time.time() - start_time
+
+        file_size = manifest["size"]
+        response_message = (f"File uploaded of size {format_size(file_size)} successfully in {elapsed_time:.3f} seconds! "
+                            f"({format_size(sent_bytes)} sent, {len(missing)} of {len(chunks)} chunks new)\n")
+        conn.send_trailer(response_message, size=file_size, wire_bytes=sent_bytes,
+                          new_chunks=len(missing), chunks=len(chunks), elapsed=elapsed_time)
+        self.logger.end_timer(
+            start_time=start_time,
+            operation="UPLOAD",
+            filename=filename,
+            file_size=file_size,
+            elapsed_time=elapsed_time,
+            response_time=0
+        )
+
+    # Stored files are either plain files or chunk store manifests
+    def open_stored_file(self, filepath, offset=0):
+        """Open a stored file for reading at `offset`, whatever its storage format."""
+        if self.chunk_store and self.chunk_store.is_manifest(filepath):
+            return self.chunk_store.open_manifest(self.chunk_store.read_manifest(filepath), offset)
+        f = open(filepath, 'rb')
+        f.seek(offset)
+        return f
+
+    def cached_file(self, filepath, size):
+        """The whole of a stored file of logical size `size` from the hot-file cache, or None to read it from disk."""
+        view = self.file_cache.get(filepath, size, self.load_stored_file)
+        if view is not None and len(view) != size:
+            return None  # changed since its size was taken; the next request sees the new one
+        return view
+
+    def load_stored_file(self, filepath):
+        """Contents of a stored file for the hot-file cache: mapped, or reassembled from the chunk store."""
+        if self.chunk_store and self.chunk_store.is_manifest(filepath):
+            buffer = bytearray(self.stored_size(filepath))
+            view = memoryview(buffer)
+            filled = 0
+            with self.open_stored_file(filepath) as f:
+                while filled < len(buffer) and (n := f.readinto(view[filled:])):
+                    filled += n
+            return buffer[:filled] if filled < len(buffer) else buffer
+        return map_file(filepath)
+
+    def stored_size(self, filepath):
+        """Logical size of a stored file."""
+        if self.chunk_store and self.chunk_store.is_manifest(filepath):
+            return self.chunk_store.read_manifest(filepath)["size"]
+        return os.path.getsize(filepath)
+
+    def release_stored_file(self, filepath):
+        """Give back the chunk references of a file that is about to be replaced or deleted."""
+        if self.chunk_store:
+            self.chunk_store.release(filepath)
+
+    # Function to plan a directory sync
+    def sync(self, conn, direction, remote_dir, algorithm=DEFAULT_HASH, options=()):
+        """Handles SYNC push|pull {dir} {algorithm} [delete] [checksum].
+
+        The client's manifest of its tree follows the command. The server diffs it
+        with its own, built from cached directory listings, and answers with a
+        plan. For a push it first creates the missing folders and, with delete,
+        removes what the client does not have; the files themselves then travel
+        through MUPLOAD/MDOWNLOAD batches, which is why the plan names them
+        relative to the storage root ("base") for the client's worker connections.
+        """
+        entries = conn.recv_list()  # pipelined right behind the command
+        delete, checksum = "delete" in options, "checksum" in options
+        root = storage_path(self.current_client_dir[conn], remote_dir, self.storage.primary)
+        if direction not in ("push", "pull") or root is None:
+            conn.send_message("Usage: SYNC push|pull {folder} {algorithm} [delete] [checksum]\n", STATUS_ERROR)
+            return
+        if checksum and not self.check_algorithm(conn, algorithm):
+            return
+        try:
+            client = entries_to_manifest(entries)
+        except ValueError as e:
+            conn.send_message(f"{e}\n", STATUS_ERROR)
+            return
+        if not os.path.isdir(root):
+            if direction == "pull" or os.path.exists(root):
+                conn.send_message("Folder not found.\n", STATUS_ERROR)
+                return
+            self.storage.makedirs(root)
+            self.dir_cache.invalidate_tree(root)
+
+        server = build_manifest(root, self.scan_folder)
+        if checksum:
+            # Only same-size files are compared by content; their digests mostly come from the hash cache
+            for path, entry in server.items():
+                other = client.get(path)
+                if not entry[0] and other is not None and other[1] == entry[1]:
+                    entry[3] = self.file_digest(os.path.join(root, *path.split("/")), algorithm)
+        base = os.path.relpath(root, self.storage.primary).replace(os.sep, "/")
+        base = "" if base == "." else base
+
+        if direction == "pull":
+            copy, create, remove, conflicts = diff_manifests(server, client, delete, checksum)
+            conn.send_list({"base": base, "download": copy, "mkdir": create, "delete": remove,
+                            "conflicts": conflicts, "sizes": {path: server[path][1] for path in copy}})
+            return
+        copy, create, remove, conflicts = diff_manifests(client, server, delete, checksum)
+        for path in remove:
+            local = os.path.join(root, *path.split("/"))
+            if server[path][0]:
+                self.remove_folder(local)
+            else:
+                self.remove_file(local)
+        for path in create:
+            self.make_folder(os.path.join(root, *path.split("/")))
+        conn.send_list({"base": base, "upload": copy, "mkdir": create, "delete": remove, "conflicts": conflicts})
+
+    def scan_folder(self, path):
+        """sync.scan_directory served from the directory cache."""
+        listing = self.dir_cache.listing(path)
+        return zip(listing.names, listing.kinds, listing.sizes, listing.mtimes)
+
+    # Striped transfers: one file split into byte ranges over several connections.
+    # The connection that starts a transfer owns it; any authenticated connection may
+    # move ranges for it by id.
+    def stripe_upload(self, conn, filename, file_size):
+        """Handles STRIPE_UPLOAD: reserve a hidden temp file that ranges are written into."""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        filepath, exists = self.upload_target(filepath)
+        if filepath is None:
+            conn.send_message("Folder not found.\n", STATUS_ERROR)
+            return
+        root, _ = self.storage.split(filepath)
+        spool = os.path.join(root or self.storage.primary, UPLOAD_SPOOL)
+        os.makedirs(spool, exist_ok=True)
+        if file_size < 0 or file_size > shutil.disk_usage(spool).free:
+            conn.send_message("Invalid file size: it must fit in the free space of the storage.\n", STATUS_ERROR)
+            return
+        if exists:
+            response = conn.prompt("File exists. Overwrite? (y/n): ").strip().lower()
+            if response != 'y':
+                conn.send_message("Upload cancelled.\n", STATUS_ERROR)
+                return
+        transfer_id = secrets.token_hex(8)
+        temp_path = os.path.join(spool, f".{transfer_id}.stripe")
+        fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(fd, file_size)
+        with self.stripes_lock:
+            self.stripes[transfer_id] = {
+                "owner": conn, "kind": "upload", "filename": filename, "path": filepath,
+                "temp_path": temp_path, "fd": fd, "size": file_size, "ranges": [],
+                "writers": 0,  # STRIPE_PUTs writing into fd; it is only closed once there are none
+                "start_time": self.logger.start_timer(),
+            }
+        conn.send_message(transfer_id)
+
+    def stripe_download(self, conn, filename):
+        """Handles STRIPE_DOWNLOAD: register a file so ranges of it can be fetched by id."""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        filepath = self.storage.locate(filepath)
+        if not os.path.isfile(filepath):
+            conn.send_message("File not found.\n", STATUS_ERROR)
+            return
+        transfer_id = secrets.token_hex(8)
+        file_size = self.stored_size(filepath)
+        with self.stripes_lock:
+            self.stripes[transfer_id] = {"owner": conn, "kind": "download", "filename": filename,
+                                         "path": filepath, "size": file_size}
+        conn.send_message(f"{transfer_id} {file_size}")
+
+    def stripe_put(self, conn, transfer_id, offset):
+        """Handles STRIPE_PUT: write one range straight into place with pwrite."""
+        with self.stripes_lock:
+            stripe = self.stripes.get(transfer_id)
+            if stripe is None or stripe["kind"] != "upload":
+                conn.send_message("Unknown transfer.\n", STATUS_ERROR)
+                return
+            stripe["writers"] += 1  # a commit or abort now waits before closing the fd
+        range_size = None
+        try:
+            conn.send_message("Ready to receive range.")
+            start_time = self.logger.start_timer()
+            range_size, first_byte_at = conn.recv_file_at(stripe["fd"], offset, stripe["size"])
+        finally:
+            with self.stripes_idle:
+                if range_size is not None:
+                    stripe["ranges"].append((offset, range_size))
+                stripe["writers"] -= 1
+                self.stripes_idle.notify_all()
+        elapsed_time = time.time() - start_time
+        conn.send_trailer(f"Range of {format_size(range_size)} stored in {elapsed_time:.3f} seconds.\n",
+                          offset=offset, size=range_size, elapsed=elapsed_time)
+        self.logger.end_timer(
+            start_time=start_time,
+            operation="UPLOAD_RANGE",
+            filename=stripe["filename"],
+            file_size=range_size,
+            elapsed_time=elapsed_time,
+            response_time=first_byte_at - start_time
+        )
+
+    def stripe_get(self, conn, transfer_id, offset, length):
+        """Handles STRIPE_GET: send one range of a registered file."""
+        stripe = self.stripes.get(transfer_id)
+        if stripe is None or stripe["kind"] != "download":
+            conn.send_message("Unknown transfer.\n", STATUS_ERROR)
+            return
+        if offset < 0 or length < 0 or offset + length > stripe["size"]:
+            conn.send_message("Range is outside the file.\n", STATUS_ERROR)
+            return
+        conn.send_message("Ready to send range.")
+        start_time = self.logger.start_timer()
+        with self.locks.shared(stripe["path"]):
+            filepath = self.storage.locate(stripe["path"])  # a rebalance may have moved it since
+            if self.stored_size(filepath) != stripe["size"]:
+                raise ConnectionError("File changed during a striped download")  # the client must start over
+            cached = self.cached_file(filepath, stripe["size"])
+            if cached is not None:
+                conn.send_buffer(cached[offset:offset + length])
+            else:
+                with self.open_stored_file(filepath, offset) as f:
+                    conn.send_file(f, length)
+        elapsed_time = time.time() - start_time
+        conn.send_trailer(f"Range of {format_size(length)} sent in {elapsed_time:.3f} seconds.\n",
+                          offset=offset, size=length, elapsed=elapsed_time)
+        self.logger.end_timer(
+            start_time=start_time,
+            operation="DOWNLOAD_RANGE",
+            filename=stripe["filename"],
+            file_size=length,
+            elapsed_time=elapsed_time,
+            response_time=elapsed_time
+        )
+
+    def stripe_commit(self, conn, transfer_id, digest):
+        """Handles STRIPE_COMMIT: verify an upload and move it under its real name, or end a download."""
+        with self.stripes_lock:
+            stripe = self.stripes.get(transfer_id)
+            if stripe is None or stripe["owner"] is not conn:
+                conn.send_message("Unknown transfer.\n", STATUS_ERROR)
+                return
+            del self.stripes[transfer_id]
+        if stripe["kind"] == "download":
+            # The client checks what it assembled against this; a file replaced meanwhile will not match
+            try:
+                digest = self.file_digest(stripe["path"], "sha256")
+            except FileNotFoundError:
+                conn.send_message("File not found.\n", STATUS_ERROR)
+                return
+            conn.send_message(f"sha256 {digest}")
+            return
+
+        self.close_stripe(stripe)
+        if not ranges_cover(stripe["ranges"], stripe["size"]):
+            os.remove(stripe["temp_path"])
+            conn.send_message("Upload incomplete: some ranges are missing.\n", STATUS_ERROR)
+            return
+        with open(stripe["temp_path"], 'rb') as f:
+            actual = hashlib.file_digest(f, "sha256").hexdigest()
+        stat = os.stat(stripe["temp_path"])
+        if digest is not None and actual != digest:
+            os.remove(stripe["temp_path"])
+            conn.send_message("Upload corrupted: checksum mismatch.\n", STATUS_ERROR)
+            return
+        with self.locks.exclusive(stripe["path"]):
+            if not os.path.isdir(os.path.dirname(stripe["path"])):
+                os.remove(stripe["temp_path"])
+                conn.send_message("Upload failed: folder not found.\n", STATUS_ERROR)
+                return
+            self.release_stored_file(stripe["path"])
+            os.replace(stripe["temp_path"], stripe["path"])
+            self.drop_other_copies(stripe["path"])
+            self.dir_cache.invalidate(os.path.dirname(stripe["path"]))
+            self.file_cache.invalidate(stripe["path"])
+            self.hash_cache.put(stripe["path"], "sha256", actual, stat)  # already hashed to verify it
+
+        elapsed_time = time.time() - stripe["start_time"]
+        conn.send_message(f"File uploaded of size {format_size(stripe['size'])} over {len(stripe['ranges'])} "
+                          f"ranges successfully in {elapsed_time:.3f} seconds!\n")
+        self.logger.end_timer(
+            start_time=stripe["start_time"],
+            operation="UPLOAD",
+            filename=stripe["filename"],
+            file_size=stripe["size"],
+            elapsed_time=elapsed_time,
+            response_time=0
+        )
+
+    def abort_stripes(self, conn):
+        """Drop the unfinished striped transfers of a connection that went away."""
+        with self.stripes_lock:
+            abandoned = [tid for tid, stripe in self.stripes.items() if stripe["owner"] is conn]
+            stripes = [self.stripes.pop(tid) for tid in abandoned]
+        for stripe in stripes:
+            if stripe["kind"] == "upload":
+                self.close_stripe(stripe)
+                os.remove(stripe["temp_path"])
+
+    def close_stripe(self, stripe):
+        """Close the temp file of an upload taken out of self.stripes, once no STRIPE_PUT writes into it."""
+        with self.stripes_idle:
+            while stripe["writers"]:
+                self.stripes_idle.wait()
+        os.close(stripe["fd"])
+
+    # Function to delete file
+    def delete_file(self, conn, filename):
+        """Handles file deletion"""
+        filepath = self.client_path(conn, filename)
+        if filepath is None:
+            return
+        if not self.remove_file(filepath):
+            conn.send_message("File not found.\n", STATUS_ERROR)
+            return
+        conn.send_message("File deleted successfully.\n")
+
+    # File system changes shared by DELETE, SUBFOLDER and SYNC. Each checks and acts under
+    # the path's exclusive lock and returns False if there was nothing to do.
+    def remove_file(self, filepath):
+        with self.locks.exclusive(filepath):
+            filepath = self.storage.locate(filepath)
+            if not os.path.isfile(filepath):
+                return False
+            self.release_stored_file(filepath)
+            os.remove(filepath)
+            self.dir_cache.invalidate(os.path.dirname(filepath))
+            self.file_cache.invalidate(filepath)
+        return True
+
+    def make_folder(self, path):
+        with self.locks.exclusive(path):
+            if os.path.exists(path) or not os.path.isdir(os.path.dirname(path)):
+                return False
+            os.mkdir(path)
+            self.storage.makedirs(path)  # and in the other roots, for the files that hash to them
+            self.dir_cache.invalidate_tree(path)
+        return True
+
+    def remove_folder(self, path):
+        """Waits for the checks and renames inside the folder to finish, then deletes it.
+
+        Uploads still receiving their body are spooled elsewhere and fail at their rename.
+        """
+        with self.locks.exclusive(path):
+            if not os.path.isdir(path):
+                return False
+            for folder in self.storage.mirrors(path):
+                if not os.path.isdir(folder):
+                    continue
+                if self.chunk_store:
+                    self.chunk_store.release_tree(folder)
+                shutil.rmtree(folder)
+                self.file_cache.invalidate_tree(folder)
+            self.dir_cache.invalidate_tree(path)
+        return True
+
+    def drop_other_copies(self, filepath):
+        """Remove the copies of a file just written that sit in other roots, e.g. where a rebalance
+        moved the old version while the new one was on its way. Call under the file's exclusive lock."""
+        for copy in self.storage.mirrors(filepath):
+            if copy != os.path.normpath(filepath) and os.path.isfile(copy):
+                self.release_stored_file(copy)
+                os.remove(copy)
+                self.file_cache.invalidate(copy)
+
+
+    # Function to list files
+    def list_files(self, conn, args=()):
+        """Handles DIR: OP_LIST pages of [name, "f"/"d", size, mtime], then a trailer with the total.
+
+        Options like "sort=size order=desc type=file match=*.csv offset=0 limit=100"
+        pick the view and window; the trailer's "next" is the offset of the next page.
+        """
+        directory = self.current_client_dir[conn]
+        try:
+            options = parse_dir_options(args)
+        except ValueError as e:
+            conn.send_message(f"{e}\n", STATUS_ERROR)
+            return
+        with self.locks.shared(directory):
+            if not os.path.isdir(directory):
+                conn.send_message("Folder not found.\n", STATUS_ERROR)
+                return
+            if isinstance(conn, LegacyConnection):
+                conn.send_message("\n".join(self.dir_cache.listing(directory).names) + "\n")  # old clients get bare names
+                return
+            if options["sort"] == "none" and not options["reverse"]:
+                pages = None  # scan order: streamed below while the folder is read
+            else:
+                total, count, pages = self.dir_cache.snapshot(directory, **options)
+        # Either way a slow client does not keep the folder locked
+        if pages is None:
+            try:
+                total, count = self.dir_cache.stream(directory, conn.send_list, **options)
+            except FileNotFoundError:
+                conn.send_trailer("Folder not found.\n", STATUS_ERROR)  # deleted while it was read
+                return
+        else:
+            for page in pages:
+                conn.send_list(page)
+        offset = options["offset"]
+        conn.send_trailer(f"{count} of {total} entries.\n", total=total, offset=offset, count=count,
+                          next=offset + count if offset + count < total else None)
+
+    def sub_folder(self, conn, command, path):
+        """Create or delete a sub folder."""
+        path = storage_path(self.storage.primary, path.lower(), self.storage.primary)
+        if path is None or path == self.storage.primary:
+            conn.send_message("Invalid folder name.\n", STATUS_ERROR)
+            return
+        if command == 'CREATE':
+            if not self.make_folder(path):
+                conn.send_message("Folder already exists!\n" if os.path.exists(path) else "Parent folder not found.\n",
+                                  STATUS_ERROR)
+                return
+            conn.send_message("Folder created successfully.\n")
+        elif command == 'DELETE':
+            if not self.remove_folder(path):
+                conn.send_message("Folder not found.\n", STATUS_ERROR)
+                return
+            conn.send_message("Folder deleted successfully.\n")
+
+    def change_directory(self, conn, directory):
+        filepath = self.current_client_dir[conn]
+        directory = directory.lower()
+        if directory == "..":
+            if filepath == self.storage.primary:
+                conn.send_message("You are already at the root directory!\n", STATUS_ERROR)
+            else:
+                newPath = os.path.dirname(filepath)
+                self.current_client_dir[conn] = newPath
+                conn.send_message("File path changed to: " + newPath + "\n")
+        else:
+            filepath = storage_path(filepath, directory, self.storage.primary)
+            if filepath is None:
+                conn.send_message("Invalid folder name.\n", STATUS_ERROR)
+            elif os.path.isdir(filepath):
+                conn.send_message("File path changed to: " + filepath + "\n")
+                self.current_client_dir[conn] = filepath
+            else:
+                conn.send_message("File path not found.\n", STATUS_ERROR)
+
+    # Function to add or remove a storage root and move the files that change owner
+    def rebalance_command(self, conn, args):
+        """Handles REBALANCE [ADD|REMOVE {root}]: change the ring, then move every misplaced file.
+
+        Runs in this session's thread while the others carry on. Without arguments
+        it only moves files, e.g. after the server was restarted with other roots.
+        A removed root is searched until all its files have moved off it.
+        """
+        action = args[0].upper() if args else None
+        if action not in (None, "ADD", "REMOVE") or len(args) != (2 if action else 0):
+            conn.send_message("Usage: REBALANCE [ADD|REMOVE {root}]\n", STATUS_ERROR)
+            return
+        if not self.storage.lock.acquire(blocking=False):
+            conn.send_message("A rebalance is already running.\n", STATUS_ERROR)
+            return
+        try:
+            try:
+                if action == "ADD":
+                    self.storage.add(args[1])
+                elif action == "REMOVE":
+                    self.storage.remove(args[1])
+            except ValueError as e:
+                conn.send_message(f"{e}\n", STATUS_ERROR)
+                return
+            start_time = time.time()
+            moved, moved_bytes, left = self.rebalance()
+            for root in self.storage.roots:
+                if root not in self.storage.ring and left.get(root, 0) == 0:
+                    self.storage.drop(root)
+            elapsed_time = time.time() - start_time
+        finally:
+            self.storage.lock.release()
+        print(f"Rebalanced: {moved} files moved")
+        message = f"Moved {moved} file(s) of {format_size(moved_bytes)} in {elapsed_time:.3f} seconds.\n"
+        if left:
+            message += f"{sum(left.values())} file(s) could not be moved, see the server log; run REBALANCE again.\n"
+        conn.send_message(message + self.storage.describe())
+
+    def rebalance(self):
+        """Move every visible file that is not in the root owning it.
+
+        Returns (files moved, bytes moved, {root: files that failed to move}).
+        """
+        moved = moved_bytes = 0
+        left = {}
+        for root in self.storage.roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [name for name in dirnames if not name.startswith(".")]  # chunk store
+                for name in filenames:
+                    if name.startswith("."):  # partial uploads, stripes and caches stay where they are
+                        continue
+                    path = os.path.join(dirpath, name)
+                    target = self.storage.owner(path)
+                    if target == os.path.normpath(path):
+                        continue
+                    try:
+                        size = self.move_stored_file(path, target)
+                    except OSError as e:
+                        print(f"Error moving {path} to {target}: {e}")
+                        left[root] = left.get(root, 0) + 1
+                        continue
+                    if size is not None:
+                        moved += 1
+                        moved_bytes += size
+        return moved, moved_bytes, left
+
+    def move_stored_file(self, source, target):
+        """Move a file to another root under its exclusive lock. Returns its size, or None if it is gone."""
+        with self.locks.exclusive(source):  # the same lock as target: it is the same logical path
+            if not os.path.isfile(source):
+                return None
+            size = os.path.getsize(source)
+            if os.path.exists(target):
+                os.remove(source)  # left by a move that crashed halfway; the owner's copy is the one served
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.rename(source, target)  # roots on the same file system
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    temp_path = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.rebalance")
+                    shutil.copy2(source, temp_path)
+                    os.replace(temp_path, target)
+                    os.remove(source)
+            self.file_cache.invalidate(source)
+            self.dir_cache.invalidate(os.path.dirname(source))
+        return size
+
+# Driver code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="File server")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=4456)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="serve all clients from one asyncio event loop instead of a thread each")
+    parser.add_argument("--backlog", type=int, default=100, help="listen() backlog")
+    parser.add_argument("--max-connections", type=int, default=1000,
+                        help="concurrent clients allowed by the async server")
+    parser.add_argument("--io-workers", type=int, default=8,
+                        help="threads the async server uses for file I/O")
+    parser.add_argument("--chunk-store", action="store_true",
+                        help="enable deduplicated DUPLOAD storage in .chunks of the first storage root")
+    parser.add_argument("--storage-root", action="append", dest="storage_roots", metavar="DIR",
+                        help="directory to store files in, e.g. one per disk; repeat it to spread files over several "
+                             "by consistent hashing (default: server_storage). The first also keeps the caches")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--rate-limit", type=parse_rate, default=None,
+                        help="bandwidth of all transfers together, in bytes/s with an optional K/M/G suffix")
+    parser.add_argument("--user-rate-limit", type=parse_rate, default=None,
+                        help="bandwidth of all sessions of one user together")
+    parser.add_argument("--session-rate-limit", type=parse_rate, default=None,
+                        help="bandwidth of one session (connection)")
+    parser.add_argument("--file-cache", type=parse_size, default=0,
+                        help="memory for hot files served from RAM, e.g. 256M (off by default)")
+    parser.add_argument("--users", default=None,
+                        help="JSON file of accounts made with backend/auth.py (default: the built-in user)")
+    parser.add_argument("--token-ttl", type=int, default=TOKEN_TTL,
+                        help="seconds a session token from TOKEN stays valid")
+    args = parser.parse_args()
+    limits = (args.rate_limit, args.user_rate_limit, args.session_rate_limit)
+    storage_roots = args.storage_roots or [STORAGE_ROOT]
+    user_store = JsonUserStore(args.users) if args.users else None
+
+    if args.use_async:
+        if any(limit is not None for limit in limits) or args.file_cache:
+            parser.error("bandwidth limits and the file cache are only supported by the threaded server")
+        if len(storage_roots) > 1:
+            parser.error("several storage roots are only supported by the threaded server")
+        from async_server import AsyncFileServer
+        file_server = AsyncFileServer(host=args.host, port=args.port, backlog=args.backlog,
+                                      max_connections=args.max_connections, io_workers=args.io_workers,
+                                      metrics_port=args.metrics_port, user_store=user_store,
+                                      token_ttl=args.token_ttl, storage_root=storage_roots[0])
+    else:
+        file_server = FileServer(host=args.host, port=args.port, backlog=args.backlog,
+                                 chunk_store=args.chunk_store, metrics_port=args.metrics_port,
+                                 rate_limit=args.rate_limit, user_rate_limit=args.user_rate_limit,
+                                 session_rate_limit=args.session_rate_limit, file_cache_size=args.file_cache,
+                                 user_store=user_store, token_ttl=args.token_ttl, storage_roots=storage_roots)
+    file_server.start_server()
@@ -1,43 +1,184 @@
+## Transfer statistics: bounded in-memory columns, streamed to CSV in the background
+
+# import libraries
+import csv
+import os
+import threading
 import time
-import pandas as pd
+from array import array
+from collections import deque
+
+COLUMNS = ("operation", "filename", "start_time", "end_time", "elapsed_time",
+           "file_size", "wire_size", "data_rate", "response_time")
+# Numeric columns live in typed arrays: 8 bytes per value instead of a Python object
+NUMERIC_COLUMNS = {"start_time": "d", "end_time": "d", "elapsed_time": "d", "file_size": "q",
+                   "wire_size": "q", "data_rate": "d", "response_time": "d"}
 
 
 class StatisticsLogger:
-    def __init__(self):
-        self.stats = {
-            "operation": [],
-            "filename": [],
-            "start_time": [],
-            "end_time": [],
-            "elapsed_time": [],
-            "file_size": [],
-            "data_rate": [],
-            "response_time": [],
-        }
+    """Keeps the latest `max_records` records and, given a path, appends every record to a CSV file.
+
+    end_timer only appends a tuple to a bounded deque, which is thread-safe without a
+    lock, so logging from many client threads is cheap. Every `flush_interval` seconds
+    a background thread drains that queue into compact typed-array columns holding
+    the latest `max_records` records and appends the new records to the CSV file, so
+    a crash loses at most the last few seconds. When the queue is half full before
+    that, the logging thread that notices drains it itself, and at three quarters
+    loggers wait for the drain, so a burst slows logging down instead of losing
+    records.
+
+    Given a `metrics` object, every record is also passed to its observe_transfer so
+    live counters and histograms see the same transfers as the CSV.
+
+    Events that are not transfers, like hits of the hot-file cache, are tallied
+    with count() and read back with get_counters().
+    """
+
+    def __init__(self, path=None, max_records=100_000, flush_interval=5.0, queue_size=16_384, metrics=None):
+        self.path = path
+        self.metrics = metrics
+        self.capacity = max_records
+        self.flush_interval = flush_interval
+        self.pending = deque(maxlen=queue_size)
+        # Fixed-size ring of columns; record n lives at index n % max_records
+        self.columns = {name: array(code, bytes(array(code).itemsize * max_records))
+                        for name, code in NUMERIC_COLUMNS.items()}
+        self.columns["operation"] = [None] * max_records
+        self.columns["filename"] = [None] * max_records
+        self.stored = 0  # records moved into the ring since start
+        self.counters = {}  # event name -> count
+        self.counters_lock = threading.Lock()
+        self.lock = threading.Lock()  # guards the columns
+        self.flush_lock = threading.Lock()  # one drainer at a time
+        self.wakeup = threading.Event()  # set by close()
+        self.stopping = False
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
 
     def start_timer(self):
         """Start timer for an operation"""
         return time.time()
 
-    def end_timer(self, start_time, operation, filename="", file_size=0, elapsed_time=0, response_time=0):
-        """Record statistics for an operation"""
+    def end_timer(self, start_time, operation, filename="", file_size=0, elapsed_time=0, response_time=0,
+                  wire_size=None):
+        """Record statistics for an operation. wire_size is what crossed the network if it differs from file_size"""
         end_time = time.time()
         data_rate = file_size / elapsed_time if elapsed_time > 0 else 0
+        if wire_size is None:
+            wire_size = file_size
+        if self.metrics is not None:
+            self.metrics.observe_transfer(operation, file_size, wire_size, elapsed_time, response_time)
+        pending = self.pending
+        # Under a burst the background thread may not get the GIL often enough; help it out
+        if len(pending) * 2 >= pending.maxlen and self.flush_lock.acquire(blocking=len(pending) * 4 >= pending.maxlen * 3):
+            try:
+                if len(pending) * 2 >= pending.maxlen:
+                    self._flush()
+            finally:
+                self.flush_lock.release()
+        pending.append((operation, filename, start_time, end_time, elapsed_time,
+                        file_size, wire_size, data_rate, response_time))
+
+    def count(self, name, amount=1):
+        """Add amount to the counter of an event."""
+        with self.counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get_counters(self):
+        """Return a copy of the event counters."""
+        with self.counters_lock:
+            return dict(self.counters)
+
+    # Draining the queue
+    def _drain(self):
+        """Move queued records into the columns and return them as rows."""
+        pending = self.pending
+        rows = [pending.popleft() for _ in range(len(pending))]
+        if not rows:
+            return []
+        kept = rows[-self.capacity:]
+        with self.lock:
+            start = (self.stored + len(rows) - len(kept)) % self.capacity
+            first = min(len(kept), self.capacity - start)  # the rest wraps to the front
+            for name, values in zip(COLUMNS, zip(*kept)):
+                column = self.columns[name]
+                code = NUMERIC_COLUMNS.get(name)
+                values = array(code, values) if code else list(values)
+                column[start:start + first] = values[:first]
+                column[:len(kept) - first] = values[first:]
+            self.stored += len(rows)
+        return rows
+
+    def snapshot(self):
+        """Return the latest records as row tuples, oldest first."""
+        self.flush()
+        with self.lock:
+            count = min(self.stored, self.capacity)
+            start = (self.stored - count) % self.capacity
+            columns = [self.columns[name] for name in COLUMNS]
+            columns = [column[start:start + count] + column[:max(0, start + count - self.capacity)]
+                       for column in columns]
+        return list(zip(*columns))
+
+    # Persistence
+    def flush(self):
+        """Drain the queue and append the new records to the CSV file."""
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        """flush() for a caller that holds flush_lock."""
+        rows = self._drain()
+        if self.path is not None and (rows or not os.path.exists(self.path)):
+            self._write(rows)
+
+    def _write(self, rows):
+        new_file = self._prepare_file()
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(COLUMNS)
+            writer.writerows(rows)
+
+    def _prepare_file(self):
+        """Return True if the CSV needs a header. A file from an older column layout is moved aside."""
+        try:
+            with open(self.path, newline='') as f:
+                header = next(csv.reader(f), None)
+        except FileNotFoundError:
+            return True
+        if header is None:
+            return True
+        if tuple(header) != COLUMNS:
+            os.replace(self.path, self.path + ".old")
+            return True
+        return False
+
+    def _flush_loop(self):
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing statistics: {e}")
 
-        self.stats["operation"].append(operation)
-        self.stats["filename"].append(filename)
-        self.stats["start_time"].append(start_time)
-        self.stats["end_time"].append(end_time)
-        self.stats["elapsed_time"].append(elapsed_time)
-        self.stats["response_time"].append(response_time)
-        self.stats["file_size"].append(file_size)
-        self.stats["data_rate"].append(data_rate)
+    def close(self):
+        """Stop the background thread and write out what is left."""
+        self.stopping = True
+        self.wakeup.set()
+        self.flusher.join()
+        self.flush()
 
     def save_to_file(self, file_path):
-        """Save statistics to CSV file"""
-        df = pd.DataFrame(self.stats)
-        df.to_csv(file_path, index=False)
+        """Save the records still in memory to a CSV file"""
+        rows = self.snapshot()
+        with open(file_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
 
     def get_dataframe(self):
-        """Return statistics as Pandas dataframe"""
-        return pd.DataFrame(self.stats)
\ No newline at end of file
+        """Return the records still in memory as a Pandas dataframe"""
+        import pandas as pd  # only needed for analysis, so servers start without it
+        return pd.DataFrame(self.snapshot(), columns=list(COLUMNS))
@@ -0,0 +1,204 @@
+## Several storage roots (e.g. one per disk) behind one namespace, files placed by consistent hashing
+
+# import libraries
+import bisect
+import hashlib
+import os
+import threading
+
+VIRTUAL_NODES = 160  # points per root on the ring; more points spread the files more evenly
+
+
+def ring_hash(text):
+    """Position of a string on the ring: the first 8 bytes of its MD5 (stable across runs, unlike hash())."""
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes.
+
+    Every node is put on the ring at VIRTUAL_NODES points and a key belongs to the
+    node of the first point at or after the key's own position. Adding or removing
+    a node therefore only moves the keys of the arcs that node gains or loses,
+    about 1/n of them, instead of nearly all of them as hash(key) % n would.
+    """
+
+    def __init__(self, nodes=(), replicas=VIRTUAL_NODES):
+        self.replicas = replicas
+        self.nodes = []
+        self.points = []  # sorted ring positions
+        self.owners = []  # node of each point
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            point = ring_hash(f"{node}#{i}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node):
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def owner(self, key):
+        """The node a key belongs to."""
+        index = bisect.bisect_left(self.points, ring_hash(key))
+        return self.owners[index % len(self.points)]
+
+
+class StorageRoots:
+    """The storage roots of a server and where each file lives in them.
+
+    The first root is the primary one: it holds the hidden state (chunk store,
+    hash cache) and its paths are the "logical" paths that handlers and sessions
+    work with. Every folder exists in every root, so a client sees one tree, and
+    each file lives in exactly one root, the owner of its relative path on the
+    ring. Files stored before the ring changed stay where they are, and locate()
+    still finds them, until the server's rebalance moves them to their owner.
+
+    A root is named by its path, which is also its identity on the ring: keep
+    passing the same spelling for the same disk or its files will move.
+    """
+
+    def __init__(self, roots):
+        roots = list(dict.fromkeys(os.path.normpath(root) for root in roots))
+        if not roots:
+            raise ValueError("At least one storage root is needed")
+        for root in roots[1:]:
+            self.check_separate(root, roots[:roots.index(root)])
+        self.primary = roots[0]
+        self.roots = tuple(roots)  # replaced, never changed in place, so readers need no lock
+        self.ring = HashRing(roots)
+        self.lock = threading.Lock()  # one ring change or rebalance at a time
+        for root in roots:
+            os.makedirs(root, exist_ok=True)
+            self.copy_folders(root)
+
+    @staticmethod
+    def check_separate(root, roots):
+        """Raise ValueError if root is one of roots or nested inside one of them (or the other way round)."""
+        for other in roots:
+            relative = os.path.relpath(root, other)
+            if relative == "." or not relative.startswith(".."):
+                raise ValueError(f"{root} is inside the storage root {other}")
+            if not os.path.relpath(other, root).startswith(".."):
+                raise ValueError(f"The storage root {other} is inside {root}")
+
+    def split(self, path):
+        """Return (root, relative path) for a path inside one of the roots, or (None, None)."""
+        path = os.path.normpath(path)
+        for root in self.roots:
+            relative = os.path.relpath(path, root)
+            if relative != ".." and not relative.startswith(".." + os.sep):
+                return root, relative
+        return None, None
+
+    # Path mapping
+    def logical(self, path):
+        """The path of the same file or folder in the primary root."""
+        if len(self.roots) == 1:
+            return path
+        root, relative = self.split(path)
+        if root is None or root == self.primary:
+            return path
+        return os.path.normpath(os.path.join(self.primary, relative))
+
+    def mirrors(self, path):
+        """The same folder in every root, the primary one first."""
+        roots = self.roots
+        if len(roots) == 1:
+            return [os.path.normpath(path)]
+        root, relative = self.split(path)
+        if root is None:
+            return [os.path.normpath(path)]
+        return [os.path.normpath(os.path.join(root, relative)) for root in roots]
+
+    def owner(self, path):
+        """Where a file belongs: the path in the root that owns it on the ring."""
+        if len(self.roots) == 1:
+            return os.path.normpath(path)  # the last root on the ring cannot be removed, so it owns everything
+        root, relative = self.split(path)
+        if root is None or relative == ".":
+            return os.path.normpath(path)
+        return os.path.normpath(os.path.join(self.ring.owner(relative.replace(os.sep, "/")), relative))
+
+    def locate(self, path):
+        """Where a file is: its owner's path, unless it still sits in another root.
+
+        New files get the owner's path, so this is also where to write one.
+        """
+        owner = self.owner(path)
+        if len(self.roots) == 1 or os.path.lexists(owner):
+            return owner
+        for candidate in self.mirrors(path):
+            if candidate != owner and os.path.isfile(candidate):
+                return candidate
+        return owner
+
+    def makedirs(self, path):
+        """Create a folder in every root."""
+        for folder in self.mirrors(path):
+            os.makedirs(folder, exist_ok=True)
+
+    def copy_folders(self, root):
+        """Give a root the folders of the primary root that it lacks."""
+        if root == self.primary:
+            return
+        for dirpath, dirnames, _ in os.walk(self.primary):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            os.makedirs(os.path.join(root, os.path.relpath(dirpath, self.primary)), exist_ok=True)
+
+    # Changing the roots; the caller moves the files afterwards
+    def add(self, root):
+        """Put a root on the ring and give it the folder tree of the primary root."""
+        root = os.path.normpath(root)
+        if root in self.roots:
+            if root in self.ring:
+                raise ValueError(f"{root} is already a storage root")
+        else:
+            if not os.path.isdir(root):
+                raise ValueError(f"{root} is not a directory")
+            self.check_separate(root, self.roots)
+        self.copy_folders(root)
+        if root not in self.roots:
+            self.roots = self.roots + (root,)
+        ring = HashRing(self.ring.nodes)
+        ring.add(root)
+        self.ring = ring
+
+    def remove(self, root):
+        """Take a root off the ring. It is still searched until drop() once its files have moved."""
+        root = os.path.normpath(root)
+        if root not in self.ring:
+            raise ValueError(f"{root} is not a storage root")
+        if len(self.ring) == 1:
+            raise ValueError("Cannot remove the last storage root")
+        ring = HashRing(self.ring.nodes)
+        ring.remove(root)
+        self.ring = ring
+
+    def drop(self, root):
+        """Stop searching a root that is off the ring. The primary root always stays."""
+        if root != self.primary and root not in self.ring:
+            self.roots = tuple(r for r in self.roots if r != root)
+
+    def describe(self):
+        """One line per root: its path and whether it takes files."""
+        lines = []
+        for root in self.roots:
+            role = "on the ring" if root in self.ring else "draining" if root != self.primary else "folders only"
+            lines.append(f"{root}: {role}{' (primary)' if root == self.primary else ''}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,105 @@
+## Many small transfers: one blocking client in a loop vs the asyncio client over a pool
+#
+# Usage: python benchmarks/bench_async_client.py [files] [file size KB]
+# Uploads and then downloads `files` files, first one after the other on one
+# FileClient, then with AsyncClientPool at 1, 4, 16 and 64 connections, against
+# the threaded and the asyncio server. Every download is checked against the
+# original. Reports files/s and MB/s.
+
+# import libraries
+import asyncio
+import filecmp
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+from client import FileClient
+from async_client import AsyncClientPool
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, *options):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), *options],
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def run_blocking(port, names):
+    with FileClient("127.0.0.1", port) as client:
+        client.connect("user", "pass")
+        start = time.perf_counter()
+        for name in names:
+            client.upload_file(name, overwrite=True)
+        middle = time.perf_counter()
+        for name in names:
+            client.download_file(name, overwrite=True)
+        return middle - start, time.perf_counter() - middle
+
+
+async def run_async(port, names, connections):
+    async with AsyncClientPool("127.0.0.1", port, "user", "pass", size=connections) as pool:
+        # Log every connection in before the clock starts, as a long running program would have
+        await asyncio.gather(*(pool.run("server_stats") for _ in range(connections)))
+        start = time.perf_counter()
+        await asyncio.gather(*(pool.run("upload_file", name, overwrite=True) for name in names))
+        middle = time.perf_counter()
+        await asyncio.gather(*(pool.run("download_file", name, overwrite=True) for name in names))
+        return middle - start, time.perf_counter() - middle
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    size = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 64 * 1024
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "server_storage"))
+        local_dir = os.path.join(workdir, "client")
+        os.makedirs(local_dir)
+        os.chdir(local_dir)
+        names = [f"f{i:05d}.bin" for i in range(files)]
+        for name in names:
+            with open(name, "wb") as f:
+                f.write(os.urandom(size))
+            os.link(name, f"original_{name}")
+
+        print(f"{files} files of {size // 1024} KB, upload then download")
+        print(f"{'server':<9} {'client':<18} {'up files/s':>11} {'down files/s':>13} {'MB/s':>8}")
+        for label, options in (("threaded", ()), ("asyncio", ("--async",))):
+            process, port = start_server(workdir, *options)
+            try:
+                runs = [("blocking, 1", lambda: run_blocking(port, names))]
+                runs += [(f"asyncio, {n}", lambda n=n: asyncio.run(run_async(port, names, n))) for n in (1, 4, 16, 64)]
+                for client, run in runs:
+                    up, down = run()
+                    for name in names:
+                        assert filecmp.cmp(name, f"original_{name}", shallow=False), f"{name} differs"
+                    print(f"{label:<9} {client:<18} {files / up:11.0f} {files / down:13.0f} "
+                          f"{2 * files * size / (up + down) / 1e6:8.1f}")
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait(timeout=30)
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+## Check that bandwidth limits hold with several concurrent clients
+#
+# Usage: python benchmarks/bench_bandwidth.py [seconds per case] [tolerance]
+# Starts a server with bandwidth limits, runs several clients that download or
+# upload at the same time and compares the rates they measured with the
+# configured limits: every session should get its fair share and the total
+# should stay within tolerance (10% by default) of the limit. A separate client
+# times DIR while the transfers run, to show that commands do not queue behind
+# bulk data. Exits with status 1 if any check fails.
+
+# import libraries
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+from client import FileClient
+from results import ClientError
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+MB = 1024 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, *options):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), *options],
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def connect(port):
+    client = FileClient("127.0.0.1", port)
+    client.connect("user", "pass")
+    return client
+
+
+def transfer(port, operation, name, rates, barrier):
+    """Download or upload one file on its own session and record its rate in bytes/s."""
+    client = connect(port)
+    barrier.wait()
+    start = time.perf_counter()
+    try:
+        client.download_file(name) if operation == "download" else client.upload_file(name)
+        rates.append(os.path.getsize(name) / (time.perf_counter() - start))
+    except ClientError:
+        rates.append(0)
+    client.send_command("QUIT")
+    client.disconnect()
+
+
+def time_commands(port, stop, latencies):
+    """Run DIR every 20 ms until stop is set and record how long each one took."""
+    client = connect(port)
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.list_dir(lambda entries: None, limit=10)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.02)
+    client.send_command("QUIT")
+    client.disconnect()
+
+
+def run_case(port, operation, clients, size, workdir):
+    """Run `clients` transfers of `size` bytes at once; returns (per-session rates, total rate, DIR latencies)."""
+    names = [f"{operation}_{i}.bin" for i in range(clients)]
+    for name in names:
+        stored = os.path.join(workdir, "server_storage", name)
+        for stale in (name, stored):  # neither side may have to ask about overwriting
+            if os.path.exists(stale):
+                os.remove(stale)
+        with open(stored if operation == "download" else name, "wb") as f:
+            f.write(os.urandom(size))
+
+    rates, latencies = [], []
+    barrier = threading.Barrier(clients + 1)
+    stop = threading.Event()
+    threads = [threading.Thread(target=transfer, args=(port, operation, name, rates, barrier)) for name in names]
+    timer = threading.Thread(target=time_commands, args=(port, stop, latencies))
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    timer.start()
+    for thread in threads:
+        thread.join()
+    total = clients * size / (time.perf_counter() - start)
+    stop.set()
+    timer.join()
+    return rates, total, latencies
+
+
+def check(label, measured, limit, tolerance, failures):
+    ok = abs(measured - limit) <= tolerance * limit
+    print(f"    {label:<22} {measured / MB:7.2f} MB/s (limit {limit / MB:.2f}) {'ok' if ok else 'FAIL'}")
+    if not ok:
+        failures.append(label)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 0.10
+    failures = []
+
+    # (description, server options, runtime LIMIT changes, operation, clients, per-session limit, total limit)
+    cases = [
+        ("global 8M, 4 downloads", ["--rate-limit", "8M"], [], "download", 4, 2 * MB, 8 * MB),
+        ("session 2M, 3 downloads", ["--session-rate-limit", "2M"], [], "download", 3, 2 * MB, 6 * MB),
+        ("user 4M, 4 downloads", ["--user-rate-limit", "4M"], [], "download", 4, 1 * MB, 4 * MB),
+        ("session 2M, 2 uploads", ["--session-rate-limit", "2M"], [], "upload", 2, 2 * MB, 4 * MB),
+        ("session 1M + global 4M, 6 downloads", ["--session-rate-limit", "1M", "--rate-limit", "4M"], [],
+         "download", 6, 4 * MB / 6, 4 * MB),
+        ("LIMIT global 4M -> 12M at runtime", ["--rate-limit", "4M"], [("global", "12M")],
+         "download", 4, 3 * MB, 12 * MB),
+    ]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "server_storage"))
+        client_dir = os.path.join(workdir, "client")
+        os.makedirs(client_dir)
+        os.chdir(client_dir)
+        for description, options, changes, operation, clients, share, limit in cases:
+            process, port = start_server(workdir, *options)
+            try:
+                control = connect(port)
+                for scope, rate in changes:
+                    control.bandwidth_limit(scope, rate)
+                idle = []
+                for _ in range(20):
+                    start = time.perf_counter()
+                    control.list_dir(lambda entries: None, limit=10)
+                    idle.append(time.perf_counter() - start)
+                rates, total, latencies = run_case(port, operation, clients, int(share * seconds), workdir)
+                report = control.bandwidth_limit()
+                control.send_command("QUIT")
+                control.disconnect()
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait(timeout=30)
+
+            print(f"{description}:")
+            for i, rate in enumerate(rates):
+                check(f"session {i + 1}", rate, share, tolerance, failures)
+            check("all sessions", total, limit, tolerance, failures)
+            print(f"    DIR latency: idle median {statistics.median(idle) * 1000:.1f} ms, during transfers "
+                  f"median {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms "
+                  f"({len(latencies)} requests)")
+            print("    " + report.strip().splitlines()[-1])
+        os.chdir(ROOT)
+
+    if failures:
+        print(f"{len(failures)} check(s) outside {tolerance:.0%} of the limit")
+        sys.exit(1)
+    print(f"All rates within {tolerance:.0%} of the limits")
+
+
+if __name__ == "__main__":
+    main()
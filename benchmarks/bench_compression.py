@@ -0,0 +1,88 @@
+## Wall time and bytes on the wire of compressed transfers
+#
+# Usage: python benchmarks/bench_compression.py [size_in_MB] [link_Mbit/s]
+# Sends a compressible corpus (CSV log lines) and an incompressible one (random
+# bytes) over loopback with every compression mode. Loopback is faster than any
+# codec, so the last column estimates the time on a link of the given speed:
+# the slower of the codec and the link sets the pace.
+
+# import libraries
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import FramedConnection
+from compression import CODECS
+
+
+def loopback_pair():
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def make_corpus(kind, size):
+    if kind == "random":
+        return os.urandom(size)
+    rng = random.Random(1)
+    lines = []
+    total = 0
+    while total < size:
+        line = (f"2024-05-{rng.randrange(1, 29):02d} {rng.randrange(24):02d}:{rng.randrange(60):02d},"
+                f"{rng.choice(['GET', 'POST', 'PUT'])},/api/v1/files/{rng.randrange(10000)},"
+                f"{rng.choice([200, 200, 200, 404, 500])},{rng.randrange(5000)}\n").encode()
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)[:size]
+
+
+def run(path, size, compression):
+    sender, receiver = loopback_pair()
+    sending = FramedConnection(sender)
+
+    def send():
+        with open(path, "rb") as f:
+            sending.send_file(f, size, compression=compression)
+
+    thread = threading.Thread(target=send)
+    start = time.perf_counter()
+    thread.start()
+    with open(os.devnull, "wb") as sink:
+        received, _ = FramedConnection(receiver).recv_file(sink)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    assert received == size
+    return elapsed, sending.last_wire_size
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 64 * 1024 * 1024
+    link = float(sys.argv[2]) if len(sys.argv) > 2 else 100.0
+    modes = ["none"] + [f"auto:{codec}" for codec in CODECS] + list(CODECS)
+
+    print(f"{'corpus':>7} {'mode':>10} {'wire MB':>9} {'ratio':>6} {'loopback s':>11} {f'{link:g} Mbit/s s':>13}")
+    for kind in ("csv", "random"):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(make_corpus(kind, size))
+            path = f.name
+        try:
+            for mode in modes:
+                elapsed, wire_size = run(path, size, mode)
+                on_link = max(elapsed, wire_size * 8 / (link * 1e6))
+                print(f"{kind:>7} {mode:>10} {wire_size / 1e6:9.2f} {size / wire_size:6.2f} "
+                      f"{elapsed:11.3f} {on_link:13.3f}")
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
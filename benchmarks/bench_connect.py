@@ -0,0 +1,135 @@
+## Latency of connecting and running a first command: password login, token login and a pool
+#
+# Usage: python benchmarks/bench_connect.py [sessions] [threads]
+# Each session runs one STAT. "password" opens a new connection and logs in
+# with the password every time, as every client did before session tokens;
+# "token" opens a new connection and logs in with a session token; "pool"
+# borrows an already logged-in connection from a ClientPool. Reports median and
+# p99 of connect + first reply, with one thread and with several at once, and
+# the server's own AUTH / AUTH_TOKEN times from STATS.
+
+# import libraries
+import hashlib
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+sys.path.append(os.path.join(ROOT, "common"))
+from client import FileClient
+from client_pool import ClientPool
+from protocol import STATUS_OK, TOKEN_PREFIX
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+PASSWORD_HASH = hashlib.sha256(b"pass").hexdigest()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, *options):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), *options],
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def fresh_session(port, secret):
+    """Connect, log in with secret as sent on the wire and run STAT."""
+    client = FileClient("127.0.0.1", port)
+    client.client_socket.connect(("127.0.0.1", port))
+    status, response = client.send_credentials("user", secret)
+    if status != STATUS_OK:
+        raise ConnectionError(response.strip())
+    status, response = client.request("STAT probe.txt")
+    client.send_command("QUIT")
+    client.disconnect()
+    return status
+
+
+def run(session, sessions, threads):
+    """Run `sessions` sessions over `threads` threads; returns the latency of each in ms."""
+    latencies = []
+    barrier = threading.Barrier(threads)
+
+    def worker(count):
+        barrier.wait()
+        for _ in range(count):
+            start = time.perf_counter()
+            if session() != STATUS_OK:
+                raise RuntimeError("STAT failed")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=worker, args=(sessions // threads,)) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    latencies.sort()
+    return latencies
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "server_storage"))
+        with open(os.path.join(workdir, "server_storage", "probe.txt"), "w") as f:
+            f.write("probe\n")
+        process, port = start_server(workdir)
+        try:
+            owner = FileClient("127.0.0.1", port)
+            owner.client_socket.connect(("127.0.0.1", port))
+            owner.send_credentials("user", PASSWORD_HASH)
+            token = owner.session_token()
+
+            with ClientPool("127.0.0.1", port, "user", "pass", size=threads) as pool:
+                for _ in range(threads):  # fill the pool, as a long running program would have
+                    with pool.connection():
+                        pass
+                modes = [
+                    ("password", lambda: fresh_session(port, PASSWORD_HASH)),
+                    ("token", lambda: fresh_session(port, TOKEN_PREFIX + token)),
+                    ("pool", lambda: pool.request("STAT probe.txt")[0]),
+                ]
+                print(f"{sessions} sessions of connect + STAT, latency in ms")
+                print(f"{'mode':<10} {'threads':>7} {'p50':>8} {'p99':>8} {'sessions/s':>11}")
+                for label, session in modes:
+                    for count in (1, threads):
+                        start = time.perf_counter()
+                        latencies = run(session, sessions, count)
+                        rate = len(latencies) / (time.perf_counter() - start)
+                        print(f"{label:<10} {count:>7} {statistics.median(latencies):8.2f} "
+                              f"{latencies[int(len(latencies) * 0.99)]:8.2f} {rate:11.0f}")
+
+            stats = owner.server_stats()
+            owner.send_command("QUIT")
+            owner.disconnect()
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=30)
+    print("\nServer side:")
+    for line in stats.splitlines():
+        if line.split()[:1] in (["AUTH"], ["AUTH_TOKEN"]):
+            print("  " + line)
+
+
+if __name__ == "__main__":
+    main()
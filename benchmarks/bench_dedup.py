@@ -0,0 +1,102 @@
+## Bytes on the wire and on disk for repeated uploads of slightly changed files
+#
+# Usage: python benchmarks/bench_dedup.py [size_in_MB] [versions]
+# Each version inserts a few bytes and overwrites a small block of the previous
+# one, like a rebuilt artifact. Plain UPLOAD is compared with DUPLOAD to a server
+# running the chunk store.
+
+# import libraries
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+from client import FileClient
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+
+
+def start_server(workdir, extra_args):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    os.makedirs(os.path.join(workdir, "server_storage"))
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port)] + extra_args,
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, _, names in os.walk(directory) for name in names)
+
+
+def make_versions(size, count):
+    rng = random.Random(42)
+    data = bytearray(os.urandom(size))
+    versions = [bytes(data)]
+    for _ in range(count - 1):
+        position = rng.randrange(len(data))
+        data[position:position] = os.urandom(rng.randrange(1, 200))  # insertion shifts everything after it
+        position = rng.randrange(len(data) - 4096)
+        data[position:position + 4096] = os.urandom(4096)
+        versions.append(bytes(data))
+    return versions
+
+
+def run(mode, versions, workdir):
+    process, port = start_server(workdir, ["--chunk-store"] if mode == "DUPLOAD" else [])
+    client = FileClient("127.0.0.1", port)
+    rows = []
+    try:
+        client.connect("user", "pass")
+        for i, data in enumerate(versions):
+            name = f"build_{i}.bin"
+            with open(name, "wb") as f:
+                f.write(data)
+            start = time.perf_counter()
+            if mode == "DUPLOAD":
+                wire_bytes = client.upload_dedup(name)["stats"]["wire_bytes"]
+            else:
+                client.upload_file(name)
+                wire_bytes = len(data)
+            elapsed = time.perf_counter() - start
+            os.remove(name)
+            rows.append((name, wire_bytes, disk_usage(os.path.join(workdir, "server_storage")), elapsed))
+        client.send_command("QUIT")
+    finally:
+        client.disconnect()
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=10)
+    return rows
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 32 * 1024 * 1024
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    versions = make_versions(size, count)
+
+    for mode in ("UPLOAD", "DUPLOAD"):
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            print(f"{mode}")
+            print(f"{'file':>14} {'wire MB':>9} {'disk MB total':>14} {'seconds':>8}")
+            for name, wire_bytes, disk_bytes, elapsed in run(mode, versions, workdir):
+                print(f"{name:>14} {wire_bytes / 1e6:9.2f} {disk_bytes / 1e6:14.2f} {elapsed:8.2f}")
+            os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
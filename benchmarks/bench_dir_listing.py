@@ -0,0 +1,124 @@
+## Time to first page and memory of DIR on a huge directory
+#
+# Usage: python benchmarks/bench_dir_listing.py [entries] [directory]
+# Fills a directory with empty files (1M by default; kept if it already has them)
+# and lists it over loopback the old way (os.listdir joined into one message) and
+# through DirectoryCache: cold in scan order (streamed while scanning), cold
+# sorted by name, then warm pages, sorted and filtered, from the cache.
+
+# import libraries
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from directory_cache import DirectoryCache
+from protocol import FramedConnection, OP_DONE
+
+
+def loopback_pair():
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def fill(directory, entries):
+    os.makedirs(directory, exist_ok=True)
+    existing = len(os.listdir(directory))
+    for i in range(existing, entries):
+        os.close(os.open(os.path.join(directory, f"file_{i:07d}.dat"), os.O_CREAT | os.O_WRONLY, 0o644))
+
+
+def old_dir(conn, directory):
+    names = [name for name in os.listdir(directory) if not name.startswith(".")]
+    conn.send_message("\n".join(names) + "\n")
+
+
+def new_dir(cache, **options):
+    def serve(conn, directory):
+        total, count = cache.stream(directory, conn.send_list, **options)
+        conn.send_trailer("", total=total, count=count)
+    return serve
+
+
+def run(serve, directory):
+    """Return (seconds to the first frame, seconds to the end, entries received)."""
+    client, server = loopback_pair()
+    conn = FramedConnection(server)
+    thread = threading.Thread(target=serve, args=(conn, directory))
+    receiving = FramedConnection(client)
+    start = time.perf_counter()
+    thread.start()
+    first = None
+    received = 0
+    while True:
+        opcode, _, payload = receiving.recv_frame()
+        if first is None:
+            first = time.perf_counter() - start
+        if opcode == OP_DONE:
+            break
+        if payload.startswith(b"["):
+            received += len(json.loads(payload))
+        else:
+            received += payload.count(b"\n")
+            break
+    total = time.perf_counter() - start
+    thread.join()
+    client.close()
+    server.close()
+    return first, total, received
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    directory = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), f"dir_bench_{entries}")
+    start = time.perf_counter()
+    fill(directory, entries)
+    print(f"{entries:,} entries in {directory} (ready in {time.perf_counter() - start:.1f} s)")
+
+    cache = DirectoryCache()
+    cases = [
+        ("old: listdir, one message", old_dir, False),
+        ("cold, scan order, page 1", new_dir(cache, sort="none", limit=1000), True),
+        ("cold, sort=name, page 1", new_dir(cache, sort="name", limit=1000), True),
+        ("warm, sort=name, page 1", new_dir(cache, sort="name", limit=1000), False),
+        ("warm, sort=size desc, page 1", new_dir(cache, sort="size", reverse=True, limit=1000), False),
+        ("warm, match=*99.dat, page 1", new_dir(cache, match="*99.dat", limit=1000), False),
+        ("warm, sort=name, page 500", new_dir(cache, sort="name", offset=499_000, limit=1000), False),
+        ("warm, sort=name, everything", new_dir(cache, sort="name"), False),
+    ]
+    print(f"{'request':>30} {'first frame s':>13} {'total s':>8} {'entries':>9}")
+    for name, serve, cold in cases:
+        if cold:
+            cache.invalidate(directory)
+        first, total, received = run(serve, directory)
+        print(f"{name:>30} {first:13.3f} {total:8.3f} {received:9,}")
+
+    # Memory is measured separately: tracing slows every allocation down
+    tracemalloc.start()
+    names = os.listdir(directory)
+    _, peak = tracemalloc.get_traced_memory()
+    del names
+    tracemalloc.stop()
+    print(f"listdir names: peak {peak / 1e6:.1f} MB")
+
+    tracemalloc.start()
+    listing = DirectoryCache().scan(directory)
+    held, peak = tracemalloc.get_traced_memory()
+    listing.view("name")
+    with_view, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"cached listing: {held / 1e6:.1f} MB held ({peak / 1e6:.1f} MB peak), "
+          f"{with_view / 1e6:.1f} MB with the name order")
+
+
+if __name__ == "__main__":
+    main()
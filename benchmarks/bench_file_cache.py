@@ -0,0 +1,136 @@
+## Repeated downloads of popular files with and without the hot-file cache
+#
+# Usage: python benchmarks/bench_file_cache.py [clients] [downloads per client] [files] [file size MB]
+# Starts the server with plain storage and with --chunk-store, each with the
+# cache off and with --file-cache big enough for the popular files, and lets
+# several clients download random files of that set at the same time. Reports
+# throughput, per-download latency and the cache counters from STATS. The
+# clients throw the data away so the numbers are the server's.
+
+# import libraries
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+from client import FileClient
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+
+
+class Discard:
+    def write(self, data):
+        return len(data)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, *options):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), *options],
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def connect(port):
+    client = FileClient("127.0.0.1", port)
+    client.connect("user", "pass")
+    return client
+
+
+def downloader(client, names, downloads, seed, barrier, latencies):
+    pick = random.Random(seed)
+    sink = Discard()
+    barrier.wait()
+    for _ in range(downloads):
+        start = time.perf_counter()
+        status, response = client.request(f"DOWNLOAD {pick.choice(names)} 0 sha256 none")
+        client.conn.recv_file(sink)
+        client.conn.recv_trailer()
+        latencies.append(time.perf_counter() - start)
+    client.send_command("QUIT")
+    client.disconnect()
+
+
+def run(workdir, options, names, clients, downloads, file_size):
+    process, port = start_server(workdir, *options)
+    try:
+        if "--chunk-store" in options:
+            # Store the files deduplicated: they become manifests of chunks
+            uploader = connect(port)
+            for name in names:
+                uploader.upload_dedup(name, overwrite=True)
+            uploader.send_command("QUIT")
+            uploader.disconnect()
+        latencies = []
+        barrier = threading.Barrier(clients + 1)
+        threads = [threading.Thread(target=downloader, args=(connect(port), names, downloads, i, barrier, latencies))
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        reporter = connect(port)
+        stats = reporter.server_stats()
+        reporter.send_command("QUIT")
+        reporter.disconnect()
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=30)
+    latencies.sort()
+    cache_line = next((line for line in stats.splitlines() if line.startswith("file cache")), "cache off")
+    return (clients * downloads * file_size / elapsed / 2 ** 20, statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000, cache_line)
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    downloads = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    file_size = int(float(sys.argv[4]) * 2 ** 20) if len(sys.argv) > 4 else 2 ** 20
+    cache = f"{files * file_size * 2 // 2 ** 20 + 1}M"
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "source")
+        os.makedirs(source)
+        os.makedirs(os.path.join(workdir, "server_storage"))
+        names = [f"hot_{i:03d}.bin" for i in range(files)]
+        for name in names:
+            data = os.urandom(file_size)
+            for folder in (source, os.path.join(workdir, "server_storage")):
+                with open(os.path.join(folder, name), "wb") as f:
+                    f.write(data)
+        os.chdir(source)  # DUPLOAD names the server file after the local path
+
+        print(f"{clients} clients x {downloads} downloads of {files} files of {file_size / 2 ** 20:.1f} MB")
+        print(f"{'storage':<14} {'cache':<8} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8}  counters")
+        for storage, base in (("plain", []), ("chunk store", ["--chunk-store"])):
+            for label, extra in (("off", []), (cache, ["--file-cache", cache])):
+                rate, p50, p99, counters = run(workdir, base + extra, names, clients, downloads, file_size)
+                print(f"{storage:<14} {label:<8} {rate:8.1f} {p50:8.2f} {p99:8.2f}  {counters}")
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+## CPU cost of verifying transfers with each digest algorithm
+#
+# Usage: python benchmarks/bench_hashing.py [size_in_MB]
+# A loopback transfer is run without a digest (sendfile), then hashed on both
+# ends the way uploads and downloads verify themselves, once per algorithm.
+
+# import libraries
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import FramedConnection
+from transfer import HASH_ALGORITHMS, new_hasher
+
+
+def loopback_pair():
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def run(path, size, algorithm):
+    sender, receiver = loopback_pair()
+    cpu = {}
+
+    def send():
+        start = time.thread_time()
+        with open(path, "rb") as f:
+            FramedConnection(sender).send_file(f, size, new_hasher(algorithm) if algorithm else None)
+        cpu["send"] = time.thread_time() - start
+
+    thread = threading.Thread(target=send)
+    start = time.perf_counter()
+    thread.start()
+    recv_start = time.thread_time()
+    with open(os.devnull, "wb") as sink:
+        FramedConnection(receiver).recv_file(sink, new_hasher(algorithm) if algorithm else None)
+    cpu["recv"] = time.thread_time() - recv_start
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return elapsed, cpu
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 512 * 1024 * 1024
+    gigabytes = size / 1024 ** 3
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(size // len(block)):
+            f.write(block)
+        path = f.name
+
+    try:
+        print(f"{'digest':>8} {'MB/s':>9} {'send CPU s/GB':>14} {'recv CPU s/GB':>14}")
+        for algorithm in (None,) + HASH_ALGORITHMS:
+            elapsed, cpu = run(path, size, algorithm)
+            print(f"{algorithm or 'none':>8} {size / elapsed / 1e6:9.1f} "
+                  f"{cpu['send'] / gigabytes:14.3f} {cpu['recv'] / gigabytes:14.3f}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+## Cost of recording commands and transfers in the live metrics
+#
+# Usage: python benchmarks/bench_metrics.py [records_per_thread] [threads]
+# Times Metrics.observe_command from one thread and from many at once, plus
+# the full per-transfer path through StatisticsLogger, and checks the counts.
+
+# import libraries
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from metrics import Metrics
+from statistics_logger import StatisticsLogger
+
+COMMANDS = ("UPLOAD", "DOWNLOAD", "DIR", "CD", "DELETE", "STAT", "HASH", "MUPLOAD")
+
+
+def run(record, records, threads):
+    barrier = threading.Barrier(threads + 1)
+
+    def work(n):
+        command = COMMANDS[n % len(COMMANDS)]
+        barrier.wait()
+        for i in range(records):
+            record(command, i)
+
+    workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    print(f"{'path':>28} {'threads':>7} {'ns/record':>10}")
+    for count in (1, threads):
+        metrics = Metrics()
+        elapsed = run(lambda command, i: metrics.observe_command(command, i * 1e-6), records, count)
+        metrics.summary()  # folds in what is still queued
+        assert sum(h.count for h in metrics.commands.values()) == records * count
+        print(f"{'observe_command':>28} {count:>7} {elapsed / (records * count) * 1e9:10.0f}")
+
+        metrics = Metrics()
+        logger = StatisticsLogger(metrics=metrics)
+        elapsed = run(lambda command, i: logger.end_timer(1.0, "UPLOAD", "f.bin", 1024, 0.01, 0.001),
+                      records, count)
+        logger.close()
+        metrics.summary()
+        assert metrics.ttfb["UPLOAD"].count == records * count
+        print(f"{'end_timer + observe_transfer':>28} {count:>7} {elapsed / (records * count) * 1e9:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+## Throughput benchmark: legacy "EOF" sentinel transfers vs. the framed protocol
+#
+# Usage: python benchmarks/bench_protocol.py [size_in_MB]
+
+# import libraries
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import FramedConnection, LegacyConnection
+
+
+class NullWriter:
+    """File-like sink that only counts bytes."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+class PayloadReader:
+    """File-like source that serves the same block over and over."""
+
+    def __init__(self, block, size):
+        self.block = block
+        self.remaining = size
+
+    def read(self, n):
+        n = min(n, self.remaining, len(self.block))
+        self.remaining -= n
+        return self.block[:n]
+
+    def readinto(self, view):
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+def run(connection_class, size, block):
+    sender, receiver = socket.socketpair()
+    send_conn = connection_class(sender)
+    recv_conn = connection_class(receiver)
+    sink = NullWriter()
+
+    thread = threading.Thread(target=send_conn.send_file, args=(PayloadReader(block, size), size))
+    start = time.perf_counter()
+    thread.start()
+    recv_conn.recv_file(sink)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return sink.size, elapsed
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 256 * 1024 * 1024
+    # Payload without the sentinel so the legacy protocol can transfer it at all
+    block = os.urandom(1024 * 1024).replace(b"EOF", b"eof")
+
+    print(f"Transferring {size // (1024 * 1024)} MB over a local socket pair")
+    for name, connection_class in (("legacy", LegacyConnection), ("framed", FramedConnection)):
+        received, elapsed = run(connection_class, size, block)
+        print(f"{name:>8}: {received / elapsed / 1e6:8.1f} MB/s ({elapsed:.3f} s)")
+
+    # Binary data containing the sentinel is where the legacy protocol breaks
+    tricky = b"header" + b"EOF" + os.urandom(4096)
+    for name, connection_class in (("legacy", LegacyConnection), ("framed", FramedConnection)):
+        received, _ = run(connection_class, len(tricky), tricky)
+        print(f"{name:>8}: file containing b'EOF' -> {received} of {len(tricky)} bytes received")
+
+
+if __name__ == "__main__":
+    main()
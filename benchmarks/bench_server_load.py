@@ -0,0 +1,117 @@
+## Load test: N concurrent clients against the threaded and the asyncio server
+#
+# Usage: python benchmarks/bench_server_load.py [clients] [commands_per_client]
+# Reports server memory (RSS) and DIR command latency percentiles for both servers.
+
+# import libraries
+import asyncio
+import hashlib
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "common"))
+from protocol import AsyncFramedConnection, OP_AUTH, OP_COMMAND, OP_DONE
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def memory_kb(pid):
+    """Return (current RSS, peak RSS) of a process in KB, read from /proc."""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0])
+    return values.get("VmRSS", 0), values.get("VmHWM", 0)
+
+
+def start_server(extra_args, workdir):
+    port = free_port()
+    os.makedirs(os.path.join(workdir, "server_storage"), exist_ok=True)
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), "--backlog", "1024"] + extra_args,
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+async def client(port, commands, connected, go, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    conn = AsyncFramedConnection(reader, writer)
+    await conn.send_frame(OP_AUTH, b"user\n" + hashlib.sha256(b"pass").hexdigest().encode())
+    await conn.recv_message()
+    connected()
+    await go.wait()
+    for _ in range(commands):
+        start = time.perf_counter()
+        await conn.send_frame(OP_COMMAND, b"DIR")
+        while (await conn.recv_frame())[0] != OP_DONE:  # pages of entries, then the trailer
+            pass
+        latencies.append(time.perf_counter() - start)
+    await conn.send_frame(OP_COMMAND, b"QUIT")
+    await conn.close()
+
+
+async def drive(port, pid, clients, commands):
+    latencies = []
+    go = asyncio.Event()
+    ready = 0
+
+    def connected():
+        nonlocal ready
+        ready += 1
+
+    tasks = [asyncio.create_task(client(port, commands, connected, go, latencies)) for _ in range(clients)]
+    while ready < clients:
+        await asyncio.sleep(0.05)
+    idle_rss, _ = memory_kb(pid)  # every client connected and idle
+    start = time.perf_counter()
+    go.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    _, peak_rss = memory_kb(pid)
+    return idle_rss, peak_rss, sorted(latencies), elapsed
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    commands = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print(f"{clients} clients x {commands} DIR commands")
+    print(f"{'server':>9} {'idle RSS MB':>12} {'peak RSS MB':>12} {'p50 ms':>8} {'p99 ms':>8} {'cmd/s':>8}")
+    for name, extra_args in (("threaded", []), ("async", ["--async"])):
+        with tempfile.TemporaryDirectory() as workdir:
+            process, port = start_server(extra_args, workdir)
+            try:
+                idle_rss, peak_rss, latencies, elapsed = asyncio.run(drive(port, process.pid, clients, commands))
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait(timeout=10)
+        print(f"{name:>9} {idle_rss / 1024:12.1f} {peak_rss / 1024:12.1f} "
+              f"{percentile(latencies, 50) * 1000:8.2f} {percentile(latencies, 99) * 1000:8.2f} "
+              f"{len(latencies) / elapsed:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
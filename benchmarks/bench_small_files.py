@@ -0,0 +1,91 @@
+## Round trip benchmark: upload and download many tiny files over loopback
+#
+# Usage: python benchmarks/bench_small_files.py [file_count] [--async]
+# Before the completion trailer every download slept 0.5 s, so 1,000 files took
+# over 500 s. The run fails if the downloads take more than a tenth of that.
+
+# import libraries
+import hashlib
+import io
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "common"))
+from protocol import FramedConnection, OP_AUTH, OP_COMMAND, STATUS_OK
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+OLD_SECONDS_PER_DOWNLOAD = 0.5
+
+
+def start_server(extra_args, workdir):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    os.makedirs(os.path.join(workdir, "server_storage"))
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port)] + extra_args,
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            return process, socket.create_connection(("127.0.0.1", port))
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def request(conn, command):
+    conn.send_frame(OP_COMMAND, command.encode())
+    _, status, text = conn.recv_message()
+    if status != STATUS_OK:
+        raise RuntimeError(f"{command}: {text}")
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    count = int(args[0]) if args else 1000
+    extra_args = ["--async"] if "--async" in sys.argv else []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        process, sock = start_server(extra_args, workdir)
+        try:
+            conn = FramedConnection(sock)
+            conn.send_frame(OP_AUTH, b"user\n" + hashlib.sha256(b"pass").hexdigest().encode())
+            conn.recv_message()
+
+            payloads = [f"tiny file {i}\n".encode() for i in range(count)]
+            start = time.perf_counter()
+            for i, payload in enumerate(payloads):
+                request(conn, f"UPLOAD tiny_{i}.txt")
+                conn.send_file(io.BytesIO(payload), len(payload))
+                conn.recv_trailer()
+            upload_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for i, payload in enumerate(payloads):
+                request(conn, f"DOWNLOAD tiny_{i}.txt")
+                received = io.BytesIO()
+                conn.recv_file(received)
+                conn.recv_trailer()
+                assert received.getvalue() == payload, f"tiny_{i}.txt came back corrupted"
+            download_time = time.perf_counter() - start
+
+            conn.send_frame(OP_COMMAND, b"QUIT")
+        finally:
+            sock.close()
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=10)
+
+    old_time = count * OLD_SECONDS_PER_DOWNLOAD
+    print(f"{count} uploads:   {upload_time:.3f} s ({count / upload_time:.0f} files/s)")
+    print(f"{count} downloads: {download_time:.3f} s ({count / download_time:.0f} files/s), "
+          f"previously at least {old_time:.0f} s")
+    assert download_time < old_time / 10, "downloads are not far below the old sleep floor"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+## Per-record cost and memory of StatisticsLogger under many concurrent threads
+#
+# Usage: python benchmarks/bench_statistics_logger.py [records_per_thread] [threads]
+# Compares the bounded logger (in memory only, and streaming to CSV) with the old
+# design of one ever-growing Python list per column.
+
+# import libraries
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from statistics_logger import StatisticsLogger
+
+
+class ListLogger:
+    """The previous logger: unbounded lists, no lock."""
+
+    def __init__(self):
+        self.stats = {name: [] for name in ("operation", "filename", "start_time", "end_time", "elapsed_time",
+                                            "file_size", "data_rate", "response_time")}
+
+    def end_timer(self, start_time, operation, filename="", file_size=0, elapsed_time=0, response_time=0):
+        end_time = time.time()
+        data_rate = file_size / elapsed_time if elapsed_time > 0 else 0
+        self.stats["operation"].append(operation)
+        self.stats["filename"].append(filename)
+        self.stats["start_time"].append(start_time)
+        self.stats["end_time"].append(end_time)
+        self.stats["elapsed_time"].append(elapsed_time)
+        self.stats["response_time"].append(response_time)
+        self.stats["file_size"].append(file_size)
+        self.stats["data_rate"].append(data_rate)
+
+
+def run(logger, records, threads, trace=False):
+    barrier = threading.Barrier(threads + 1)
+
+    def work(n):
+        filename = f"file_{n}.bin"
+        barrier.wait()
+        for i in range(records):
+            logger.end_timer(start_time=1.0, operation="UPLOAD", filename=filename,
+                             file_size=1024 * i, elapsed_time=0.01, response_time=0.001)
+
+    workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    if trace:
+        tracemalloc.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    total = records * threads
+
+    with tempfile.TemporaryDirectory() as workdir:
+        loggers = [
+            ("lists (old)", lambda: ListLogger()),
+            ("ring, memory only", lambda: StatisticsLogger(max_records=100_000)),
+            ("ring + CSV stream", lambda: StatisticsLogger(os.path.join(workdir, "stats.csv"), max_records=100_000,
+                                                            flush_interval=0.5)),
+        ]
+        print(f"{total:,} records from {threads} threads")
+        print(f"{'logger':>18} {'ns/record':>10} {'peak MB':>8}")
+        for name, make in loggers:
+            # Timing and memory are measured in separate runs: tracing slows every allocation down
+            logger = make()
+            elapsed, _ = run(logger, records, threads)
+            if isinstance(logger, StatisticsLogger):
+                logger.close()
+            traced = make()
+            _, peak = run(traced, records, threads, trace=True)
+            if isinstance(traced, StatisticsLogger):
+                traced.close()
+            print(f"{name:>18} {elapsed / total * 1e9:10.0f} {peak / 1e6:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+## Stress the storage with many threads on overlapping paths and check that it stays consistent
+#
+# Usage: python benchmarks/bench_storage_locks.py [seconds per run] [threads]
+# Part 1 times backend/path_locks.py alone: threads hold a lock on a path while
+# they sleep as if doing I/O, on paths of their own, on a handful of shared
+# paths and behind one global lock, to show that throughput scales with the
+# thread count as long as the paths differ.
+# Part 2 starts the server (threaded, then with --async) and lets dozens of
+# clients upload, download and delete the same few files (also with DUPLOAD on
+# the chunk store) and create and remove the folder some of them live in, all
+# at once. Every stored file describes itself (a seed and a length in its
+# first bytes), so a download that got a mix of two uploads, a half written
+# file or the wrong length is caught.
+# Exits with status 1 on any torn read or unexpected error.
+
+# import libraries
+import functools
+import hashlib
+import io
+import json
+import os
+import random
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+sys.path.append(os.path.join(ROOT, "backend"))
+sys.path.append(os.path.join(ROOT, "common"))
+from client import FileClient
+from path_locks import PathLocks
+from protocol import OP_LIST, OP_PROMPT, OP_REPLY, STATUS_OK, ProtocolError
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+HEADER = struct.Struct("!QQ")  # seed, length of the random bytes that follow
+SEEDS = 64  # few distinct files, so deduplicated uploads share chunks
+CHUNK = 64 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, *options):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), *options],
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def connect(port):
+    client = FileClient("127.0.0.1", port)
+    client.connect("user", "pass")
+    return client
+
+
+# Part 1: the locks on their own
+
+def lock_worker(locks, paths, exclusive, hold, deadline, counts, barrier):
+    pick = random.Random()
+    done = 0
+    barrier.wait()
+    while time.perf_counter() < deadline:
+        path = pick.choice(paths)
+        with (locks.exclusive(path) if exclusive else locks.shared(path)):
+            time.sleep(hold)
+        done += 1
+    counts.append(done)
+
+
+class GlobalLock:
+    """What the storage would be with one lock: the same interface, one mutex."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def exclusive(self, path):
+        return self.lock
+
+    shared = exclusive
+
+
+def lock_run(locks, threads, paths_for, exclusive, seconds, hold=0.002):
+    counts = []
+    barrier = threading.Barrier(threads + 1)
+    deadline = time.perf_counter() + seconds + 0.1
+    workers = [threading.Thread(target=lock_worker,
+                                args=(locks, paths_for(i), exclusive, hold, deadline, counts, barrier))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def bench_locks(seconds, failures):
+    root = os.path.join(tempfile.gettempdir(), "storage")
+    files = [os.path.join(root, "folder", f"file_{i}") for i in range(4)]
+    cases = [
+        ("own paths, exclusive", lambda: PathLocks(root), lambda i: [os.path.join(root, "folder", f"own_{i}")], True),
+        ("4 shared paths, shared", lambda: PathLocks(root), lambda i: files, False),
+        ("4 shared paths, exclusive", lambda: PathLocks(root), lambda i: files, True),
+        ("one global lock", GlobalLock, lambda i: files, True),
+    ]
+    print("PathLocks, each operation holds its lock for 2 ms (ops/s)")
+    counts = (1, 4, 16, 64)
+    print(f"  {'case':<28}" + "".join(f"{f'{n} threads':>12}" for n in counts))
+    for label, make, paths_for, exclusive in cases:
+        rates = [lock_run(make(), n, paths_for, exclusive, seconds) for n in counts]
+        print(f"  {label:<28}" + "".join(f"{rate:12.0f}" for rate in rates))
+        if label == "own paths, exclusive" and rates[-1] < 0.5 * counts[-1] * rates[0]:
+            failures.append(f"{label} does not scale: {rates[-1]:.0f} ops/s with {counts[-1]} threads")
+
+
+# Part 2: the server under overlapping operations
+
+@functools.lru_cache(maxsize=SEEDS)
+def payload(seed):
+    """The file of a seed: its header, then random bytes of a length picked by the seed."""
+    body = random.Random(seed)
+    length = body.randrange(1, 256 * 1024)
+    return HEADER.pack(seed, length) + body.randbytes(length)
+
+
+def check_payload(data):
+    """Empty string if data is a whole file as one upload wrote it, else what is wrong."""
+    if len(data) < HEADER.size:
+        return f"only {len(data)} bytes"
+    seed, length = HEADER.unpack_from(data)
+    if len(data) != HEADER.size + length:
+        return f"{len(data)} bytes, header says {HEADER.size + length}"
+    if seed >= SEEDS or data != payload(seed):
+        return "body does not match its header"
+    return ""
+
+
+def upload(client, name, data):
+    """Upload data as name, overwriting it; False if the server refused (e.g. folder gone)."""
+    client.send_command(f"UPLOAD {name} 0 sha256")
+    opcode, status, _ = client.conn.recv_message()
+    if opcode == OP_PROMPT:
+        client.conn.send_frame(OP_REPLY, b"y")
+        opcode, status, _ = client.conn.recv_message()
+    if status != STATUS_OK:
+        return False
+    client.conn.send_file(io.BytesIO(data), len(data))
+    status, _, _ = client.conn.recv_trailer()
+    return status == STATUS_OK
+
+
+def upload_dedup(client, name, data):
+    """Upload data as name through DUPLOAD, cut into fixed-size chunks; False if the server refused."""
+    chunks = [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+    client.send_command(f"DUPLOAD {name}")
+    client.conn.send_list([[hashlib.sha256(chunk).hexdigest(), len(chunk)] for chunk in chunks])
+    opcode, status, payload = client.conn.recv_frame()
+    if opcode == OP_PROMPT:
+        client.conn.send_frame(OP_REPLY, b"y")
+        opcode, status, payload = client.conn.recv_frame()
+    if opcode != OP_LIST:
+        return False
+    by_digest = {hashlib.sha256(chunk).hexdigest(): chunk for chunk in chunks}
+    for digest in json.loads(payload):
+        client.conn.send_file(io.BytesIO(by_digest[digest]), len(by_digest[digest]))
+    status, _, _ = client.conn.recv_trailer()
+    return status == STATUS_OK
+
+
+def download(client, name):
+    """The stored bytes of name, or None if it does not exist right now."""
+    status, _ = client.request(f"DOWNLOAD {name} 0 sha256 none")
+    if status != STATUS_OK:
+        return None
+    buffer = io.BytesIO()
+    client.conn.recv_file(buffer)
+    client.conn.recv_trailer()
+    return buffer.getvalue()
+
+
+# Refusals that are expected when others delete what one works on; anything else is an error
+EXPECTED = ("File not found", "Folder not found", "Folder already exists", "Parent folder not found")
+
+
+def stress_worker(client, names, folder, seed, seconds, dedup, results, barrier):
+    pick = random.Random(seed)
+    ops = torn = errors = 0
+    problems = []
+    barrier.wait()
+    deadline = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < deadline:
+            name = pick.choice(names)
+            roll = pick.random()
+            if roll < 0.45:
+                data = download(client, name)
+                if data is not None:
+                    problem = check_payload(data)
+                    if problem:
+                        torn += 1
+                        problems.append(f"torn read of {name}: {problem}")
+            elif roll < 0.85:
+                send = upload_dedup if dedup and pick.random() < 0.5 else upload
+                send(client, name, payload(pick.randrange(SEEDS)))
+            elif roll < 0.95:
+                status, response = client.request(f"DELETE {name}")
+                if status != STATUS_OK and not response.startswith(EXPECTED):
+                    errors += 1
+                    problems.append(f"DELETE {name}: {response.strip()}")
+            else:
+                action = pick.choice(("CREATE", "DELETE"))
+                status, response = client.request(f"SUBFOLDER {action} {folder}")
+                if status != STATUS_OK and not response.startswith(EXPECTED):
+                    errors += 1
+                    problems.append(f"SUBFOLDER {action}: {response.strip()}")
+            ops += 1
+        client.send_command("QUIT")
+        client.disconnect()
+    except (OSError, EOFError, ProtocolError) as e:  # the session broke, e.g. the server failed halfway through
+        errors += 1
+        problems.append(f"session lost: {e!r}")
+    results.append((ops, torn, errors, problems))
+
+
+def stress_run(port, threads, names_for, folder, seconds, dedup):
+    results = []
+    barrier = threading.Barrier(threads + 1)
+    workers = [threading.Thread(target=stress_worker,
+                                args=(connect(port), names_for(i), folder, i, seconds, dedup, results, barrier))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    ops = sum(r[0] for r in results)
+    problems = [p for r in results for p in r[3]]
+    return ops / elapsed, sum(r[1] for r in results), sum(r[2] for r in results), problems
+
+
+def bench_server(seconds, threads, failures):
+    folder = "hot"
+    shared = [f"shared_{i}.bin" for i in range(4)] + [f"{folder}/inner_{i}.bin" for i in range(2)]
+    cases = [
+        ("overlapping", lambda i: shared),
+        ("disjoint", lambda i: [f"own_{i}.bin"]),
+    ]
+    print(f"\nServer, clients downloading, uploading and deleting files and the '{folder}' folder (ops/s)")
+    for storage, options in (("plain", []), ("chunk store", ["--chunk-store"]), ("async", ["--async"])):
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(os.path.join(workdir, "server_storage", folder))
+            process, port = start_server(workdir, *options)
+            try:
+                for label, names_for in cases:
+                    line = []
+                    for n in sorted({1, max(1, threads // 4), threads}):
+                        rate, torn, errors, problems = stress_run(port, n, names_for, folder, seconds,
+                                                                    "--chunk-store" in options)
+                        line.append(f"{n} threads {rate:7.0f}")
+                        if torn or errors:
+                            failures.append(f"{storage}, {label}, {n} threads: {torn} torn read(s), "
+                                            f"{errors} error(s), e.g. {problems[0]}")
+                    print(f"  {storage:<12} {label:<12} " + "   ".join(line))
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait(timeout=30)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 48
+    failures = []
+    bench_locks(seconds, failures)
+    bench_server(seconds, threads, failures)
+    if failures:
+        print(f"\n{len(failures)} failure(s):")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nNo torn reads or unexpected errors")
+
+
+if __name__ == "__main__":
+    main()
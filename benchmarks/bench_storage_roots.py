@@ -0,0 +1,155 @@
+## Aggregate throughput of the server with its files spread over 1, 2 and 4 storage roots
+#
+# Usage: python benchmarks/bench_storage_roots.py [clients] [files per client] [file size KB] [directory ...]
+# Starts the server with one --storage-root per root and lets `clients` clients
+# upload and then download their own files all at once, checking every copy.
+# Reports the aggregate files/s and MB/s, how evenly the files landed on the
+# roots (largest root / average) and, after REBALANCE ADD of one more root, the
+# share of files that moved, next to the ideal 1/(n+1) and what hash % n would
+# have moved.
+# Roots are subdirectories of the given directories, used in turn (pass one per
+# disk or tmpfs mount to see the disks add up); without any, of one temporary
+# directory, which only shows what spreading the files costs on a single disk.
+
+# import libraries
+import filecmp
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+sys.path.append(os.path.join(ROOT, "backend"))
+from client import FileClient
+from storage_roots import ring_hash
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+ROOT_COUNTS = (1, 2, 4)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, *options):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), *options],
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def run_clients(port, clients, paths, work):
+    """Run work(client, path) for every path of every client, all clients at once; returns the wall time."""
+    errors = []
+    start_line = threading.Barrier(clients + 1)
+
+    def run(i):
+        try:
+            with FileClient("127.0.0.1", port) as client:
+                client.connect("user", "pass")
+                start_line.wait()
+                for path in paths[i]:
+                    work(client, path, overwrite=True)
+        except Exception as e:
+            errors.append(e)
+            start_line.abort()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start_line.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - start
+
+
+def files_per_root(roots):
+    counts = []
+    for root in roots:
+        counts.append(sum(len([name for name in filenames if not name.startswith(".")])
+                          for _, _, filenames in os.walk(root)))
+    return counts
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    size = int(sys.argv[3]) * 1024 if len(sys.argv) > 3 else 256 * 1024
+    bases = sys.argv[4:]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Client i uploads and downloads c<i>/<name>, the same relative path locally and on the server
+        os.chdir(workdir)
+        originals = os.path.join(workdir, "originals")
+        os.makedirs(originals)
+        names = [f"f{i:04d}.bin" for i in range(files)]
+        for name in names:
+            with open(os.path.join(originals, name), "wb") as f:
+                f.write(os.urandom(size))
+        paths = [[f"c{i}/{name}" for name in names] for i in range(clients)]
+        total = clients * files * size
+
+        print(f"{clients} clients x {files} files of {size // 1024} KB, "
+              f"roots in {', '.join(bases) if bases else 'one temporary directory'}")
+        print(f"{'roots':>5} {'up files/s':>11} {'up MB/s':>8} {'down files/s':>13} {'down MB/s':>10} "
+              f"{'max/avg':>8} {'moved on add':>13} {'ideal':>6} {'hash % n':>9}")
+        for count in ROOT_COUNTS:
+            roots = [os.path.join(bases[i % len(bases)] if bases else workdir, f"bench_root{i}")
+                     for i in range(count + 1)]
+            for root in roots:
+                shutil.rmtree(root, ignore_errors=True)
+                os.makedirs(root)
+            options = [option for root in roots[:count] for option in ("--storage-root", root)]
+            process, port = start_server(workdir, *options)
+            try:
+                with FileClient("127.0.0.1", port) as admin:
+                    admin.connect("user", "pass")
+                    for i in range(clients):
+                        admin.make_folder(f"c{i}")
+                        shutil.rmtree(f"c{i}", ignore_errors=True)
+                        os.makedirs(f"c{i}")
+                        for name in names:
+                            os.link(os.path.join(originals, name), f"c{i}/{name}")
+
+                    up = run_clients(port, clients, paths, FileClient.upload_file)
+                    down = run_clients(port, clients, paths, FileClient.download_file)  # replaces the links
+                    for i in range(clients):
+                        for name in names:
+                            assert filecmp.cmp(f"c{i}/{name}", os.path.join(originals, name),
+                                               shallow=False), f"c{i}/{name} differs"
+
+                    counts = files_per_root(roots[:count])
+                    spread = max(counts) / (sum(counts) / count)
+                    admin.rebalance("add", roots[count])
+                    moved = files_per_root(roots[count:])[0] / sum(counts)
+                    keys = [f"c{i}/{name}" for i in range(clients) for name in names]
+                    modulo = sum(ring_hash(key) % count != ring_hash(key) % (count + 1) for key in keys) / len(keys)
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait(timeout=30)
+            print(f"{count:>5} {clients * files / up:11.0f} {total / up / 1e6:8.1f} {clients * files / down:13.0f} "
+                  f"{total / down / 1e6:10.1f} {spread:8.2f} {moved:13.1%} {1 / (count + 1):6.1%} {modulo:9.1%}")
+            for root in roots:
+                shutil.rmtree(root, ignore_errors=True)
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+## Loopback benchmark for striped (multi-connection) uploads and downloads
+#
+# Usage: python benchmarks/bench_striped.py [size_in_MB]
+# Runs K = 1..8 parallel connections and checks every copy is byte-identical.
+
+# import libraries
+import filecmp
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+from client import FileClient
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+
+
+def start_server(workdir):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    os.makedirs(os.path.join(workdir, "server_storage"))
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port)], cwd=workdir,
+                               stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 512 * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as workdir:
+        process, port = start_server(workdir)
+        local_dir = os.path.join(workdir, "client")
+        os.makedirs(local_dir)
+        os.chdir(local_dir)
+        with open("big.bin", "wb") as f:
+            for _ in range(size // (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+
+        client = FileClient("127.0.0.1", port)
+        client.connect("user", "pass")
+        try:
+            print(f"{size // (1024 * 1024)} MB file")
+            print(f"{'K':>3} {'upload MB/s':>12} {'download MB/s':>14} {'identical':>10}")
+            for streams in range(1, 9):
+                start = time.perf_counter()
+                client.upload_striped("big.bin", streams, overwrite=True)
+                upload_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                os.rename("big.bin", "original.bin")
+                client.download_striped("big.bin", streams)
+                download_time = time.perf_counter() - start
+                identical = (filecmp.cmp("original.bin", "big.bin", shallow=False) and
+                             filecmp.cmp("original.bin", os.path.join(workdir, "server_storage", "big.bin"),
+                                         shallow=False))
+                os.replace("original.bin", "big.bin")
+                print(f"{streams:>3} {size / upload_time / 1e6:12.1f} {size / download_time / 1e6:14.1f} "
+                      f"{str(identical):>10}")
+                assert identical, "striped copy differs from the original"
+        finally:
+            client.send_command("QUIT")
+            client.disconnect()
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+## Time to re-sync a large, mostly unchanged tree
+#
+# Usage: python benchmarks/bench_sync.py [files] [streams]
+# Builds a local tree (1,000 files per folder, 100k files by default), puts an
+# identical copy in the server's storage as if it had been pushed before, and
+# times SYNC push and pull against it: unchanged with a cold and a warm server
+# cache, and after touching 1% of the files and adding 100 new ones.
+
+# import libraries
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+sys.path.append(os.path.join(ROOT, "common"))
+from client import FileClient
+from sync import build_manifest
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+PER_FOLDER = 1000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port)], cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def make_tree(root, files):
+    for i in range(files):
+        folder = os.path.join(root, f"d{i // PER_FOLDER:04d}")
+        if i % PER_FOLDER == 0:
+            os.makedirs(folder)
+        with open(os.path.join(folder, f"f{i:07d}.dat"), "wb") as f:
+            f.write(b"%d\n" % i * 8)
+
+
+def timed(label, action):
+    start = time.perf_counter()
+    summary = action()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>36} {elapsed:8.2f} s {len(summary['files']):>7} transferred")
+    return summary
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as workdir:
+        local = os.path.join(workdir, "local")
+        start = time.perf_counter()
+        make_tree(local, files)
+        shutil.copytree(local, os.path.join(workdir, "server_storage", "tree"))  # copy2 keeps the mtimes
+        print(f"{files:,} files in {files // PER_FOLDER or 1} folders (set up in {time.perf_counter() - start:.1f} s)")
+
+        start = time.perf_counter()
+        build_manifest(local)
+        print(f"{'local manifest only':>36} {time.perf_counter() - start:8.2f} s")
+
+        process, port = start_server(workdir)
+        try:
+            client = FileClient("127.0.0.1", port)
+            client.connect("user", "pass")
+            timed("push, unchanged, cold server cache", lambda: client.sync(local, "tree", "push", streams=streams))
+            timed("push, unchanged, warm server cache", lambda: client.sync(local, "tree", "push", streams=streams))
+            timed("pull, unchanged", lambda: client.sync(local, "tree", "pull", streams=streams))
+
+            for i in range(0, files, 100):
+                path = os.path.join(local, f"d{i // PER_FOLDER:04d}", f"f{i:07d}.dat")
+                with open(path, "ab") as f:
+                    f.write(b"changed\n")
+            os.makedirs(os.path.join(local, "new"))
+            for i in range(100):
+                with open(os.path.join(local, "new", f"n{i:03d}.dat"), "wb") as f:
+                    f.write(os.urandom(1000))
+            summary = timed("push, 1% changed + 100 new", lambda: client.sync(local, "tree", "push", streams=streams))
+            assert len(summary["files"]) == len(range(0, files, 100)) + 100
+            assert all(result["status"] == "uploaded" for result in summary["files"])
+            timed("push, unchanged again", lambda: client.sync(local, "tree", "push", streams=streams))
+            client.send_command("QUIT")
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
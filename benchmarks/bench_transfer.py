@@ -0,0 +1,74 @@
+## Loopback benchmark for the transfer engine across chunk sizes
+#
+# Usage: python benchmarks/bench_transfer.py [size_in_MB]
+
+# import libraries
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import FramedConnection
+
+CHUNK_SIZES = [16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+
+def loopback_pair():
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def run(path, size, chunk_size, use_sendfile):
+    sender, receiver = loopback_pair()
+    cpu = {}
+
+    def send():
+        start = time.thread_time()
+        with open(path, "rb") as f:
+            FramedConnection(sender, chunk_size, use_sendfile).send_file(f, size)
+        cpu["send"] = time.thread_time() - start
+
+    thread = threading.Thread(target=send)
+    start = time.perf_counter()
+    thread.start()
+    recv_start = time.thread_time()
+    with open(os.devnull, "wb") as sink:
+        FramedConnection(receiver, chunk_size).recv_file(sink)
+    cpu["recv"] = time.thread_time() - recv_start
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return elapsed, cpu
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 512 * 1024 * 1024
+    gigabytes = size / 1024 ** 3
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(size // len(block)):
+            f.write(block)
+        path = f.name
+
+    try:
+        print(f"{'mode':>8} {'chunk':>8} {'MB/s':>9} {'send CPU s/GB':>14} {'recv CPU s/GB':>14}")
+        for use_sendfile in (False, True):
+            for chunk_size in CHUNK_SIZES:
+                elapsed, cpu = run(path, size, chunk_size, use_sendfile)
+                mode = "sendfile" if use_sendfile else "copy"
+                print(f"{mode:>8} {chunk_size // 1024:>6}KB {size / elapsed / 1e6:9.1f} "
+                      f"{cpu['send'] / gigabytes:14.3f} {cpu['recv'] / gigabytes:14.3f}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
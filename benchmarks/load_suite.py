@@ -0,0 +1,601 @@
+## End-to-end load suite: synthetic or replayed workloads against a server on loopback
+#
+# Usage:
+#   python benchmarks/load_suite.py [--clients 8] [--operations 200 | --duration 30]
+#       [--mix upload=30,download=50,dir=10,delete=10] [--sizes lognormal:64K:1.5:16M]
+#       [--files 200] [--seed 1] [--server threaded|async] [--server-arg=--file-cache=64M]
+#       [--output run.json] [--compare baseline.json] [--tolerance 0.10] [--record stats.csv]
+#   python benchmarks/load_suite.py --replay server_statistics.csv [--speed 1.0] [--clients 16]
+#
+# Starts server.py in a temporary directory, so with an empty storage root, and
+# drives it from --clients threads, each on its own logged-in connection.
+# A synthetic workload draws each client's commands from --mix and upload sizes
+# from --sizes, seeded by --seed so two runs ask for the same work; --files
+# files are stored before the clock starts so downloads and deletes have
+# something to work on. --replay instead plays back the UPLOADs and DOWNLOADs
+# recorded in a server_statistics.csv at their original pace (--speed 2 is twice
+# as fast, 0 as fast as possible). Downloaded data is thrown away, so the numbers
+# are the server's.
+#
+# Reports throughput, latency percentiles per command, CPU time and peak RSS of
+# the server and of the load generator, and writes it all as JSON with
+# --output. --compare prints the change against an earlier JSON file and exits
+# with status 1 if throughput fell or p99 latency rose by more than --tolerance.
+#
+# Sizes: "64K" (fixed), "uniform:1K:1M", "lognormal:{median}:{sigma}[:{max}]"
+# or "choice:4K=70,1M=25,16M=5" (size=weight).
+
+# import libraries
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "frontend"))
+sys.path.append(os.path.join(ROOT, "backend"))
+sys.path.append(os.path.join(ROOT, "common"))
+from client import FileClient
+from results import ClientError
+from file_cache import parse_size
+from protocol import OP_PROMPT, OP_REPLY, STATUS_OK, ProtocolError
+
+SERVER = os.path.join(ROOT, "backend", "server.py")
+KINDS = ("upload", "download", "dir", "delete")
+DEFAULT_MAX_SIZE = 64 * 1024 ** 2  # cap of a lognormal size distribution without an explicit one
+
+
+class Discard:
+    def write(self, data):
+        return len(data)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, *options):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--port", str(port), "--backlog", "1024", *options],
+                               cwd=workdir, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def connect(port):
+    client = FileClient("127.0.0.1", port)
+    client.connect("user", "pass")
+    return client
+
+
+# Resource usage, read from /proc for the server; None where there is no /proc
+def process_cpu(pid):
+    """User + system CPU seconds a process has used so far."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def peak_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# Workload description
+def parse_distribution(spec):
+    """Return (sample(rng), largest size it can return) for a --sizes spec."""
+    kind, _, rest = spec.partition(":")
+    if not rest:
+        size = parse_size(kind)
+        return (lambda rng: size), size
+    args = rest.split(":")
+    if kind == "uniform" and len(args) == 2:
+        low, high = parse_size(args[0]), parse_size(args[1])
+        return (lambda rng: rng.randint(low, high)), high
+    if kind == "lognormal" and len(args) in (2, 3):
+        median, sigma = parse_size(args[0]), float(args[1])
+        cap = parse_size(args[2]) if len(args) == 3 else DEFAULT_MAX_SIZE
+        return (lambda rng: min(cap, int(rng.lognormvariate(math.log(median), sigma)))), cap
+    if kind == "choice":
+        pairs = [part.partition("=") for part in rest.split(",")]
+        sizes = [parse_size(size) for size, _, _ in pairs]
+        weights = [float(weight or 1) for _, _, weight in pairs]
+        return (lambda rng: rng.choices(sizes, weights)[0]), max(sizes)
+    raise ValueError(f"Invalid size distribution {spec}")
+
+
+def parse_mix(spec):
+    """{"upload": weight, ...} from "upload=30,download=50,dir=10,delete=10"."""
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip().lower()
+        if kind not in KINDS:
+            raise ValueError(f"Unknown command {kind} in mix, expected one of {', '.join(KINDS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def synthetic_ops(rng, mix, sample):
+    """Endless (kind, upload size or None) commands drawn from the mix."""
+    kinds, weights = list(mix), list(mix.values())
+    while True:
+        kind = rng.choices(kinds, weights)[0]
+        yield kind, sample(rng) if kind == "upload" else None
+
+
+def safe_name(filename):
+    """A recorded file name as one plain name in the storage root."""
+    return filename.replace("\\", "/").strip("/").replace("/", "_").lstrip(".") or "unnamed"
+
+
+def load_replay(path):
+    """The transfers of a server_statistics.csv as (offset seconds, kind, name, size), in start order.
+
+    Striped ranges (UPLOAD_RANGE, DOWNLOAD_RANGE) are played as whole transfers of
+    the range's size. Returns (operations, rows skipped, recorded seconds per kind).
+    """
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        missing = {"operation", "filename", "start_time", "file_size"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"{path} lacks the columns {', '.join(sorted(missing))}")
+        ops, skipped = [], 0
+        recorded = {kind: [] for kind in KINDS}
+        for row in reader:
+            operation = row["operation"].upper()
+            kind = "upload" if "UPLOAD" in operation else "download" if "DOWNLOAD" in operation else None
+            if kind is None:
+                skipped += 1
+                continue
+            ops.append((float(row["start_time"]), kind, safe_name(row["filename"]), int(float(row["file_size"] or 0))))
+            if row.get("elapsed_time"):
+                recorded[kind].append(float(row["elapsed_time"]))
+    if not ops:
+        raise ValueError(f"{path} has no UPLOAD or DOWNLOAD records")
+    ops.sort()
+    first = ops[0][0]
+    return [(start - first, kind, name, size) for start, kind, name, size in ops], skipped, recorded
+
+
+class FileSet:
+    """Names stored on the server and their sizes, shared by the clients.
+
+    Any number of downloads may use a name at once, but a name being downloaded
+    is never picked for deletion, so neither side sees an unexpected refusal.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = []  # for picking a random one in O(1)
+        self.sizes = {}
+        self.readers = {}
+
+    def add(self, name, size):
+        with self.lock:
+            if name not in self.sizes:
+                self.names.append(name)
+            self.sizes[name] = size
+
+    def borrow(self, rng):
+        """A random name to download, or None if there are none; give it back with done()."""
+        with self.lock:
+            if not self.names:
+                return None
+            name = rng.choice(self.names)
+            self.readers[name] = self.readers.get(name, 0) + 1
+            return name
+
+    def done(self, name):
+        with self.lock:
+            self.readers[name] -= 1
+            if not self.readers[name]:
+                del self.readers[name]
+
+    def take(self, rng, attempts=8):
+        """Remove and return a random name nobody is downloading, or None if none was found."""
+        with self.lock:
+            for _ in range(min(attempts, len(self.names))):
+                i = rng.randrange(len(self.names))
+                name = self.names[i]
+                if name not in self.readers:
+                    self.names[i] = self.names[-1]
+                    self.names.pop()
+                    del self.sizes[name]
+                    return name
+        return None
+
+
+# The commands, straight on the protocol so no local files are written
+def upload(client, name, size, source):
+    client.send_command(f"UPLOAD {name} 0 sha256")
+    opcode, status, response = client.conn.recv_message()
+    if opcode == OP_PROMPT:
+        client.conn.send_frame(OP_REPLY, b"y")
+        opcode, status, response = client.conn.recv_message()
+    if status != STATUS_OK:
+        return 0, response.strip()
+    with open(source, 'rb') as f:
+        client.conn.send_file(f, size)
+    status, message, _ = client.conn.recv_trailer()
+    return size, None if status == STATUS_OK else message.strip()
+
+
+def download(client, name):
+    status, response = client.request(f"DOWNLOAD {name} 0 sha256 none")
+    if status != STATUS_OK:
+        return 0, response.strip()
+    size, _ = client.conn.recv_file(Discard())
+    status, message, _ = client.conn.recv_trailer()
+    return size, None if status == STATUS_OK else message.strip()
+
+
+def list_dir(client):
+    try:
+        client.list_dir(lambda page: None)
+    except ClientError as e:
+        return 0, e.message
+    return 0, None
+
+
+def delete(client, name):
+    status, response = client.request(f"DELETE {name}")
+    return 0, None if status == STATUS_OK else response.strip()
+
+
+class LoadClient:
+    """One connection of the load generator and the samples it took.
+
+    A sample is (kind, seconds since the run started, latency, bytes, error or
+    None). A connection that breaks is counted as an error and replaced.
+    """
+
+    def __init__(self, port, source, files, seed):
+        self.port = port
+        self.source = source  # random data; uploads send its first `size` bytes
+        self.files = files
+        self.rng = random.Random(seed)
+        self.client = connect(port)
+        self.samples = []
+        self.skipped = {kind: 0 for kind in KINDS}
+        self.uploads = 0
+
+    def run(self, kind, name, size, started):
+        if kind == "download" and name is None:
+            name = self.files.borrow(self.rng)
+            if name is None:
+                self.skipped[kind] += 1
+                return
+            try:
+                self.timed(kind, started, download, name)
+            finally:
+                self.files.done(name)
+            return
+        if kind == "delete" and name is None:
+            name = self.files.take(self.rng)
+            if name is None:
+                self.skipped[kind] += 1
+                return
+        if kind == "upload":
+            name = name or f"load_{id(self):x}_{self.uploads:06d}.bin"
+            self.uploads += 1
+            if self.timed(kind, started, upload, name, size, self.source) is None:
+                self.files.add(name, size)
+        elif kind == "delete":
+            self.timed(kind, started, delete, name)
+        elif kind == "dir":
+            self.timed(kind, started, list_dir)
+        else:
+            self.timed(kind, started, download, name)
+
+    def timed(self, kind, started, command, *args):
+        start = time.perf_counter()
+        try:
+            size, error = command(self.client, *args)
+        except (OSError, EOFError, ProtocolError) as e:
+            size, error = 0, f"connection lost: {type(e).__name__}"
+            self.client.disconnect()
+            self.client = connect(self.port)
+        self.samples.append((kind, start - started, time.perf_counter() - start, size, error))
+        return error
+
+    def close(self):
+        self.client.send_command("QUIT")
+        self.client.disconnect()
+
+
+def closed_loop(load_client, ops, operations, deadline, started, barrier):
+    """Run commands back to back until `operations` are done or the deadline passed."""
+    barrier.wait()
+    for count, (kind, size) in enumerate(ops):
+        if count == operations or time.perf_counter() >= deadline:
+            break
+        load_client.run(kind, None, size, started)
+
+
+def replay_loop(load_client, queue, lock, speed, started, lags, barrier):
+    """Take the next recorded transfer and start it at its recorded offset / speed."""
+    barrier.wait()
+    while True:
+        with lock:
+            if not queue:
+                return
+            offset, kind, name, size = queue.pop()
+        if speed > 0:
+            due = started + offset / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            lags.append(max(0.0, time.perf_counter() - due))
+        load_client.run(kind, name, size, started)
+
+
+# Results
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return None
+    return {"p50": percentile(latencies, 0.5) * 1000, "p90": percentile(latencies, 0.9) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000, "max": latencies[-1] * 1000,
+            "mean": sum(latencies) / len(latencies) * 1000}
+
+
+def summarize(samples, skipped, wall):
+    """Per-command and overall count, errors, throughput and latency (ms) of a run."""
+    groups = {kind: [sample for sample in samples if sample[0] == kind] for kind in KINDS}
+    groups = {kind: group for kind, group in groups.items() if group or skipped.get(kind)}
+    groups["all"] = samples
+    summary = {}
+    for kind, group in groups.items():
+        ok = [sample for sample in group if sample[4] is None]
+        transferred = sum(sample[3] for sample in ok)
+        errors = {}
+        for sample in group:
+            if sample[4] is not None:
+                errors[sample[4]] = errors.get(sample[4], 0) + 1
+        summary[kind] = {
+            "count": len(group),
+            "errors": len(group) - len(ok),
+            "error_messages": errors,
+            "skipped": sum(skipped.values()) if kind == "all" else skipped.get(kind, 0),
+            "bytes": transferred,
+            "ops_per_s": len(ok) / wall,
+            "mb_per_s": transferred / wall / 1e6,
+            "latency_ms": latency_summary([sample[2] for sample in ok]),
+        }
+    return summary
+
+
+def print_report(result):
+    print(f"{'command':<9} {'count':>7} {'errors':>6} {'ops/s':>8} {'MB/s':>8} "
+          f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, row in result["operations"].items():
+        latency = row["latency_ms"] or dict.fromkeys(("p50", "p90", "p99", "max"), float("nan"))
+        print(f"{kind:<9} {row['count']:>7} {row['errors']:>6} {row['ops_per_s']:8.1f} {row['mb_per_s']:8.2f} "
+              f"{latency['p50']:8.2f} {latency['p90']:8.2f} {latency['p99']:8.2f} {latency['max']:8.2f}")
+        for message, count in row["error_messages"].items():
+            print(f"{'':<9} {count:>7} x {message}")
+    for side in ("server", "client"):
+        usage = result[side]
+        cpu = "n/a" if usage["cpu_seconds"] is None else \
+            f"{usage['cpu_seconds']:.2f} s ({usage['cpu_seconds'] / result['wall_seconds'] * 100:.0f}% of a core)"
+        rss = "n/a" if usage["peak_rss_kb"] is None else f"{usage['peak_rss_kb'] / 1024:.1f} MB"
+        print(f"{side}: CPU {cpu}, peak RSS {rss}")
+    if "replay" in result:
+        replay = result["replay"]
+        pace = "as fast as possible" if replay["max_lag_ms"] is None else \
+            f"started up to {replay['max_lag_ms']:.1f} ms late (p99 {replay['p99_lag_ms']:.1f} ms)"
+        print(f"replay: {replay['operations']} transfers, {replay['skipped_rows']} other rows skipped, {pace}")
+
+
+def compare(result, baseline, tolerance):
+    """Print the change of every metric against baseline; return the names of the regressions."""
+    if result["config"] != baseline.get("config"):
+        print("Note: the baseline was run with a different configuration")
+    print(f"\n{'command':<9} {'ops/s':>10} {'change':>8} {'p99 ms':>10} {'change':>8}")
+    regressions = []
+    for kind, row in result["operations"].items():
+        old = baseline.get("operations", {}).get(kind)
+        if old is None or not old["ops_per_s"] or not row["latency_ms"] or not old["latency_ms"]:
+            continue
+        throughput = row["ops_per_s"] / old["ops_per_s"] - 1
+        p99 = row["latency_ms"]["p99"] / old["latency_ms"]["p99"] - 1
+        worse = [name for name, bad in (("throughput", throughput < -tolerance), ("p99", p99 > tolerance)) if bad]
+        regressions.extend(f"{kind} {name}" for name in worse)
+        print(f"{kind:<9} {row['ops_per_s']:10.1f} {throughput:+8.1%} {row['latency_ms']['p99']:10.2f} {p99:+8.1%}"
+              f"{'  worse: ' + ', '.join(worse) if worse else ''}")
+    for side in ("server", "client"):
+        for key in ("cpu_seconds", "peak_rss_kb"):
+            new, old = result[side][key], baseline.get(side, {}).get(key)
+            if new is None or not old:
+                continue
+            if key == "cpu_seconds":
+                # CPU per command, so a run that did more work is not a regression
+                new, old = new / max(1, result["operations"]["all"]["count"]), \
+                    old / max(1, baseline["operations"]["all"]["count"])
+            change = new / old - 1
+            print(f"{side} {key.replace('_', ' ')}{' per command' if key == 'cpu_seconds' else ''}: {change:+.1%}")
+            if change > tolerance:
+                regressions.append(f"{side} {key}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load suite for the file server.")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=200, help="commands per client (synthetic)")
+    parser.add_argument("--duration", type=float, default=None, help="run for this many seconds instead")
+    parser.add_argument("--mix", default="upload=30,download=50,dir=10,delete=10")
+    parser.add_argument("--sizes", default="lognormal:64K:1.5:16M")
+    parser.add_argument("--files", type=int, default=200, help="files stored before the run starts")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", help="server_statistics.csv to play back instead of a synthetic mix")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor; 0 for as fast as possible")
+    parser.add_argument("--server", choices=("threaded", "async"), default="threaded")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra server option, e.g. --server-arg=--file-cache=64M")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--record", help="keep the server's server_statistics.csv of this run here")
+    args = parser.parse_args()
+
+    config = {"server": args.server, "server_args": args.server_arg, "clients": args.clients}
+    if args.replay:
+        queue, skipped_rows, recorded = load_replay(args.replay)
+        config.update(replay=os.path.basename(args.replay), speed=args.speed)
+        largest = max(size for _, _, _, size in queue)
+    else:
+        mix = parse_mix(args.mix)
+        sample, largest = parse_distribution(args.sizes)
+        config.update(mix=mix, sizes=args.sizes, files=args.files, seed=args.seed,
+                      operations=None if args.duration else args.operations, duration=args.duration)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = os.path.join(workdir, "server_storage")
+        os.makedirs(storage)
+        source = os.path.join(workdir, "source.bin")
+        with open(source, "wb") as f:
+            for offset in range(0, max(largest, 1), 1024 * 1024):
+                f.write(os.urandom(min(1024 * 1024, largest - offset)))
+
+        # Files there before the clock starts: what the replay downloads before uploading it, or --files
+        files = FileSet()
+        if args.replay:
+            seeded = {}
+            uploaded = set()
+            for _, kind, name, size in queue:
+                if kind == "upload":
+                    uploaded.add(name)
+                elif name not in uploaded:
+                    seeded[name] = max(size, seeded.get(name, 0))
+        else:
+            rng = random.Random(args.seed)
+            seeded = {f"seed_{i:06d}.bin": sample(rng) for i in range(args.files)}
+        with open(source, "rb") as src:
+            for name, size in seeded.items():
+                src.seek(0)
+                with open(os.path.join(storage, name), "wb") as f:
+                    f.write(src.read(size))
+                files.add(name, size)
+
+        options = (["--async"] if args.server == "async" else []) + args.server_arg
+        process, port = start_server(workdir, *options)
+        try:
+            load_clients = [LoadClient(port, source, files, args.seed * 1000 + i) for i in range(args.clients)]
+            barrier = threading.Barrier(args.clients + 1)
+            lags = []
+            started = time.perf_counter() + 0.05  # the threads are waiting at the barrier by then
+            if args.replay:
+                pending = list(reversed(queue))  # popped from the end, so earliest first
+                lock = threading.Lock()
+                threads = [threading.Thread(target=replay_loop,
+                                            args=(c, pending, lock, args.speed, started, lags, barrier))
+                           for c in load_clients]
+            else:
+                deadline = started + args.duration if args.duration else float("inf")
+                operations = None if args.duration else args.operations
+                threads = [threading.Thread(target=closed_loop,
+                                            args=(c, synthetic_ops(random.Random(args.seed * 1000 + i), mix, sample),
+                                                  operations, deadline, started, barrier))
+                           for i, c in enumerate(load_clients)]
+            for thread in threads:
+                thread.start()
+            time.sleep(max(0.0, started - time.perf_counter()))
+            server_cpu = process_cpu(process.pid)
+            client_cpu = time.process_time()
+            barrier.wait()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - started
+            server_cpu = None if server_cpu is None else process_cpu(process.pid) - server_cpu
+            client_cpu = time.process_time() - client_cpu
+            server_rss = peak_rss_kb(process.pid)
+            for c in load_clients:
+                c.close()
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=60)
+        if args.record:
+            shutil.copyfile(os.path.join(workdir, "server_statistics.csv"), args.record)
+
+    samples = [sample for c in load_clients for sample in c.samples]
+    skipped = {kind: sum(c.skipped[kind] for c in load_clients) for kind in KINDS}
+    result = {
+        "suite": "load_suite",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": config,
+        "wall_seconds": wall,
+        "operations": summarize(samples, skipped, wall),
+        "server": {"cpu_seconds": server_cpu, "peak_rss_kb": server_rss},
+        "client": {"cpu_seconds": client_cpu, "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+    }
+    if args.replay:
+        lags.sort()
+        result["replay"] = {
+            "operations": len(queue), "skipped_rows": skipped_rows,
+            # How late transfers started against the recorded schedule; None when replayed as fast as possible
+            "max_lag_ms": lags[-1] * 1000 if lags else None,
+            "p99_lag_ms": percentile(lags, 0.99) * 1000 if lags else None,
+            "recorded_latency_ms": {kind: latency_summary(values) for kind, values in recorded.items() if values},
+        }
+
+    print(f"{args.server} server, {args.clients} clients, {wall:.2f} s")
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+## Content-defined chunking with a gear rolling hash
+#
+# Cut points depend on the bytes themselves, not on their position, so inserting
+# or removing a few bytes only changes the chunks around the edit and every other
+# chunk keeps its hash. That is what lets the chunk store deduplicate near-identical
+# files.
+
+# import libraries
+import hashlib
+import random
+
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 256 * 1024
+AVERAGE_BITS = 16  # a cut is expected every 2**16 bytes after MIN_CHUNK
+
+# Fixed seed: every client must cut the same data at the same places
+_rng = random.Random(0x5EED)
+GEAR = [_rng.getrandbits(31) for _ in range(256)]
+_HASH_MASK = 0x7FFFFFFF
+# Bit k of the gear hash depends on the last k+1 bytes, so test the top bits
+_BOUNDARY_MASK = ((1 << AVERAGE_BITS) - 1) << (31 - AVERAGE_BITS)
+
+
+def find_cut(data, start, end):
+    """Return the end of the chunk that starts at `start`; data[start:end] is all that is available."""
+    limit = min(start + MAX_CHUNK, end)
+    position = start + MIN_CHUNK
+    if position >= limit:
+        return limit
+    gear = GEAR
+    h = 0
+    for byte in data[position:limit]:
+        h = ((h << 1) + gear[byte]) & _HASH_MASK
+        position += 1
+        if not h & _BOUNDARY_MASK:
+            return position
+    return limit
+
+
+def iter_chunks(f, read_size=4 * 1024 * 1024):
+    """Yield (offset, data) for every chunk of a binary file, holding at most a few MB at once."""
+    buffer = b""
+    start = 0
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - start < MAX_CHUNK:
+            block = f.read(read_size)
+            if block:
+                buffer = buffer[start:] + block
+                start = 0
+            else:
+                eof = True
+            continue
+        if start >= len(buffer):
+            return
+        cut = find_cut(buffer, start, len(buffer))
+        yield offset, buffer[start:cut]
+        offset += cut - start
+        start = cut
+
+
+def chunk_file(path):
+    """Return [(sha256, offset, size), ...] for the chunks of a file."""
+    with open(path, 'rb') as f:
+        return [(hashlib.sha256(data).hexdigest(), offset, len(data)) for offset, data in iter_chunks(f)]
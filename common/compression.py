@@ -0,0 +1,146 @@
+## Streaming compression codecs for file transfers
+#
+# A compressed body is a series of blocks, one per chunk of input. Every block is
+# flushed on its own, so the receiver can decode it as soon as it arrives and never
+# holds more than one chunk of output, while zlib and zstd still keep their window
+# across blocks. A block that decodes to more than MAX_BLOCK_SIZE is refused
+# before it is fully decoded, so a few bytes on the wire cannot expand into
+# gigabytes of memory.
+
+# import libraries
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Codecs this process can use, best first; zlib is always there
+CODECS = tuple(name for name, module in (("zstd", zstandard), ("lz4", lz4), ("zlib", zlib)) if module is not None)
+
+# Transfer compression settings: "none", "auto" or a codec name
+COMPRESSION_MODES = ("none", "auto") + CODECS
+
+# "auto" compresses only if the first chunk shrinks at least this much
+AUTO_MIN_SAVING = 0.10
+SAMPLE_SIZE = 64 * 1024
+
+# Largest block accepted, compressed or decoded; senders compress one transfer chunk per block, far less
+MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def _too_large():
+    return ValueError(f"Compressed block decodes to more than {MAX_BLOCK_SIZE} bytes")
+
+
+class _BoundedSink:
+    """Write target collecting the output of one block, refusing more than MAX_BLOCK_SIZE."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > MAX_BLOCK_SIZE:
+            raise _too_large()
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+class _ZlibCodec:
+    def __init__(self):
+        self.compressor = zlib.compressobj(3)  # about as fast as level 1 and close to the ratio of 6
+        self.decompressor = zlib.decompressobj()
+
+    def compress_block(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def decompress_block(self, data):
+        block = self.decompressor.decompress(data, MAX_BLOCK_SIZE + 1)  # one byte over the limit is enough to know
+        if len(block) > MAX_BLOCK_SIZE:
+            raise _too_large()
+        return block
+
+
+class _ZstdCodec:
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        # decompressobj() has no output limit, a stream writer hands its output over piece by piece
+        self.sink = _BoundedSink()
+        self.decompressor = zstandard.ZstdDecompressor().stream_writer(self.sink)
+
+    def compress_block(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def decompress_block(self, data):
+        try:
+            self.decompressor.write(data)
+        finally:
+            block = self.sink.take()
+        return block
+
+
+class _Lz4Codec:
+    # Every block is its own LZ4 frame; LZ4 is about speed, not ratio
+    def compress_block(self, data):
+        return lz4.frame.compress(data)
+
+    def decompress_block(self, data):
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        block = decompressor.decompress(data, max_length=MAX_BLOCK_SIZE + 1)
+        if len(block) > MAX_BLOCK_SIZE:
+            raise _too_large()
+        if not decompressor.eof:
+            raise ValueError("Truncated LZ4 block")
+        return block
+
+
+_CODEC_CLASSES = {"zlib": _ZlibCodec, "zstd": _ZstdCodec, "lz4": _Lz4Codec}
+
+
+def new_codec(name):
+    """Return a fresh stateful codec for one transfer."""
+    if name not in CODECS:
+        raise ValueError(f"Unsupported compression codec {name}")
+    return _CODEC_CLASSES[name]()
+
+
+def worth_compressing(sample):
+    """Guess from a sample whether compressing the data pays off (it does not for media, archives...)."""
+    sample = bytes(sample[:SAMPLE_SIZE])
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) <= len(sample) * (1 - AUTO_MIN_SAVING)
+
+
+def resolve_compression(mode, peer_codecs):
+    """Turn a compression mode into what the sender is told: "none", "<codec>" or "auto:<codec>".
+
+    "auto" and explicit codecs fall back to the best codec both sides have.
+    """
+    usable = [codec for codec in CODECS if codec in peer_codecs]
+    if mode == "none" or not usable:
+        return "none"
+    if mode == "auto":
+        return f"auto:{usable[0]}"
+    return mode if mode in usable else usable[0]
+
+
+def parse_compression(setting):
+    """Split a resolved setting into (codec or None, sample first). Unknown codecs mean no compression."""
+    auto, _, codec = setting.rpartition(":")
+    if codec not in CODECS:
+        return None, False
+    return codec, auto == "auto"
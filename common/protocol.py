@@ -0,0 +1,499 @@
+## Framed wire protocol shared by the server and the client
+
+# import libraries
+import asyncio
+import json
+import socket
+import struct
+import time
+from transfer import DEFAULT_CHUNK_SIZE, BufferReader, send_file, send_buffer, recv_file, recv_file_at, pace
+from compression import MAX_BLOCK_SIZE, new_codec, parse_compression, worth_compressing
+
+# Every frame starts with a fixed size header:
+#   magic (2s) | version (B) | opcode (B) | status (B) | payload length (Q)
+MAGIC = b"FS"
+VERSION = 1
+HEADER = struct.Struct("!2sBBBQ")
+HEADER_SIZE = HEADER.size
+
+# Opcodes
+OP_AUTH = 1      # client -> server: "username\npassword_hash", or "username\ntoken:<token>" to resume
+OP_COMMAND = 2   # client -> server: command line, e.g. "UPLOAD notes.txt"
+OP_RESPONSE = 3  # server -> client: human readable result of a command
+OP_PROMPT = 4    # server -> client: question that needs an OP_REPLY
+OP_REPLY = 5     # client -> server: answer to an OP_PROMPT
+OP_DATA = 6      # either way: file body of exactly `length` bytes follows
+OP_DONE = 7      # server -> client: trailer closing a transfer, JSON {"message": ..., "stats": {...}}
+OP_LIST = 8      # either way: JSON list, e.g. the files of a batch transfer
+OP_ZDATA = 9     # either way: compressed file body block; the first names the codec, an empty one ends the body
+
+# Status codes
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Largest payloads a receiver accepts. Frames other than file bodies are read whole into
+# memory, so their length must not be left to the peer (OP_AUTH arrives before login)
+MAX_CONTROL_SIZE = 64 * 1024  # OP_AUTH, OP_COMMAND, OP_REPLY
+MAX_FRAME_SIZE = 64 * 1024 * 1024  # any other frame read whole, e.g. OP_LIST with the chunks of a large file
+# (OP_ZDATA blocks are limited to MAX_BLOCK_SIZE of compression.py, compressed and decoded)
+FRAME_LIMITS = {OP_AUTH: MAX_CONTROL_SIZE, OP_COMMAND: MAX_CONTROL_SIZE, OP_REPLY: MAX_CONTROL_SIZE}
+
+# Marks the second line of OP_AUTH as a session token from the TOKEN command instead of a password hash
+TOKEN_PREFIX = "token:"
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends something that is not a valid frame."""
+
+
+def recv_exact_into(sock, view):
+    """Fill the whole memoryview from the socket."""
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Connection closed by peer")
+        received += n
+
+
+def pack_header(opcode, length, status=STATUS_OK):
+    return HEADER.pack(MAGIC, VERSION, opcode, status, length)
+
+
+def parse_header(data):
+    """Validate a raw header and return (opcode, status, length)."""
+    magic, version, opcode, status, length = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError("Bad frame magic")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    return opcode, status, length
+
+
+def check_frame_size(opcode, length):
+    """Raise ProtocolError if a frame read whole into memory is larger than its opcode allows."""
+    limit = FRAME_LIMITS.get(opcode, MAX_FRAME_SIZE)
+    if length > limit:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the {limit} byte limit for opcode {opcode}")
+
+
+def pack_trailer(message, stats):
+    return json.dumps({"message": message, "stats": stats}).encode()
+
+
+def parse_trailer(payload):
+    """Return (message, stats) from an OP_DONE payload."""
+    trailer = json.loads(payload)
+    return trailer["message"], trailer["stats"]
+
+
+def is_framed(sock):
+    """Peek at the first bytes of a new connection to see if it speaks the framed protocol."""
+    head = sock.recv(len(MAGIC), socket.MSG_PEEK | socket.MSG_WAITALL)
+    return head == MAGIC
+
+
+class FramedConnection:
+    """Sends and receives length-prefixed frames over a connected socket."""
+
+    def __init__(self, sock, chunk_size=DEFAULT_CHUNK_SIZE, use_sendfile=True):
+        self.sock = sock
+        self.use_sendfile = use_sendfile
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Frames are small and back-to-back; don't let Nagle hold them for an ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._header = bytearray(HEADER_SIZE)
+        self._header_view = memoryview(self._header)
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        self.last_wire_size = 0  # body bytes that went over the wire for the last file sent or received
+        self.throttle = None  # optional bandwidth throttle for file bodies, see backend/bandwidth.py
+
+    # Low level frame functions
+    def send_frame(self, opcode, payload=b"", status=STATUS_OK):
+        """Send one complete frame."""
+        self.sock.sendall(pack_header(opcode, len(payload), status) + payload)
+
+    def send_frame_header(self, opcode, length, status=STATUS_OK):
+        """Send only a header; the caller streams `length` bytes of payload after it."""
+        self.sock.sendall(pack_header(opcode, length, status))
+
+    def recv_header(self):
+        """Read a frame header and return (opcode, status, length)."""
+        recv_exact_into(self.sock, self._header_view)
+        return parse_header(self._header)
+
+    def recv_frame(self, expected=None):
+        """Read a frame with a small payload and return (opcode, status, payload)."""
+        opcode, status, length = self.recv_header()
+        if expected is not None and opcode != expected:
+            raise ProtocolError(f"Expected opcode {expected}, got {opcode}")
+        check_frame_size(opcode, length)
+        payload = bytearray(length)
+        recv_exact_into(self.sock, memoryview(payload))
+        return opcode, status, bytes(payload)
+
+    # Message helpers
+    def send_message(self, text, status=STATUS_OK, opcode=OP_RESPONSE):
+        self.send_frame(opcode, text.encode(), status)
+
+    def recv_message(self, expected=None):
+        """Return (opcode, status, text) of the next frame."""
+        opcode, status, payload = self.recv_frame(expected)
+        return opcode, status, payload.decode()
+
+    def recv_credentials(self):
+        """Return (username, password_hash) from the OP_AUTH frame."""
+        _, _, text = self.recv_message(OP_AUTH)
+        username, _, password_hash = text.partition("\n")
+        return username.strip(), password_hash.strip()
+
+    def recv_command(self):
+        """Return the next command line, or None once the peer has gone away."""
+        try:
+            _, _, text = self.recv_message(OP_COMMAND)
+        except ConnectionError:
+            return None
+        return text
+
+    def prompt(self, text):
+        """Ask the peer a question and wait for its answer."""
+        self.send_message(text, opcode=OP_PROMPT)
+        _, _, reply = self.recv_message(OP_REPLY)
+        return reply
+
+    def send_list(self, items):
+        self.send_frame(OP_LIST, json.dumps(items).encode())
+
+    def recv_list(self):
+        _, _, payload = self.recv_frame(OP_LIST)
+        return json.loads(payload)
+
+    def send_trailer(self, message, status=STATUS_OK, **stats):
+        """Close a transfer with the summary message and its stats."""
+        self.send_frame(OP_DONE, pack_trailer(message, stats), status)
+
+    def recv_trailer(self):
+        """Return (status, message, stats) of the trailer that ends a transfer."""
+        _, status, payload = self.recv_frame(OP_DONE)
+        message, stats = parse_trailer(payload)
+        return status, message, stats
+
+    # File body functions
+    def send_file(self, f, size, hasher=None, compression="none"):
+        """Send exactly `size` bytes read from f as one OP_DATA frame, or compressed.
+
+        compression is "none", a codec name, or "auto:<codec>" to compress only if
+        the first chunk shrinks. A hasher, if given, is updated with the original bytes.
+        """
+        codec, auto = parse_compression(compression)
+        if codec is None or size == 0:
+            self.send_frame_header(OP_DATA, size)
+            send_file(self.sock, f, size, self._view, self.use_sendfile, hasher, self.throttle)
+            self.last_wire_size = size
+            return
+
+        n = f.readinto(self._view[:min(size, len(self._view))])
+        if not n:
+            raise EOFError(f"File shrank while sending (0 of {size} bytes)")
+        if auto and not worth_compressing(self._view[:n]):
+            # Already compressed data: send the sample, then the rest as usual
+            self.send_frame_header(OP_DATA, size)
+            if hasher is not None:
+                hasher.update(self._view[:n])
+            if self.throttle is not None:
+                pace(self.throttle, n)
+            self.sock.sendall(self._view[:n])
+            send_file(self.sock, f, size - n, self._view, self.use_sendfile, hasher, self.throttle)
+            self.last_wire_size = size
+            return
+        self.send_compressed(f, size, n, new_codec(codec), codec, hasher)
+
+    def send_buffer(self, buffer, hasher=None, compression="none"):
+        """send_file for a file that is already in memory, e.g. from the hot-file cache.
+
+        Uncompressed it is sent straight from the buffer; compression reads it
+        through the transfer buffer like a file, since the codec copies anyway.
+        """
+        codec, _ = parse_compression(compression)
+        if codec is not None and len(buffer):
+            self.send_file(BufferReader(buffer), len(buffer), hasher, compression)
+            return
+        self.send_frame_header(OP_DATA, len(buffer))
+        send_buffer(self.sock, buffer, hasher, self.throttle)
+        self.last_wire_size = len(buffer)
+
+    def send_compressed(self, f, size, n, codec, codec_name, hasher):
+        """Send the body as OP_ZDATA blocks; the first n bytes are already in the buffer."""
+        self.send_frame(OP_ZDATA, codec_name.encode())
+        wire_size = 0
+        remaining = size
+        while True:
+            if hasher is not None:
+                hasher.update(self._view[:n])
+            block = codec.compress_block(self._view[:n])
+            if block:
+                if self.throttle is not None:
+                    pace(self.throttle, len(block))  # compressed data is paced by what goes over the wire
+                self.send_frame(OP_ZDATA, block)
+                wire_size += len(block)
+            remaining -= n
+            if remaining <= 0:
+                break
+            n = f.readinto(self._view[:min(remaining, len(self._view))])
+            if not n:
+                raise EOFError(f"File shrank while sending ({size - remaining} of {size} bytes)")
+        self.send_frame(OP_ZDATA)
+        self.last_wire_size = wire_size
+
+    def recv_file(self, f, hasher=None, max_size=None):
+        """Receive a file body into f, plain or compressed. Returns (file_size, time the header arrived).
+
+        A body longer than max_size raises ProtocolError before the excess is read.
+        """
+        opcode, _, size = self.recv_header()
+        first_byte_at = time.time()
+        if opcode == OP_ZDATA:
+            return self.recv_compressed(f, size, hasher, max_size), first_byte_at
+        if opcode != OP_DATA:
+            raise ProtocolError(f"Expected file data, got opcode {opcode}")
+        if max_size is not None and size > max_size:
+            raise ProtocolError(f"File body of {size} bytes exceeds the {max_size} bytes expected")
+        recv_file(self.sock, f, size, self._view, hasher, self.throttle)
+        self.last_wire_size = size
+        return size, first_byte_at
+
+    def recv_compressed(self, f, length, hasher, max_size=None):
+        """Decode OP_ZDATA blocks into f one at a time; `length` is that of the codec frame."""
+        try:
+            codec = new_codec(bytes(self.recv_payload(length)).decode())
+        except ValueError as e:
+            raise ProtocolError(str(e))
+        file_size = wire_size = 0
+        while True:
+            opcode, _, length = self.recv_header()
+            if opcode != OP_ZDATA:
+                raise ProtocolError(f"Expected compressed data, got opcode {opcode}")
+            if length == 0:
+                break
+            if self.throttle is not None:
+                pace(self.throttle, length)
+            try:
+                data = codec.decompress_block(self.recv_payload(length))
+            except ValueError as e:
+                raise ProtocolError(str(e))
+            if max_size is not None and file_size + len(data) > max_size:
+                raise ProtocolError(f"File body exceeds the {max_size} bytes expected")
+            f.write(data)
+            if hasher is not None:
+                hasher.update(data)
+            file_size += len(data)
+            wire_size += length
+        self.last_wire_size = wire_size
+        return file_size
+
+    def recv_payload(self, length):
+        """Read a payload into the transfer buffer when it fits. The view is only valid until the next read."""
+        if length > MAX_BLOCK_SIZE:
+            raise ProtocolError(f"Block of {length} bytes exceeds the {MAX_BLOCK_SIZE} byte limit")
+        view = self._view[:length] if length <= len(self._view) else memoryview(bytearray(length))
+        recv_exact_into(self.sock, view)
+        return view
+
+    def recv_file_at(self, fd, offset, limit):
+        """Receive an OP_DATA frame into fd at `offset`, refusing to write past `limit` bytes.
+
+        Returns (range_size, time the header arrived).
+        """
+        opcode, _, size = self.recv_header()
+        first_byte_at = time.time()
+        if opcode != OP_DATA:
+            raise ProtocolError(f"Expected file data, got opcode {opcode}")
+        if offset < 0 or offset + size > limit:
+            raise ProtocolError(f"Range {offset}+{size} is outside the file")
+        recv_file_at(self.sock, fd, offset, size, self._view, self.throttle)
+        return size, first_byte_at
+
+    def close(self):
+        self.sock.close()
+
+
+class AsyncFramedConnection:
+    """The framed protocol on top of asyncio streams.
+
+    Disk writes go to `executor` so a slow disk never blocks the event loop.
+    """
+
+    def __init__(self, reader, writer, executor=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.reader = reader
+        self.writer = writer
+        self.executor = executor
+        self.chunk_size = chunk_size
+
+    async def send_frame(self, opcode, payload=b"", status=STATUS_OK):
+        self.writer.write(pack_header(opcode, len(payload), status) + payload)
+        await self.writer.drain()
+
+    async def recv_header(self):
+        return parse_header(await self.reader.readexactly(HEADER_SIZE))
+
+    async def recv_frame(self, expected=None):
+        opcode, status, length = await self.recv_header()
+        if expected is not None and opcode != expected:
+            raise ProtocolError(f"Expected opcode {expected}, got {opcode}")
+        check_frame_size(opcode, length)
+        return opcode, status, await self.reader.readexactly(length)
+
+    async def send_message(self, text, status=STATUS_OK, opcode=OP_RESPONSE):
+        await self.send_frame(opcode, text.encode(), status)
+
+    async def recv_message(self, expected=None):
+        opcode, status, payload = await self.recv_frame(expected)
+        return opcode, status, payload.decode()
+
+    async def recv_credentials(self):
+        _, _, text = await self.recv_message(OP_AUTH)
+        username, _, password_hash = text.partition("\n")
+        return username.strip(), password_hash.strip()
+
+    async def recv_command(self):
+        try:
+            _, _, text = await self.recv_message(OP_COMMAND)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return text
+
+    async def prompt(self, text):
+        await self.send_message(text, opcode=OP_PROMPT)
+        _, _, reply = await self.recv_message(OP_REPLY)
+        return reply
+
+    async def send_list(self, items):
+        await self.send_frame(OP_LIST, json.dumps(items).encode())
+
+    async def recv_list(self):
+        _, _, payload = await self.recv_frame(OP_LIST)
+        return json.loads(payload)
+
+    async def send_trailer(self, message, status=STATUS_OK, **stats):
+        await self.send_frame(OP_DONE, pack_trailer(message, stats), status)
+
+    async def recv_trailer(self):
+        _, status, payload = await self.recv_frame(OP_DONE)
+        message, stats = parse_trailer(payload)
+        return status, message, stats
+
+    async def send_file(self, f, size):
+        """Send an OP_DATA frame with `size` bytes of f, zero-copy where the loop supports it."""
+        self.writer.write(pack_header(OP_DATA, size))
+        await self.writer.drain()
+        if size > 0:
+            loop = asyncio.get_running_loop()
+            await loop.sendfile(self.writer.transport, f, f.tell(), size)
+
+    async def recv_file(self, f, hasher=None):
+        """Receive an OP_DATA frame into f, feeding hasher if given. Returns (file_size, time the header arrived)."""
+        opcode, _, size = await self.recv_header()
+        first_byte_at = time.time()
+        if opcode != OP_DATA:
+            raise ProtocolError(f"Expected file data, got opcode {opcode}")
+        loop = asyncio.get_running_loop()
+        remaining = size
+        while remaining > 0:
+            data = await self.reader.read(min(remaining, self.chunk_size))
+            if not data:
+                raise ConnectionError("Connection closed during transfer")
+            if hasher is not None:
+                hasher.update(data)
+            await loop.run_in_executor(self.executor, f.write, data)
+            remaining -= len(data)
+        return size, first_byte_at
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class LegacyConnection:
+    """Compatibility mode for old clients that speak the raw text + "EOF" protocol."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._file_just_sent = False
+        self.last_wire_size = 0
+        self.throttle = None
+
+    def send_message(self, text, status=STATUS_OK, opcode=OP_RESPONSE):
+        if self._file_just_sent:
+            # Old clients can only tell the summary apart from the data by timing
+            time.sleep(0.5)
+            self._file_just_sent = False
+        self.sock.send(text.encode())
+
+    def recv_credentials(self):
+        username = self.sock.recv(1024).decode().strip()
+        password_hash = self.sock.recv(1024).decode().strip()
+        return username, password_hash
+
+    def recv_command(self):
+        data = self.sock.recv(1024)
+        if not data:
+            return None
+        return data.decode()
+
+    def prompt(self, text):
+        self.sock.send(text.encode())
+        return self.sock.recv(1024).decode()
+
+    def send_trailer(self, message, status=STATUS_OK, **stats):
+        # Old clients only understand the plain summary line
+        self.send_message(message, status)
+
+    def send_file(self, f, size, hasher=None, compression="none"):
+        # Old clients never ask for compression
+        while chunk := f.read(1024):
+            if hasher is not None:
+                hasher.update(chunk)
+            if self.throttle is not None:
+                pace(self.throttle, len(chunk))
+            self.sock.sendall(chunk)
+        self.sock.sendall(b"EOF")
+        self._file_just_sent = True
+        self.last_wire_size = size
+
+    def send_buffer(self, buffer, hasher=None, compression="none"):
+        send_buffer(self.sock, buffer, hasher, self.throttle)
+        self.sock.sendall(b"EOF")
+        self._file_just_sent = True
+        self.last_wire_size = len(buffer)
+
+    def recv_file(self, f, hasher=None):
+        file_size = 0
+        first_byte_at = 0
+        while True:
+            data = self.sock.recv(1024)
+            if first_byte_at == 0:
+                first_byte_at = time.time()
+            if not data:
+                break
+            if self.throttle is not None:
+                pace(self.throttle, len(data))
+            if b"EOF" in data:
+                data = data.split(b"EOF")[0]  # Write everything before "EOF"
+                f.write(data)
+                file_size += len(data)
+                if hasher is not None:
+                    hasher.update(data)
+                break
+            f.write(data)
+            file_size += len(data)
+            if hasher is not None:
+                hasher.update(data)
+        self.last_wire_size = file_size
+        return file_size, first_byte_at
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,130 @@
+## Manifests of directory trees and the diff that turns one tree into a copy of another
+
+# import libraries
+import os
+
+# Two mtimes closer than this are the same: they travel as JSON floats and come back through utime
+MTIME_TOLERANCE = 0.001
+
+
+def scan_directory(path):
+    """Yield (name, is_dir, size, mtime) for the visible entries of a directory."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):  # partial downloads, caches
+                continue
+            try:
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield entry.name, is_dir, 0 if is_dir else stat.st_size, stat.st_mtime
+
+
+def build_manifest(root, scan=scan_directory):
+    """Walk a tree and return {relative path: [is_dir, size, mtime, digest]}, digest None.
+
+    Paths use "/" whatever the OS. scan(path) lists one directory; the server
+    passes one backed by its directory cache so unchanged directories are not reread.
+    """
+    manifest = {}
+    pending = [""]
+    while pending:
+        folder = pending.pop()
+        for name, is_dir, size, mtime in scan(os.path.join(root, *folder.split("/")) if folder else root):
+            path = f"{folder}/{name}" if folder else name
+            manifest[path] = [is_dir, size, mtime, None]
+            if is_dir:
+                pending.append(path)
+    return manifest
+
+
+def manifest_to_entries(manifest):
+    """Compact wire form: [path, "f"/"d", size, mtime] plus the digest when there is one."""
+    entries = []
+    for path, (is_dir, size, mtime, digest) in manifest.items():
+        entry = [path, "d" if is_dir else "f", size, mtime]
+        if digest is not None:
+            entry.append(digest)
+        entries.append(entry)
+    return entries
+
+
+def check_path(path):
+    """Raise ValueError unless path is a relative "/" path that stays in its tree and is not hidden."""
+    parts = path.split("/")
+    if path.startswith("/") or any(part in ("", ".", "..") or part.startswith(".") for part in parts):
+        raise ValueError(f"Invalid path in manifest: {path}")
+
+
+def local_path(root, path):
+    """The file of a manifest path below root. Raises ValueError for invalid paths and for
+    ones that resolve outside root, e.g. through a symlink in the tree."""
+    check_path(path)
+    local = os.path.join(root, *path.split("/"))
+    real_root = os.path.realpath(root)
+    if os.path.commonpath([real_root, os.path.realpath(local)]) != real_root:
+        raise ValueError(f"Path in manifest leaves {root}: {path}")
+    return local
+
+
+def entries_to_manifest(entries):
+    """Inverse of manifest_to_entries. Raises ValueError for paths that could leave the tree."""
+    manifest = {}
+    for path, kind, size, mtime, *digest in entries:
+        check_path(path)
+        manifest[path] = [kind == "d", size, mtime, digest[0] if digest else None]
+    return manifest
+
+
+def diff_manifests(source, target, delete=False, checksum=False):
+    """What it takes to make target a copy of source.
+
+    Returns (copy, create, remove, conflicts): files that are new or changed,
+    directories to create, paths to remove (only with delete, topmost first and
+    without their contents) and paths that are a file on one side and a
+    directory on the other (removed first with delete, otherwise left alone).
+    A file changed if its size differs, then if its digest differs with
+    checksum, otherwise if its mtime does.
+    """
+    copy, create, conflicts = [], [], []
+    for path, (is_dir, size, mtime, digest) in source.items():
+        have = target.get(path)
+        if have is not None and have[0] != is_dir:
+            conflicts.append(path)
+            if not delete:
+                continue
+            have = None
+        if is_dir:
+            if have is None:
+                create.append(path)
+        elif have is None or have[1] != size:
+            copy.append(path)
+        elif checksum:
+            if digest != have[3]:
+                copy.append(path)
+        elif abs(have[2] - mtime) > MTIME_TOLERANCE:
+            copy.append(path)
+
+    remove = []
+    if delete:
+        removed = set()
+        for path in sorted(set(path for path in target if path not in source) | set(conflicts)):
+            parts = path.split("/")
+            if any("/".join(parts[:i]) in removed for i in range(1, len(parts))):
+                continue  # its folder goes anyway
+            removed.add(path)
+            remove.append(path)
+    create.sort()  # parents before children
+    return copy, create, remove, conflicts
+
+
+def split_groups(paths, sizes, count):
+    """Deal paths into at most count groups of about equal total size, biggest files first."""
+    groups = [[] for _ in range(max(1, min(count, len(paths))))]
+    loads = [0] * len(groups)
+    for path in sorted(paths, key=lambda p: sizes.get(p, 0), reverse=True):
+        lightest = loads.index(min(loads))
+        groups[lightest].append(path)
+        loads[lightest] += sizes.get(path, 0)
+    return [group for group in groups if group]
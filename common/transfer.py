@@ -0,0 +1,168 @@
+## Transfer engine shared by the server and the client
+
+# import libraries
+import hashlib
+import io
+import os
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# socket.sendfile() only goes zero-copy when the OS offers os.sendfile()
+HAS_SENDFILE = hasattr(os, "sendfile")
+
+# What a batch transfer does when the destination file already exists
+BATCH_POLICIES = ("skip", "overwrite", "newer")
+
+# Digests used to verify transfers. SHA-256 is fastest on CPUs with SHA extensions,
+# BLAKE2b on 64-bit CPUs without them (see benchmarks/bench_hashing.py)
+HASH_ALGORITHMS = ("sha256", "blake2b")
+DEFAULT_HASH = "sha256"
+
+
+def _real_fileno(f):
+    """Return the OS file descriptor behind f, or None for in-memory files."""
+    try:
+        return f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+
+def new_hasher(algorithm=DEFAULT_HASH):
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unsupported hash algorithm {algorithm}")
+    return hashlib.new(algorithm)
+
+
+def hash_file(f, hasher, size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Feed the next `size` bytes of f (or the rest of it) into hasher."""
+    remaining = size
+    while remaining is None or remaining > 0:
+        chunk = f.read(chunk_size if remaining is None else min(remaining, chunk_size))
+        if not chunk:
+            break
+        hasher.update(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+    return hasher
+
+
+def send_file(sock, f, size, view, use_sendfile=True, hasher=None, throttle=None):
+    """Send exactly `size` bytes of f, starting at its current position.
+
+    Regular files go through sendfile() so the data never enters Python.
+    Anything else is copied through the caller's preallocated memoryview, which
+    is also the path taken when the data has to be hashed on the way out.
+    throttle(n), if given, returns how many of the next n bytes may go now
+    (see backend/bandwidth.py); the file then goes out in pieces of that size.
+    """
+    if hasher is None and use_sendfile and HAS_SENDFILE and size > 0 and _real_fileno(f) is not None:
+        if throttle is None:
+            sent = sock.sendfile(f, f.tell(), size)
+        else:
+            sent = 0
+            while sent < size:
+                n = sock.sendfile(f, f.tell(), throttle(size - sent))
+                if not n:
+                    break
+                sent += n
+        if sent != size:
+            raise EOFError(f"File shrank while sending ({sent} of {size} bytes)")
+        return
+
+    remaining = size
+    while remaining > 0:
+        step = min(remaining, len(view))
+        if throttle is not None:
+            step = throttle(step)
+        n = f.readinto(view[:step])
+        if not n:
+            raise EOFError(f"File shrank while sending ({size - remaining} of {size} bytes)")
+        if hasher is not None:
+            hasher.update(view[:n])
+        sock.sendall(view[:n])
+        remaining -= n
+
+
+def send_buffer(sock, buffer, hasher=None, throttle=None):
+    """Send a buffer that is already in memory (e.g. a mapped file) as memoryview slices, without copies."""
+    view = memoryview(buffer)
+    if hasher is not None:
+        hasher.update(view)
+    if throttle is None:
+        sock.sendall(view)
+        return
+    sent = 0
+    while sent < len(view):
+        n = throttle(len(view) - sent)
+        sock.sendall(view[sent:sent + n])
+        sent += n
+
+
+class BufferReader:
+    """Read-only file object over a buffer, for code that reads files with readinto()."""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def readinto(self, b):
+        n = min(len(b), len(self.view) - self.position)
+        b[:n] = self.view[self.position:self.position + n]
+        self.position += n
+        return n
+
+
+def recv_file(sock, f, size, view, hasher=None, throttle=None):
+    """Receive exactly `size` bytes from the socket into f using the caller's buffer.
+
+    With a throttle the sender is slowed down by simply not reading faster than it allows.
+    """
+    remaining = size
+    while remaining > 0:
+        step = min(remaining, len(view))
+        n = sock.recv_into(view[:step if throttle is None else throttle(step)])
+        if n == 0:
+            raise ConnectionError("Connection closed during transfer")
+        f.write(view[:n])
+        if hasher is not None:
+            hasher.update(view[:n])
+        remaining -= n
+
+
+def recv_file_at(sock, fd, offset, size, view, throttle=None):
+    """Receive exactly `size` bytes into file descriptor fd at `offset` using positional writes.
+
+    Several threads can fill different ranges of the same file this way at once.
+    """
+    remaining = size
+    while remaining > 0:
+        step = min(remaining, len(view))
+        n = sock.recv_into(view[:step if throttle is None else throttle(step)])
+        if n == 0:
+            raise ConnectionError("Connection closed during transfer")
+        written = 0
+        while written < n:
+            written += os.pwrite(fd, view[written:n], offset + written)
+        offset += n
+        remaining -= n
+
+
+def pace(throttle, size):
+    """Wait until a throttle lets `size` bytes go, for data that is sent in one piece."""
+    while size > 0:
+        size -= throttle(size)
+
+
+def split_ranges(size, parts):
+    """Split [0, size) into at most `parts` contiguous (offset, length) ranges."""
+    part = max(1, -(-size // parts))
+    return [(offset, min(part, size - offset)) for offset in range(0, size, part)]
+
+
+def should_transfer(dest_path, source_mtime, policy):
+    """Decide by the batch overwrite policy whether a file should be (re)written."""
+    if not os.path.exists(dest_path) or policy == "overwrite":
+        return True
+    if policy == "newer":
+        return source_mtime is not None and source_mtime > os.path.getmtime(dest_path)
+    return False
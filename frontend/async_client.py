@@ -0,0 +1,302 @@
+## Asyncio version of the client, for programs that drive many transfers at once
+
+# import libraries
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import (AsyncFramedConnection, OP_AUTH, OP_COMMAND, OP_PROMPT, OP_REPLY, OP_LIST, OP_DONE,
+                      STATUS_OK, STATUS_ERROR, TOKEN_PREFIX, parse_trailer)
+from transfer import DEFAULT_CHUNK_SIZE, DEFAULT_HASH, new_hasher, hash_file
+from results import (ClientError, AuthenticationError, RemoteExistsError, ChecksumError, check_response, allowed,
+                     transfer_result)
+
+
+class AsyncFileClient:
+    """One connection to the server, with the same results and errors as FileClient.
+
+    A connection runs one command at a time; run operations concurrently over
+    several clients, e.g. from an AsyncClientPool. Local file I/O goes to the
+    default executor so a slow disk never blocks the event loop. Transfers are
+    never compressed.
+
+        async with AsyncFileClient("127.0.0.1", 4456) as client:
+            await client.connect("user", "pass")
+            result = await client.upload_file("notes.txt", overwrite=True)
+    """
+
+    def __init__(self, server_ip, port, chunk_size=DEFAULT_CHUNK_SIZE, hash_algorithm=DEFAULT_HASH):
+        self.server_ip = server_ip
+        self.port = port
+        self.chunk_size = chunk_size
+        self.hash_algorithm = hash_algorithm
+        self.conn = None
+        self.credentials = None  # (username, password_hash or token) once logged in
+        self.token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.quit()
+
+    async def connect(self, username, password=None, token=None):
+        """Connects and logs in with the password or a session token; returns True or raises AuthenticationError."""
+        reader, writer = await asyncio.open_connection(self.server_ip, self.port)
+        self.conn = AsyncFramedConnection(reader, writer, chunk_size=self.chunk_size)
+        if token is not None:
+            secret = TOKEN_PREFIX + token
+            self.token = token
+        else:
+            secret = hashlib.sha256(password.encode()).hexdigest()
+        status, response = await self.send_credentials(username, secret)
+        if status != STATUS_OK:
+            await self.disconnect()
+            raise AuthenticationError(response.strip())
+        return True
+
+    async def send_credentials(self, username, secret):
+        await self.conn.send_frame(OP_AUTH, f"{username}\n{secret}".encode())
+        _, status, response = await self.conn.recv_message()
+        if status == STATUS_OK:
+            self.credentials = (username, secret)
+        return status, response
+
+    async def request(self, command):
+        """Sends a command and returns (status, text) of the server's response."""
+        await self.conn.send_frame(OP_COMMAND, command.encode())
+        _, status, response = await self.conn.recv_message()
+        return status, response
+
+    async def command(self, command):
+        """Sends a command and returns the server's answer, raising the matching ClientError if it refused."""
+        return check_response(*await self.request(command))
+
+    async def session_token(self):
+        """Asks the server for a session token and returns it, or None if the server has none to give."""
+        status, response = await self.request("TOKEN")
+        if status != STATUS_OK:
+            return None
+        self.token = response.split()[0]
+        return self.token
+
+    async def upload_file(self, filename, overwrite=False):
+        """Uploads a file; the digest is computed before sending, since the body goes out with sendfile.
+
+        Returns the transfer result; raises RemoteExistsError, ChecksumError or ClientError.
+        """
+        start = time.perf_counter()
+        f, size, hasher = await asyncio.get_running_loop().run_in_executor(None, self.open_hashed, filename)
+        try:
+            await self.conn.send_frame(OP_COMMAND, f"UPLOAD {filename} 0 {hasher.name}".encode())
+            opcode, status, response = await self.conn.recv_message()
+            if opcode == OP_PROMPT:
+                yes = allowed(overwrite, filename)
+                await self.conn.send_frame(OP_REPLY, b"y" if yes else b"n")
+                _, status, response = await self.conn.recv_message()
+                if not yes:
+                    raise RemoteExistsError("File exists on server.")
+            check_response(status, response)
+            await self.conn.send_file(f, size)
+        finally:
+            f.close()
+        status, message, stats = await self.conn.recv_trailer()
+        check_response(status, message)
+        if stats.get("algorithm") == hasher.name and stats["digest"] != hasher.hexdigest():
+            raise ChecksumError("The server's copy differs from the local file. Upload it again.")
+        return transfer_result(filename, "uploaded", size, time.perf_counter() - start, message, stats)
+
+    def open_hashed(self, filename):
+        """Opens a file for upload and hashes it; one trip to the executor instead of three."""
+        f = open(filename, 'rb')
+        hasher = hash_file(f, new_hasher(self.hash_algorithm), chunk_size=self.chunk_size)
+        f.seek(0)
+        return f, os.fstat(f.fileno()).st_size, hasher
+
+    async def download_file(self, filename, overwrite=False):
+        """Downloads a file through a hidden .part file that replaces `filename` once its digest checks out.
+
+        Returns the transfer result; raises FileExistsError, RemoteNotFoundError or ChecksumError.
+        """
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, os.path.exists, filename) and not allowed(overwrite, filename):
+            raise FileExistsError(f"Local file {filename} exists")
+        start = time.perf_counter()
+        directory, name = os.path.split(filename)
+        part_path = os.path.join(directory, f".{name}.part")
+        await self.command(f"DOWNLOAD {filename} 0 {self.hash_algorithm} none")
+        hasher = new_hasher(self.hash_algorithm)
+        f = await loop.run_in_executor(None, open, part_path, 'wb')
+        try:
+            size, _ = await self.conn.recv_file(f, hasher)
+            _, message, stats = await self.conn.recv_trailer()
+        except BaseException:
+            await loop.run_in_executor(None, f.close)
+            raise
+        intact = stats.get("algorithm") != hasher.name or stats["digest"] == hasher.hexdigest()
+        await loop.run_in_executor(None, self.finish_download, f, part_path, filename, intact)
+        if not intact:
+            raise ChecksumError("The download is corrupted and was discarded.")
+        return transfer_result(filename, "downloaded", size, time.perf_counter() - start, message, stats)
+
+    @staticmethod
+    def finish_download(f, part_path, filename, intact):
+        f.close()
+        if intact:
+            os.replace(part_path, filename)
+        else:
+            os.remove(part_path)
+
+    async def delete_file(self, filename):
+        return (await self.command(f"DELETE {filename}")).strip()
+
+    async def stat_file(self, filename):
+        """Returns {"size", "mtime", "algorithm", "digest"} of a server file."""
+        size, mtime, algorithm, digest = (await self.command(f"STAT {filename} {self.hash_algorithm}")).split()
+        return {"size": int(size), "mtime": float(mtime), "algorithm": algorithm, "digest": digest}
+
+    async def remote_hash(self, filename):
+        return (await self.command(f"HASH {filename} {self.hash_algorithm}")).split()[1]
+
+    async def server_stats(self, fmt=""):
+        return await self.command(f"STATS {fmt}".strip())
+
+    async def list_files(self, sort="name", reverse=False, match=None, kind=None, offset=0, limit=None):
+        """Returns the server directory like FileClient.list_files."""
+        options = [f"sort={sort}", f"order={'desc' if reverse else 'asc'}", f"offset={offset}"]
+        if match is not None:
+            options.append(f"match={match}")
+        if kind is not None:
+            options.append(f"type={kind}")
+        if limit is not None:
+            options.append(f"limit={limit}")
+        await self.conn.send_frame(OP_COMMAND, ("DIR " + " ".join(options)).encode())
+        entries = []
+        while True:
+            opcode, status, payload = await self.conn.recv_frame()
+            if opcode == OP_LIST:
+                entries.extend({"name": name, "kind": entry_kind, "size": size, "mtime": mtime}
+                               for name, entry_kind, size, mtime in json.loads(payload))
+            elif opcode == OP_DONE:
+                return dict(parse_trailer(payload)[1], entries=entries)
+            else:
+                check_response(STATUS_ERROR, payload.decode())
+
+    async def make_folder(self, path):
+        return (await self.command(f"SUBFOLDER CREATE {path}")).strip()
+
+    async def remove_folder(self, path):
+        return (await self.command(f"SUBFOLDER DELETE {path}")).strip()
+
+    async def change_directory(self, path):
+        return (await self.command(f"CD {path}")).strip().rpartition(": ")[2]
+
+    async def quit(self):
+        """Ends the session and closes the connection."""
+        if self.conn is None:
+            return
+        try:
+            await self.conn.send_frame(OP_COMMAND, b"QUIT")
+        except OSError:
+            pass
+        await self.disconnect()
+
+    async def disconnect(self):
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+
+class AsyncClientPool:
+    """Lends out up to `size` logged-in AsyncFileClients, like ClientPool does for threads.
+
+    The first connection logs in with the password and asks for a session token,
+    the others log in with the token, until it expires and the next connection
+    logs in with the password again. A client that raised anything but a
+    ClientError while borrowed is closed rather than reused.
+
+        async with AsyncClientPool("127.0.0.1", 4456, "user", "pass", size=16) as pool:
+            results = await asyncio.gather(*(pool.run("upload_file", name) for name in names))
+    """
+
+    def __init__(self, server_ip, port, username, password, size=8, **options):
+        self.server_ip = server_ip
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.options = options
+        self.token = None
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)  # one per client connected or being connected
+        self.login_lock = asyncio.Lock()  # the first login fetches the token the others use
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a client for a sequence of commands; it goes back to the pool afterwards."""
+        await self.slots.acquire()
+        try:
+            client = self.idle.pop() if self.idle else await self.open()
+        except BaseException:
+            self.slots.release()
+            raise
+        try:
+            yield client
+        except ClientError:
+            # The server refused a command; the connection itself is fine
+            self.idle.append(client)
+            raise
+        except BaseException:
+            await client.disconnect()
+            raise
+        else:
+            self.idle.append(client)
+        finally:
+            self.slots.release()
+
+    async def run(self, method, *args, **kwargs):
+        """Call AsyncFileClient.<method>(*args, **kwargs) on any free client and return its result."""
+        async with self.connection() as client:
+            return await getattr(client, method)(*args, **kwargs)
+
+    async def open(self):
+        stale = self.token
+        if stale is not None:
+            client = await self.login(stale)
+            if client is not None:
+                return client
+        # No token yet, or it expired: one connection logs in with the password and asks for a new one
+        async with self.login_lock:
+            if self.token is None or self.token == stale:
+                client = AsyncFileClient(self.server_ip, self.port, **self.options)
+                await client.connect(self.username, self.password)
+                self.token = await client.session_token()
+                return client
+        client = await self.login(self.token)  # another connection renewed it meanwhile
+        if client is None:
+            raise AuthenticationError("Authentication failed.")
+        return client
+
+    async def login(self, token):
+        client = AsyncFileClient(self.server_ip, self.port, **self.options)
+        try:
+            await client.connect(self.username, token=token)
+        except AuthenticationError:
+            return None
+        return client
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for client in idle:
+            await client.quit()
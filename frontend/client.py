@@ -3,207 +3,642 @@
 # import libraries
 import socket
 import os
+import sys
+import glob
 import hashlib
+import json
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import (FramedConnection, OP_AUTH, OP_COMMAND, OP_PROMPT, OP_REPLY, OP_LIST, OP_DONE, STATUS_OK,
+                      STATUS_ERROR, TOKEN_PREFIX, ProtocolError, parse_trailer)
+from transfer import DEFAULT_CHUNK_SIZE, DEFAULT_HASH, should_transfer, split_ranges, new_hasher, hash_file
+from chunking import chunk_file
+from compression import resolve_compression
+from sync import build_manifest, manifest_to_entries, split_groups, local_path
+from results import AuthenticationError, RemoteExistsError, ChecksumError, check_response, allowed, transfer_result
 
 
 # create client as class
 class FileClient:
     # Constructor
-    def __init__(self, server_ip, port):
+    def __init__(self, server_ip, port, chunk_size=DEFAULT_CHUNK_SIZE, hash_algorithm=DEFAULT_HASH,
+                 compression="none"):
         self.server_ip = server_ip
         self.port = port
+        self.chunk_size = chunk_size
+        self.hash_algorithm = hash_algorithm  # digest used to verify transfers: "sha256" or "blake2b"
+        self.compression = compression  # "none", "auto" (only if the data compresses) or a codec name
+        self.server_codecs = None  # asked once per connection, see transfer_compression()
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.conn = FramedConnection(self.client_socket, chunk_size)
+        self.credentials = None  # (username, password_hash or token) once logged in, reused by extra connections
+        self.token = None  # session token from the server, see session_token()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
 
     # Connect to server
-    def connect(self):
-        """Connects to server and authenticates the user"""
-        try:
-            self.client_socket.connect((self.server_ip, self.port))
-            print(f"Connected to server at {self.server_ip}:{self.port}")
-            self.authenticate()
-        except Exception as e:
-            print(f"Error connecting to server: {e}")
-            self.client_socket.close()
+    def connect(self, username, password=None, token=None):
+        """Connects to the server and logs in; returns True or raises AuthenticationError.
+
+        A token from session_token() can stand in for the password and skips the
+        server's password check.
+        """
+        self.client_socket.connect((self.server_ip, self.port))
+        self.authenticate(username, password, token)
+        return True
 
     # Authenticate user
-    def authenticate(self):
-        """Authenticate client by sending username and password."""
-        username = input("Enter username: ")
-        password = input("Enter password: ")
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
+    def authenticate(self, username, password=None, token=None):
+        """Authenticate client by sending username and password, or a session token."""
+        if token is not None:
+            secret = TOKEN_PREFIX + token
+            self.token = token
+        else:
+            secret = hashlib.sha256(password.encode()).hexdigest()
 
         # Send username and password to server
-        self.client_socket.sendall(f"{username}\n".encode())
-        self.client_socket.sendall(f"{password_hash}\n".encode())
-
-        # Receive authentication response
-        response = self.client_socket.recv(1024).decode()
-        print(response)
-        if "successful" not in response:
-            print("Authentication failed.")
+        status, response = self.send_credentials(username, secret)
+        if status != STATUS_OK:
             self.client_socket.close()
-        else:
-            self.command_loop()
+            raise AuthenticationError(response.strip())
 
-    # Send commands
-    def command_loop(self):
-        """Loop for sending commands to the server."""
-        while True:
-            try:
-                command = input("Enter command (UPLOAD {file}, DOWNLOAD {file}, DELETE {file}, SUBFOLDER {create|delete} {path}, DIR, CD {..|path}, QUIT, SHUTDOWN):\n").strip()
-                command_select = command.split()[0].upper()
-                if command_select == "QUIT":
-                    self.client_socket.send(b"QUIT")
-                    print("Disconnected from server.")
-                    break
-                elif command_select.startswith("UPLOAD"):
-                    _, filename = command.split()
-                    self.upload_file(filename)
-                elif command_select.startswith("DOWNLOAD"):
-                    _, filename = command.split()
-                    self.download_file(filename)
-                elif command_select.startswith("DELETE"):
-                    _, filename = command.split()
-                    self.delete_file(filename)
-                elif command_select.startswith("SUBFOLDER"):
-                    _, cmd, path = command.split()
-                    self.manage_subfolders(cmd, path)
-                elif command_select == "DIR":
-                    self.list_files()
-                elif command_select.startswith("CD"):
-                    _, path = command.split()
-                    self.change_directory(path)
-                elif command_select.startswith("SHUTDOWN"):
-                    self.client_socket.send(b"SHUTDOWN")
-                    print("Shutting down server.")
-                    break
-                else:
-                    print("Invalid command.")
-            except Exception as e:
-                print("Invalid command! Please provide valid arguments!")
+    def send_credentials(self, username, secret):
+        """Sends the login frame and returns (status, text) of the server's answer.
+
+        secret is the SHA-256 of the password, or TOKEN_PREFIX and a session token.
+        """
+        self.conn.send_frame(OP_AUTH, f"{username}\n{secret}".encode())
+        _, status, response = self.conn.recv_message()
+        if status == STATUS_OK:
+            self.credentials = (username, secret)
+        return status, response
+
+    def session_token(self):
+        """Asks the server for a session token and returns it, or None if the server has none to give.
+
+        Extra connections (open_worker) log in with it from then on, which skips the
+        server's deliberately slow password check; connect(username, token=...)
+        does the same for a later client until the token expires.
+        """
+        status, response = self.request("TOKEN")
+        if status != STATUS_OK:
+            return None
+        self.token = response.split()[0]
+        self.credentials = (self.credentials[0], TOKEN_PREFIX + self.token)
+        return self.token
+
+    def open_worker(self):
+        """Opens another authenticated connection to the same server, e.g. for striped transfers."""
+        if self.token is None:
+            self.session_token()
+        for _ in range(2):
+            worker = FileClient(self.server_ip, self.port, self.chunk_size, self.hash_algorithm, self.compression)
+            worker.client_socket.connect((self.server_ip, self.port))
+            status, response = worker.send_credentials(*self.credentials)
+            if status == STATUS_OK:
+                worker.token = self.token
+                return worker
+            worker.disconnect()
+            # Only a token that expired is worth one more try, with a fresh one
+            if not self.credentials[1].startswith(TOKEN_PREFIX) or self.session_token() is None:
+                break
+        raise ConnectionError(response.strip())
+
+    # Sends a command and returns the server's reply
+    def send_command(self, command):
+        """Sends a single command frame to the server."""
+        self.conn.send_frame(OP_COMMAND, command.encode())
+
+    def request(self, command):
+        """Sends a command and returns (status, text) of the server's response."""
+        self.send_command(command)
+        _, status, response = self.conn.recv_message()
+        return status, response
+
+    def command(self, command):
+        """Sends a command and returns the server's answer, raising the matching ClientError if it refused."""
+        return check_response(*self.request(command))
+
+    def transfer_compression(self):
+        """Resolves self.compression against the codecs the server has into a per-transfer setting."""
+        if self.compression == "none":
+            return "none"
+        if self.server_codecs is None:
+            status, response = self.request("CODECS")
+            self.server_codecs = response.split() if status == STATUS_OK else []
+        return resolve_compression(self.compression, self.server_codecs)
+
+    def verify_digest(self, stats, hasher, required=False):
+        """Checks the digest in a transfer trailer against the one computed locally while streaming.
+
+        Servers that do not report a digest (or report another algorithm) cannot be checked,
+        which passes unless required: a resumed transfer joins two halves and must be checked.
+        """
+        if stats.get("algorithm") != hasher.name:
+            return not required
+        return stats["digest"] == hasher.hexdigest()
 
     # Uploads file
-    def upload_file(self, filename):
-        """Uploads a file to the server."""
+    def upload_file(self, filename, streams=1, resume=False, overwrite=False):
+        """Uploads a file to the server, split over `streams` parallel connections if more than one.
+
+        With resume=True only the part the server does not have yet from an earlier,
+        interrupted upload is sent. The file is hashed while it is sent and compared
+        with the digest the server computed on its side. overwrite (True, False or a
+        callable asked with the name) decides whether a server file is replaced.
+        Returns the transfer result; raises RemoteExistsError, ChecksumError or ClientError.
+        """
         if not os.path.exists(filename):
-            print("File does not exist.")
-            return
+            raise FileNotFoundError(f"No local file {filename}")
+        if streams > 1:
+            return self.upload_striped(filename, streams, overwrite)
 
-        self.client_socket.sendall(f"UPLOAD {filename}\n".encode())
-        response = self.client_socket.recv(1024).decode()
-        print(response)
-        if "Overwrite?" in response:
-            overwrite = input("File exists on server. Overwrite? (y/n): ")
-            self.client_socket.sendall(overwrite.encode())
-            response = self.client_socket.recv(1024).decode()
+        start = time.perf_counter()
+        offset, hasher = self.resume_offset(filename) if resume else (0, new_hasher(self.hash_algorithm))
+        compression = self.transfer_compression()
+        self.send_command(f"UPLOAD {filename} {offset} {hasher.name}")
+        opcode, status, response = self.conn.recv_message()
+        if opcode == OP_PROMPT:
+            status, response = self.answer_prompt(allowed(overwrite, filename))
+        check_response(status, response)
 
-        if "Ready" in response:
-            with open(filename, 'rb') as f:
-                while chunk := f.read(1024):
-                    self.client_socket.sendall(chunk)
-            self.client_socket.sendall(b"EOF")  # Send "EOF" after the file is done
-            print(self.client_socket.recv(1024).decode())
+        size = os.path.getsize(filename)
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            self.conn.send_file(f, size - offset, hasher, compression)
+        status, message, stats = self.conn.recv_trailer()
+        check_response(status, message)
+        if not self.verify_digest(stats, hasher, required=offset > 0):
+            raise ChecksumError("The server's copy differs from the local file. Upload it again." if "digest" in stats
+                                else "The server did not confirm the resumed upload. Upload it again.")
+        return transfer_result(filename, "uploaded", size, time.perf_counter() - start, message, stats)
+
+    def answer_prompt(self, yes):
+        """Answers the server's overwrite question; returns (status, text) of what follows.
+
+        Declining ends the command with RemoteExistsError.
+        """
+        self.conn.send_frame(OP_REPLY, b"y" if yes else b"n")
+        _, status, response = self.conn.recv_message()
+        if not yes:
+            raise RemoteExistsError("File exists on server.")
+        return status, response
+
+    def resume_offset(self, filename):
+        """Asks the server how much of an interrupted upload it kept and checks it is the same data.
+
+        Returns (offset, hasher) where hasher already holds the digest of the kept prefix;
+        (0, a new hasher) when there is nothing to resume or the local file changed.
+        """
+        status, response = self.request(f"OFFSET {filename}")
+        if status != STATUS_OK:
+            return 0, new_hasher(self.hash_algorithm)
+        offset, algorithm, digest = response.split()
+        offset = int(offset)
+        if offset > os.path.getsize(filename):
+            return 0, new_hasher(self.hash_algorithm)
+        with open(filename, 'rb') as f:
+            hasher = hash_file(f, new_hasher(algorithm), offset)
+        if hasher.hexdigest() != digest:
+            return 0, new_hasher(self.hash_algorithm)
+        return offset, hasher
 
     # Downloads file
-    def download_file(self, filename):
-        """Downloads a file from the server."""
-        if os.path.exists(filename):
-           response = input("File exists on your computer! Do you wish to overwrite? (y/n): ")
-           if response == "y":
-               print("Overwriting "+filename)
-           else:
-               print("Canceling download\n")
-               return
-
-        self.client_socket.sendall(f"DOWNLOAD {filename}\n".encode())
-        response = self.client_socket.recv(1024).decode()
-        if "Ready" in response:
-            print("Ready to receive file")
-            with open(filename, 'wb') as f:
-                buffer = b""
-                while True:
-                    data = self.client_socket.recv(1024)
-                    if b"EOF" in data:
-                        buffer += data.split(b"EOF")[0]  # Write everything before "EOF"
-                        # res = data.split(b"EOF")[1].decode()
-                        f.write(buffer)
-                        break
-                    buffer += data
-                    f.write(buffer)
-                    buffer = b""  # Reset buffer after writing to the file
-            response = self.client_socket.recv(1024).decode()
-            print(response)
+    def download_file(self, filename, streams=1, resume=False, overwrite=False):
+        """Downloads a file from the server, split over `streams` parallel connections if more than one.
+
+        Data goes to a hidden .part file that is renamed once complete and its digest
+        matches the server's; with resume=True a .part left by an interrupted download
+        is continued instead of started over. A local file is only replaced if
+        overwrite allows it (True, False or a callable asked with the name).
+        Returns the transfer result; raises FileExistsError, RemoteNotFoundError or ChecksumError.
+        """
+        if os.path.exists(filename) and not allowed(overwrite, filename):
+            raise FileExistsError(f"Local file {filename} exists")
+        if streams > 1:
+            return self.download_striped(filename, streams)
+
+        start = time.perf_counter()
+        directory, name = os.path.split(filename)
+        part_path = os.path.join(directory, f".{name}.part")
+        offset = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+        check_response(*self.request(f"DOWNLOAD {filename} {offset} {self.hash_algorithm} "
+                                     f"{self.transfer_compression()}"))
+        hasher = new_hasher(self.hash_algorithm)
+        if offset:
+            with open(part_path, 'rb') as f:
+                hash_file(f, hasher, offset)
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            size, _ = self.conn.recv_file(f, hasher)
+        _, message, stats = self.conn.recv_trailer()
+        if not self.verify_digest(stats, hasher, required=offset > 0):
+            os.remove(part_path)
+            raise ChecksumError("The download is corrupted and was discarded." if "digest" in stats
+                                else "The resumed download could not be verified and was discarded.")
+        os.replace(part_path, filename)
+        return transfer_result(filename, "downloaded", offset + size, time.perf_counter() - start, message, stats)
+
+    # Asks for the digest of a server file
+    def remote_hash(self, filename):
+        """Returns the server's digest of a file (from its hash cache when unchanged)."""
+        return self.command(f"HASH {filename} {self.hash_algorithm}").split()[1]
+
+    def stat_file(self, filename):
+        """Returns {"size", "mtime", "algorithm", "digest"} of a server file."""
+        size, mtime, algorithm, digest = self.command(f"STAT {filename} {self.hash_algorithm}").split()
+        return {"size": int(size), "mtime": float(mtime), "algorithm": algorithm, "digest": digest}
+
+    # Asks for the server's live metrics
+    def server_stats(self, fmt=""):
+        """Returns the server's STATS report: a summary, or Prometheus text for fmt "prometheus"."""
+        return self.command(f"STATS {fmt}".strip())
+
+    def bandwidth_limit(self, scope="", rate=""):
+        """Returns the server's bandwidth limits, after setting one first if scope and rate are given.
+
+        rate is in bytes/s with an optional K/M/G suffix, or "off".
+        """
+        return self.command(f"LIMIT {scope} {rate}".strip())
+
+    # Spreads the stored files over the server's storage roots again
+    def rebalance(self, action="", root=""):
+        """Returns the server's report of the files it moved to their root, after adding or removing one
+        first if action ("add" or "remove") and root (a directory on the server) are given."""
+        return self.command(f"REBALANCE {action.upper()} {root}".strip())
+
+    # Uploads only the chunks the server does not have yet
+    def upload_dedup(self, filename, overwrite=False):
+        """Uploads a file to a server running the chunk store.
+
+        The file is cut into content-defined chunks locally; the server answers the
+        list of chunk hashes with the ones it is missing and only those are sent.
+        Returns the transfer result, whose stats hold wire_bytes, new_chunks, ...
+        """
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f"No local file {filename}")
+        start = time.perf_counter()
+        chunks = chunk_file(filename)
+        self.send_command(f"DUPLOAD {filename}")
+        self.conn.send_list([[digest, size] for digest, _, size in chunks])
+
+        opcode, status, payload = self.conn.recv_frame()
+        if opcode == OP_PROMPT:
+            yes = allowed(overwrite, filename)
+            self.conn.send_frame(OP_REPLY, b"y" if yes else b"n")
+            opcode, status, payload = self.conn.recv_frame()
+            if not yes:
+                raise RemoteExistsError("File exists on server.")
+        if opcode != OP_LIST:
+            check_response(STATUS_ERROR, payload.decode())
+
+        positions = {digest: (offset, size) for digest, offset, size in chunks}
+        with open(filename, 'rb') as f:
+            for digest in json.loads(payload):
+                offset, size = positions[digest]
+                f.seek(offset)
+                self.conn.send_file(f, size)
+        status, message, stats = self.conn.recv_trailer()
+        check_response(status, message)
+        return transfer_result(filename, "uploaded", stats.get("size", 0), time.perf_counter() - start,
+                               message, stats)
+
+    # Uploads one file as byte ranges over several connections
+    def upload_striped(self, filename, streams=4, overwrite=False):
+        """Uploads a large file as `streams` byte ranges sent in parallel.
+
+        The server only shows the file under its name once every range arrived
+        and the SHA-256 matches. Returns the transfer result.
+        """
+        start = time.perf_counter()
+        file_size = os.path.getsize(filename)
+        self.send_command(f"STRIPE_UPLOAD {filename} {file_size}")
+        opcode, status, response = self.conn.recv_message()
+        if opcode == OP_PROMPT:
+            status, response = self.answer_prompt(allowed(overwrite, filename))
+        transfer_id = check_response(status, response)
+
+        def put(worker, offset, length):
+            check_response(*worker.request(f"STRIPE_PUT {transfer_id} {offset}"))
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                worker.conn.send_file(f, length)
+            worker.conn.recv_trailer()
+
+        self.run_striped(put, split_ranges(file_size, streams))
+        with open(filename, 'rb') as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        message = self.command(f"STRIPE_COMMIT {transfer_id} {digest}")
+        return transfer_result(filename, "uploaded", file_size, time.perf_counter() - start, message,
+                               {"streams": streams, "algorithm": "sha256", "digest": digest})
+
+    # Downloads one file as byte ranges over several connections
+    def download_striped(self, filename, streams=4):
+        """Downloads a large file as `streams` byte ranges fetched in parallel.
+
+        Ranges are written into a hidden temp file with positional writes, which
+        replaces `filename` only once every range has arrived. Returns the transfer result.
+        """
+        start = time.perf_counter()
+        transfer_id, file_size = self.command(f"STRIPE_DOWNLOAD {filename}").split()
+        file_size = int(file_size)
+
+        temp_path = os.path.join(os.path.dirname(filename), f".{os.path.basename(filename)}.{transfer_id}.stripe")
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(fd, file_size)
+
+        def get(worker, offset, length):
+            check_response(*worker.request(f"STRIPE_GET {transfer_id} {offset} {length}"))
+            worker.conn.recv_file_at(fd, offset, file_size)
+            worker.conn.recv_trailer()
+
+        try:
+            self.run_striped(get, split_ranges(file_size, streams))
+        except Exception:
+            os.remove(temp_path)
+            raise
+        finally:
+            os.close(fd)
+        try:
+            algorithm, digest = self.command(f"STRIPE_COMMIT {transfer_id}").split()
+            with open(temp_path, 'rb') as f:
+                actual = hashlib.file_digest(f, algorithm).hexdigest()
+        except Exception:
+            os.remove(temp_path)
+            raise
+        if actual != digest:
+            os.remove(temp_path)
+            raise ChecksumError("The download is corrupted and was discarded.")
+        os.replace(temp_path, filename)
+        return transfer_result(filename, "downloaded", file_size, time.perf_counter() - start,
+                               f"File downloaded over {streams} connections.",
+                               {"streams": streams, "algorithm": algorithm, "digest": digest})
+
+    def run_striped(self, job, ranges):
+        """Runs job(worker, *args) for every args tuple in ranges, each on its own connection."""
+        if not ranges:
+            return
+        workers = [self.open_worker() for _ in ranges]
+        try:
+            with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+                list(pool.map(job, workers, *zip(*ranges)))
+        finally:
+            for worker in workers:
+                worker.send_command("QUIT")
+                worker.disconnect()
+
+    # Uploads many files in one batch
+    def upload_files(self, patterns, policy="skip"):
+        """Uploads every local file matching the names/globs with one round trip for the whole batch.
+
+        policy decides what happens to files that already exist on the server:
+        "skip", "overwrite" or "newer" (only if the local copy is newer).
+        Returns a list of {"name", "status", "message"} dicts, one per file.
+        """
+        paths = []
+        for pattern in patterns:
+            paths.extend(p for p in sorted(glob.glob(pattern)) if os.path.isfile(p))
+        return self.upload_batch(paths, [os.path.basename(p) for p in paths], policy)
+
+    def upload_batch(self, paths, names, policy="skip"):
+        """MUPLOAD of local files under the given server names (relative paths in the server directory)."""
+        if not paths:
+            return []
+        entries = [{"name": name, "size": os.path.getsize(p), "mtime": os.path.getmtime(p),
+                    "algorithm": self.hash_algorithm} for p, name in zip(paths, names)]
+
+        compression = self.transfer_compression()
+        # Command and file list go out together, the plan comes back once
+        self.send_command(f"MUPLOAD {policy}")
+        self.conn.send_list(entries)
+        opcode, status, payload = self.conn.recv_frame()
+        if opcode != OP_LIST:
+            return [{"name": e["name"], "status": "error", "message": payload.decode().strip()} for e in entries]
+        plan = json.loads(payload)
+
+        results = [{"name": item["name"], "status": "skipped", "message": "Exists on server."} for item in plan]
+        to_send = [i for i, item in enumerate(plan) if item["action"] == "upload"]
+        # Created up front: a trailer can only arrive after its file was hashed and sent
+        hashers = {i: new_hasher(self.hash_algorithm) for i in to_send}
+
+        # Per-file trailers are read on a second thread so neither side ever blocks on a full socket
+        def collect():
+            for i in to_send:
+                status, message, stats = self.conn.recv_trailer()
+                if status == STATUS_OK and not self.verify_digest(stats, hashers[i]):
+                    status, message = None, "Checksum mismatch."
+                results[i] = {"name": plan[i]["name"], "status": "uploaded" if status == STATUS_OK else "error",
+                              "message": message.strip()}
+            self.conn.recv_message()
+
+        reader = threading.Thread(target=collect)
+        reader.start()
+        for i in to_send:
+            with open(paths[i], 'rb') as f:
+                self.conn.send_file(f, entries[i]["size"], hashers[i], compression)
+        reader.join()
+        return results
+
+    # Downloads many files in one batch
+    def download_files(self, patterns, policy="skip", target=None):
+        """Downloads every server file matching the names/globs, streamed back-to-back.
+
+        policy works as in upload_files, but against the local copies. Globs may
+        name a sub-directory ("logs/*.csv"); target(name) maps a server name to
+        the local path (default: the name itself).
+        """
+        target = target or (lambda name: name)
+        self.send_command(f"MDOWNLOAD {self.hash_algorithm} {self.transfer_compression()}")
+        self.conn.send_list(patterns)
+        entries = self.conn.recv_list()
+
+        results = []
+        wanted = []
+        for entry in entries:
+            if "error" in entry:
+                results.append({"name": entry["name"], "status": "error", "message": entry["error"]})
+            elif should_transfer(target(entry["name"]), entry["mtime"], policy):
+                wanted.append(entry)
+            else:
+                results.append({"name": entry["name"], "status": "skipped", "message": "Exists locally."})
+        self.conn.send_list([entry["name"] for entry in wanted])
+
+        for entry in wanted:
+            hasher = new_hasher(self.hash_algorithm)
+            local_path = target(entry["name"])
+            directory, name = os.path.split(local_path)
+            part_path = os.path.join(directory, f".{name}.part")  # the local copy stays until the new one is good
+            with open(part_path, 'wb') as f:
+                self.conn.recv_file(f, hasher)
+            status, message, stats = self.conn.recv_trailer()
+            if status != STATUS_OK or not self.verify_digest(stats, hasher):
+                os.remove(part_path)
+                results.append({"name": entry["name"], "status": "error",
+                                "message": message.strip() if status != STATUS_OK else "Checksum mismatch."})
+                continue
+            os.replace(part_path, local_path)
+            os.utime(local_path, (entry["mtime"], entry["mtime"]))
+            results.append({"name": entry["name"], "status": "downloaded", "message": message.strip()})
+        self.conn.recv_message()
+        return results
+
+    # Mirrors a directory tree to or from the server
+    def sync(self, local_dir, remote_dir, direction="push", delete=False, checksum=False, streams=4):
+        """Makes remote_dir a copy of local_dir (push) or local_dir a copy of remote_dir (pull).
+
+        Both sides compare manifests (path, size, mtime; with checksum also the
+        digest of same-size files) and only new and changed files travel, as
+        MUPLOAD/MDOWNLOAD batches over up to `streams` extra connections. With
+        delete, files missing from the source are removed from the copy.
+        Returns {"files", "mkdir", "delete", "conflicts"} (files as in
+        upload_files); raises ClientError if the server refused and
+        ProtocolError if it named a path outside local_dir.
+        """
+        os.makedirs(local_dir, exist_ok=True)
+        manifest = build_manifest(local_dir)
+        if checksum:
+            for path, entry in manifest.items():
+                if not entry[0]:
+                    with open(os.path.join(local_dir, *path.split("/")), 'rb') as f:
+                        entry[3] = hash_file(f, new_hasher(self.hash_algorithm), chunk_size=self.chunk_size).hexdigest()
+        flags = (" delete" if delete else "") + (" checksum" if checksum else "")
+        self.send_command(f"SYNC {direction} {remote_dir} {self.hash_algorithm}{flags}")
+        self.conn.send_list(manifest_to_entries(manifest))
+        opcode, status, payload = self.conn.recv_frame()
+        if opcode != OP_LIST:
+            check_response(STATUS_ERROR, payload.decode())
+        plan = json.loads(payload)
+        base = plan["base"]
+
+        def local(path):
+            # A pull writes and deletes what the server names, so nothing may point outside local_dir
+            try:
+                return local_path(local_dir, path)
+            except ValueError as e:
+                raise ProtocolError(f"Unsafe path from the server: {e}") from None
+
+        def remote(path):
+            return f"{base}/{path}" if base else path
+
+        results = []
+        if direction == "push":
+            sizes = {path: manifest[path][1] for path in plan["upload"]}
+
+            def job(worker, group):
+                results.extend(worker.upload_batch([local(p) for p in group], [remote(p) for p in group], "overwrite"))
+            groups = split_groups(plan["upload"], sizes, streams)
         else:
-            print("File not found!\n")
+            for path in plan["delete"] + plan["mkdir"] + plan["download"]:
+                local(path)  # all checked before anything changes
+            for path in plan["delete"]:
+                if os.path.isdir(local(path)):
+                    shutil.rmtree(local(path))
+                else:
+                    os.remove(local(path))
+            for path in plan["mkdir"]:
+                os.makedirs(local(path), exist_ok=True)
+
+            def target(name):
+                # Names come back as remote paths; strip the base to find the local file
+                if base:
+                    if not name.startswith(base + "/"):
+                        raise ProtocolError(f"Unsafe path from the server: {name} is not in {base}")
+                    name = name[len(base) + 1:]
+                return local(name)
+
+            def job(worker, group):
+                # Only the last part of a name is a glob on the server
+                patterns = [os.path.join(os.path.dirname(remote(p)), glob.escape(os.path.basename(p))) for p in group]
+                results.extend(worker.download_files(patterns, "overwrite", target=target))
+            groups = split_groups(plan["download"], plan["sizes"], streams)
+        # Workers start in the server's root directory, hence the paths relative to "base"
+        self.run_striped(job, [(group,) for group in groups])
+        return {"files": results, "mkdir": plan["mkdir"], "delete": plan["delete"], "conflicts": plan["conflicts"]}
 
     # Deletes file
     def delete_file(self, filename):
-        """Sends a delete command to the server for a specific file."""
-        self.client_socket.sendall(f"DELETE {filename}\n".encode())
-        response = self.client_socket.recv(1024).decode()
-        print(response)  # Server's response (success/failure message)
+        """Deletes a file on the server; returns the server's message or raises RemoteNotFoundError."""
+        return self.command(f"DELETE {filename}").strip()
 
-    # Lists files
-    def list_files(self):
-        """Requests a list of files in the server's directory."""
-        self.client_socket.sendall(b"DIR\n")
-        response = self.client_socket.recv(4096).decode()
-        if response == "":
-            print("There are no files on the server! Upload files to view them here")
-            return
-        files = []
-        directories = []
-        for path in response.split('\n'):
-            if path == '':
-                continue
-            if '.' in path.split('/')[-1]:  # Checks for a file extension in the last part of the path
-                files.append(path)
+    # Lists the server directory page by page
+    def list_dir(self, on_page, sort="name", reverse=False, match=None, kind=None, offset=0, limit=None):
+        """Sends DIR and calls on_page(entries) with each page of [name, "f"/"d", size, mtime] as it arrives.
+
+        kind is "file" or "dir", match a glob. Returns the trailer stats
+        ({"total", "offset", "count", "next"}); raises ClientError if the server refused.
+        """
+        options = [f"sort={sort}", f"order={'desc' if reverse else 'asc'}", f"offset={offset}"]
+        if match is not None:
+            options.append(f"match={match}")
+        if kind is not None:
+            options.append(f"type={kind}")
+        if limit is not None:
+            options.append(f"limit={limit}")
+        self.send_command("DIR " + " ".join(options))
+        while True:
+            opcode, status, payload = self.conn.recv_frame()
+            if opcode == OP_LIST:
+                on_page(json.loads(payload))
+            elif opcode == OP_DONE:
+                message, stats = parse_trailer(payload)
+                check_response(status, message)
+                return stats
             else:
-                directories.append(path)
-
-        files.sort()
-        directories.sort()
-        print("Files:")
-        for file in files:
-            print(file)
-        print("\nSub-Directories:")
-        for directory in directories:
-            print(directory)
-        print()
+                check_response(STATUS_ERROR, payload.decode())
 
-    # Disconnect
-    def disconnect(self):
-        """Gracefully disconnects from the server."""
-        self.client_socket.close()
+    # Lists files
+    def list_files(self, sort="name", reverse=False, match=None, kind=None, offset=0, limit=None):
+        """Returns the server directory as list_dir's stats plus "entries", a list of
+        {"name", "kind" ("f" or "d"), "size", "mtime"} dicts."""
+        entries = []
+
+        def collect(page):
+            entries.extend({"name": name, "kind": entry_kind, "size": size, "mtime": mtime}
+                           for name, entry_kind, size, mtime in page)
 
-    def manage_subfolders(self, cmd, path):
-        cmd = cmd.upper()
-        path = path.lower()
-        self.client_socket.sendall(f"SUBFOLDER {cmd} {path}\n".encode())
-        response = self.client_socket.recv(1024).decode()
-
-        if cmd == "CREATE":
-            if "exists" in response:
-                print("Subfolder already exists!")
-            elif "successfully" in response:
-                print("Subfolder created successfully!")
-        elif cmd == "DELETE":
-            if "not found" in response:
-                print("Subfolder does not exist!")
-            elif "successfully" in response:
-                print("Subfolder deleted successfully!")
+        stats = self.list_dir(collect, sort, reverse, match, kind, offset, limit)
+        return dict(stats, entries=entries)
+
+    # Folders
+    def make_folder(self, path):
+        """Creates a sub folder; raises RemoteExistsError if it exists."""
+        return self.command(f"SUBFOLDER CREATE {path}").strip()
+
+    def remove_folder(self, path):
+        """Deletes a sub folder and everything in it; raises RemoteNotFoundError if there is none."""
+        return self.command(f"SUBFOLDER DELETE {path}").strip()
 
     def change_directory(self, path):
-        self.client_socket.sendall(f"CD {path}\n".encode())
-        response = self.client_socket.recv(1024).decode()
-        print(response)
+        """Changes the server directory of this session ("..", or a path below it) and returns the new one."""
+        return self.command(f"CD {path}").strip().rpartition(": ")[2]
+
+    # Disconnect
+    def quit(self):
+        """Ends the session and closes the connection."""
+        try:
+            self.send_command("QUIT")
+        except OSError:
+            pass
+        self.disconnect()
+
+    def shutdown(self):
+        """Asks the server to shut down, then closes the connection."""
+        response = self.command("SHUTDOWN")
+        self.disconnect()
+        return response.strip()
+
+    def disconnect(self):
+        """Closes the connection without ending the session first."""
+        self.client_socket.close()
 
 
 if __name__ == "__main__":
-    # server_ip = input("Enter the server IP: ")
-    # port = int(input("Enter the server port: "))
-    server_ip = '127.0.0.1'
-    # server_ip = '192.168.123.202'
-    port = 4456
-    client = FileClient(server_ip, port)
-    client.connect()
+    from shell import main
+    main()
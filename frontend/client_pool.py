@@ -0,0 +1,142 @@
+## Pool of logged-in client connections for scripts that run many commands
+
+# import libraries
+import hashlib
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import STATUS_OK, TOKEN_PREFIX
+from client import FileClient
+from results import AuthenticationError
+
+
+class ClientPool:
+    """Lends out up to `size` authenticated FileClients that stay connected between uses.
+
+    Connections are opened when first needed. The first one logs in with the
+    password and asks for a session token; the others, and replacements for
+    broken ones, log in with the token, which skips the server's password check.
+    A connection that raised while it was borrowed is closed rather than reused,
+    since the protocol may be halfway through a command. Extra keyword arguments
+    go to FileClient (chunk_size, hash_algorithm, compression).
+
+        with ClientPool("127.0.0.1", 4456, "user", "pass", size=4) as pool:
+            with pool.connection() as client:
+                client.download_file("notes.txt")
+            status, text = pool.request("STAT notes.txt")
+    """
+
+    def __init__(self, server_ip, port, username, password, size=4, **options):
+        self.server_ip = server_ip
+        self.port = port
+        self.username = username
+        self.password_hash = hashlib.sha256(password.encode()).hexdigest()
+        self.size = size
+        self.options = options
+        self.token = None  # shared by every connection of the pool
+        self.idle = []  # connected clients not lent out, most recently used last
+        self.opened = 0  # clients connected or being connected, lent out or idle
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a client for a sequence of commands; it goes back to the pool afterwards."""
+        client = self.acquire(timeout)
+        try:
+            yield client
+        except BaseException:
+            self.release(client, broken=True)
+            raise
+        self.release(client)
+
+    def request(self, command):
+        """Run one command on any free connection and return (status, text) of the response."""
+        with self.connection() as client:
+            return client.request(command)
+
+    def acquire(self, timeout=None):
+        """Take a client out of the pool, connecting a new one if fewer than `size` exist.
+
+        Waits up to `timeout` seconds (forever if None) when all of them are lent out.
+        """
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise ConnectionError("Pool is closed")
+                if self.idle:
+                    return self.idle.pop()
+                if self.opened < self.size:
+                    self.opened += 1
+                    break
+                if not self.condition.wait(timeout):
+                    raise TimeoutError(f"No connection free after {timeout} seconds")
+        try:
+            return self.open()
+        except BaseException:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, client, broken=False):
+        """Give a client back; a broken one (or any, once the pool is closed) is disconnected."""
+        with self.condition:
+            keep = not broken and not self.closed
+            if keep:
+                self.idle.append(client)
+            else:
+                self.opened -= 1
+            self.condition.notify()
+        if not keep:
+            self.quit(client, broken)
+
+    def close(self):
+        """Disconnect the idle clients; ones still lent out are disconnected when they come back."""
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+            self.condition.notify_all()
+        for client in idle:
+            self.quit(client)
+
+    def open(self):
+        if self.token is not None:
+            client = self.login(TOKEN_PREFIX + self.token)
+            if client is not None:
+                return client
+        # No token yet, or it expired: log in with the password and ask for a new one
+        client = self.login(self.password_hash)
+        if client is None:
+            raise AuthenticationError("Authentication failed.")
+        self.token = client.session_token()
+        return client
+
+    def login(self, secret):
+        client = FileClient(self.server_ip, self.port, **self.options)
+        client.client_socket.connect((self.server_ip, self.port))
+        status, _ = client.send_credentials(self.username, secret)
+        if status != STATUS_OK:
+            client.disconnect()
+            return None
+        client.token = self.token
+        return client
+
+    @staticmethod
+    def quit(client, broken=False):
+        try:
+            if not broken:
+                client.send_command("QUIT")
+        except OSError:
+            pass
+        client.disconnect()
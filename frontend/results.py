@@ -0,0 +1,61 @@
+## Structured results and typed errors shared by the blocking and the asyncio client
+
+# import libraries
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from protocol import STATUS_OK
+
+
+class ClientError(Exception):
+    """The server refused a request. `message` is its answer, without the trailing newline."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class AuthenticationError(ClientError):
+    """Wrong username, password or token."""
+
+
+class RemoteNotFoundError(ClientError):
+    """The file or folder does not exist on the server."""
+
+
+class RemoteExistsError(ClientError):
+    """The file or folder already exists on the server and was not to be overwritten."""
+
+
+class ChecksumError(ClientError):
+    """The digests of the two copies differ after a transfer; the bad copy was discarded."""
+
+
+def check_response(status, response):
+    """Return the server's answer, or raise the ClientError that fits it if it refused."""
+    if status == STATUS_OK:
+        return response
+    message = response.strip()
+    lowered = message.lower()
+    if "not found" in lowered or "does not exist" in lowered:
+        raise RemoteNotFoundError(message)
+    if "exists" in lowered:
+        raise RemoteExistsError(message)
+    if "checksum" in lowered:
+        raise ChecksumError(message)
+    if lowered.startswith("authentication"):
+        raise AuthenticationError(message)
+    raise ClientError(message)
+
+
+def allowed(overwrite, name):
+    """overwrite is True, False or a callable asked with the name (e.g. a prompt)."""
+    return overwrite(name) if callable(overwrite) else bool(overwrite)
+
+
+def transfer_result(name, status, size, elapsed, message="", stats=None):
+    """The result of one transfer: status is "uploaded", "downloaded" or "skipped",
+    size the bytes of the file, elapsed seconds on this side and stats the server's trailer."""
+    return {"name": name, "status": status, "bytes": size, "elapsed": elapsed,
+            "message": message.strip(), "stats": stats or {}}
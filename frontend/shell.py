@@ -0,0 +1,258 @@
+## Interactive shell and batch mode on top of the FileClient library
+
+# import libraries
+import argparse
+import json
+import sys
+import time
+from client import FileClient
+from results import ClientError
+from protocol import ProtocolError
+from compression import COMPRESSION_MODES
+
+COMMANDS = ("UPLOAD {file} [streams] [RESUME], DOWNLOAD {file} [streams] [RESUME], "
+            "MUPLOAD {skip|overwrite|newer} {files...}, MDOWNLOAD {skip|overwrite|newer} {files...}, DUPLOAD {file}, "
+            "SYNC {push|pull} {local_dir} {remote_dir} [DELETE] [CHECKSUM] [streams], HASH {file}, STAT {file}, "
+            "COMPRESSION {none|auto|codec}, STATS [prometheus], LIMIT [global|user|session {rate|off}], TOKEN, "
+            "REBALANCE [add|remove {root}], DELETE {file}, SUBFOLDER {create|delete} {path}, "
+            "DIR [sort=name|size|mtime|none] [order=asc|desc] [type=file|dir] [match=glob] [offset=N] [limit=N], "
+            "CD {..|path}, QUIT, SHUTDOWN")
+
+
+class ClientShell:
+    """Runs command lines against a logged-in FileClient and prints what they return.
+
+    Interactively the user is asked before a file is overwritten; batch mode
+    passes overwrite=True or False instead. With as_json every command prints one
+    JSON object {"command", "ok", "result" or "error" and "message"}.
+    """
+
+    def __init__(self, client, overwrite=None, as_json=False):
+        self.client = client
+        self.overwrite = self.ask if overwrite is None else overwrite
+        self.as_json = as_json
+        self.handlers = {
+            "UPLOAD": self.upload, "DOWNLOAD": self.download, "MUPLOAD": self.upload_many,
+            "MDOWNLOAD": self.download_many, "DUPLOAD": self.upload_dedup, "SYNC": self.sync,
+            "HASH": self.remote_hash, "STAT": client.stat_file, "COMPRESSION": self.set_compression,
+            "STATS": client.server_stats, "LIMIT": client.bandwidth_limit, "TOKEN": client.session_token,
+            "REBALANCE": client.rebalance,
+            "DELETE": client.delete_file, "SUBFOLDER": self.subfolder, "DIR": self.list_files,
+            "CD": client.change_directory, "QUIT": self.quit, "SHUTDOWN": client.shutdown,
+        }
+
+    @staticmethod
+    def ask(name):
+        return input(f"{name} exists. Overwrite? (y/n): ").strip().lower() == "y"
+
+    # Interactive loop
+    def command_loop(self):
+        """Reads commands until QUIT, SHUTDOWN or end of input."""
+        while True:
+            try:
+                line = input(f"Enter command ({COMMANDS}):\n").strip()
+            except EOFError:
+                self.client.quit()
+                break
+            if not self.run_line(line)[1]:
+                break
+
+    def run_line(self, line):
+        """Runs one command line and prints its result. Returns (succeeded, session still open)."""
+        words = line.split()
+        if not words:
+            return True, True
+        command, args = words[0].upper(), words[1:]
+        handler = self.handlers.get(command)
+        try:
+            if handler is None:
+                raise ValueError(f"Invalid command {words[0]}.")
+            result = handler(*args)
+        except (ClientError, ProtocolError, OSError, ValueError, TypeError) as e:
+            # TypeError and ValueError here come from missing or malformed arguments
+            if isinstance(e, (TypeError, ValueError)) and not isinstance(e, ClientError):
+                message = str(e) if handler is None else f"Invalid arguments for {command}: {e}"
+            else:
+                message = str(e) or type(e).__name__
+            self.show_error(line, type(e).__name__, message)
+            # After a ProtocolError the connection is out of step with the server, like a lost one
+            return False, command not in ("QUIT", "SHUTDOWN") and not isinstance(e, (ConnectionError, ProtocolError))
+        self.show(line, command, result)
+        return True, command not in ("QUIT", "SHUTDOWN")
+
+    # Commands that need their arguments parsed first
+    def upload(self, filename, *options):
+        return self.client.upload_file(filename, *self.transfer_options(options), overwrite=self.overwrite)
+
+    def download(self, filename, *options):
+        return self.client.download_file(filename, *self.transfer_options(options), overwrite=self.overwrite)
+
+    def upload_dedup(self, filename):
+        return self.client.upload_dedup(filename, overwrite=self.overwrite)
+
+    def upload_many(self, policy, *patterns):
+        return self.client.upload_files(patterns, policy)
+
+    def download_many(self, policy, *patterns):
+        return self.client.download_files(list(patterns), policy)
+
+    def sync(self, direction, local_dir, remote_dir, *options):
+        options = [option.upper() for option in options]
+        streams = next((int(option) for option in options if option.isdigit()), 4)
+        return self.client.sync(local_dir, remote_dir, direction.lower(), "DELETE" in options,
+                                "CHECKSUM" in options, streams)
+
+    def remote_hash(self, filename):
+        return f"{self.client.hash_algorithm} {self.client.remote_hash(filename)}"
+
+    def set_compression(self, mode):
+        if mode.lower() not in COMPRESSION_MODES:
+            raise ValueError(f"Compression must be one of: {', '.join(COMPRESSION_MODES)}")
+        self.client.compression = mode.lower()
+        return f"Compression set to {self.client.compression}."
+
+    def subfolder(self, action, path):
+        if action.upper() == "CREATE":
+            return self.client.make_folder(path)
+        if action.upper() == "DELETE":
+            return self.client.remove_folder(path)
+        raise ValueError("expected create or delete")
+
+    def list_files(self, *options):
+        """DIR's key=value words, e.g. sort=size order=desc, as list_files arguments."""
+        kwargs = {}
+        for option in options:
+            key, _, value = option.partition("=")
+            key = key.lower()
+            if key == "order":
+                kwargs["reverse"] = value == "desc"
+            elif key == "type":
+                kwargs["kind"] = value
+            elif key in ("offset", "limit"):
+                kwargs[key] = int(value)
+            elif key in ("sort", "match"):
+                kwargs[key] = value
+            else:
+                raise ValueError(f"unknown option {key}")
+        return self.client.list_files(**kwargs)
+
+    def quit(self):
+        self.client.quit()
+        return "Disconnected from server."
+
+    @staticmethod
+    def transfer_options(options):
+        """Turns the optional "{streams}" and "RESUME" words of UPLOAD/DOWNLOAD into (streams, resume)."""
+        streams = 1
+        resume = False
+        for option in options:
+            if option.upper() == "RESUME":
+                resume = True
+            else:
+                streams = int(option)
+        return streams, resume
+
+    # Output
+    def show_error(self, line, kind, message):
+        if self.as_json:
+            print(json.dumps({"command": line, "ok": False, "error": kind, "message": message}), flush=True)
+        else:
+            print(f"Error: {message}")
+
+    def show(self, line, command, result):
+        if self.as_json:
+            print(json.dumps({"command": line, "ok": True, "result": result}), flush=True)
+        elif command == "DIR":
+            self.print_listing(result)
+        elif command == "SYNC":
+            self.print_batch_results(result["files"])
+            print(f"{len(result['mkdir'])} folder(s) created, {len(result['delete'])} path(s) deleted, "
+                  f"{len(result['conflicts'])} conflict(s).")
+        elif command == "TOKEN":
+            print(f"Session token: {result}" if result else "The server did not issue a token.")
+        elif isinstance(result, list):
+            self.print_batch_results(result)
+        elif isinstance(result, dict) and "message" in result:
+            print(result["message"])
+        elif isinstance(result, str):
+            print(result.rstrip("\n"))
+        else:
+            print(result)
+
+    @staticmethod
+    def print_batch_results(results):
+        for result in results:
+            print(f"{result['status']:>10}  {result['name']}  {result['message']}")
+        print(f"{len(results)} file(s) processed.")
+
+    @staticmethod
+    def print_listing(listing):
+        for entry in listing["entries"]:
+            modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["mtime"]))
+            if entry["kind"] == "d":
+                print(f"{'<dir>':>14}  {modified}  {entry['name']}/")
+            else:
+                print(f"{entry['size']:>14,}  {modified}  {entry['name']}")
+        if listing["total"] == 0:
+            print("There are no files on the server! Upload files to view them here")
+        elif listing["next"] is not None:
+            print(f"{listing['count']} of {listing['total']} entries, continue with offset={listing['next']}")
+        print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="File client. Without -c or --script it starts an interactive shell.",
+        epilog=f"Commands: {COMMANDS}")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4456)
+    parser.add_argument("--user", help="username (asked for interactively if missing)")
+    parser.add_argument("--password", help="password (asked for interactively if missing)")
+    parser.add_argument("--token", help="session token from TOKEN, instead of the password")
+    parser.add_argument("-c", "--command", action="append", default=[], dest="commands",
+                        help="run this command; may be given several times")
+    parser.add_argument("--script", help="run the commands in this file, one per line ('-' for stdin)")
+    parser.add_argument("--overwrite", action="store_true", help="replace existing files without asking")
+    parser.add_argument("--keep-going", action="store_true", help="run the remaining commands after one fails")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per command")
+    parser.add_argument("--compression", default="none", choices=COMPRESSION_MODES)
+    args = parser.parse_args(argv)
+
+    lines = list(args.commands)
+    if args.script:
+        with (sys.stdin if args.script == "-" else open(args.script)) as f:
+            lines.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith("#"))
+    batch = bool(lines)
+    if batch and (args.user is None or (args.password is None and args.token is None)):
+        parser.error("batch mode needs --user and --password or --token")
+
+    client = FileClient(args.host, args.port, compression=args.compression)
+    username = args.user if args.user is not None else input("Enter username: ")
+    password = args.password
+    if password is None and args.token is None:
+        password = input("Enter password: ")
+    try:
+        client.connect(username, password, args.token)
+    except (ClientError, OSError) as e:
+        print(f"Error connecting to server: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if not batch:
+        print(f"Connected to server at {args.host}:{args.port}")
+        ClientShell(client).command_loop()
+        return
+
+    shell = ClientShell(client, overwrite=args.overwrite, as_json=args.json)
+    failed = False
+    for line in lines:
+        succeeded, still_open = shell.run_line(line)
+        failed = failed or not succeeded
+        if not still_open or (failed and not args.keep_going):
+            break
+    else:
+        client.quit()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+## Shared setup of the regression checks: they drive the scripts in benchmarks/ at a small size
+
+# import libraries
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+
+@pytest.fixture
+def run_benchmark():
+    """run(name, *args) runs benchmarks/<name>.py and fails the test, with its output, unless it exits with status 0."""
+    def run(name, *args, timeout=600):
+        result = subprocess.run([sys.executable, os.path.join(ROOT, "benchmarks", f"{name}.py"), *map(str, args)],
+                                capture_output=True, text=True, timeout=timeout)
+        assert result.returncode == 0, result.stdout + result.stderr
+        return result.stdout
+    return run
@@ -0,0 +1,6 @@
+## Bandwidth limits per session, user and server hold with several clients at once
+
+
+def test_rates_stay_within_limits(run_benchmark):
+    # 5 s per case lets the token buckets' initial burst wear off; 20% leaves room for a busy machine
+    run_benchmark("bench_bandwidth", 5, 0.2)
@@ -0,0 +1,10 @@
+## Transfers end with a DONE trailer, not a fixed sleep: many tiny downloads must stay fast
+
+# import libraries
+import pytest
+
+
+@pytest.mark.parametrize("server", ["threaded", "async"])
+def test_tiny_downloads_are_not_slept_on(run_benchmark, server):
+    # 200 downloads took at least 100 s with the old 0.5 s sleep; the script fails above a tenth of that
+    run_benchmark("bench_small_files", 200, *(["--async"] if server == "async" else []))
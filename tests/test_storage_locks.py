@@ -0,0 +1,41 @@
+## Per-path locks: no torn or mixed files under concurrent uploads, downloads and deletes
+
+# import libraries
+import asyncio
+import os
+import tempfile
+import time
+
+from bench_storage_locks import bench_server, lock_run  # also puts backend/ on sys.path
+from path_locks import AsyncPathLocks, PathLocks
+
+
+def test_locks_on_different_paths_do_not_wait_for_each_other():
+    with tempfile.TemporaryDirectory() as root:
+        def own_path(i):
+            return [os.path.join(root, "folder", f"own_{i}")]
+        alone = lock_run(PathLocks(root), 1, own_path, True, 0.5)
+        together = lock_run(PathLocks(root), 16, own_path, True, 0.5)
+    # Each holder sleeps 2 ms, so 16 of them reach up to 16x; a shared lock would stay at 1x
+    assert together > 4 * alone
+
+
+def test_async_locks_serialize_one_path_only():
+    async def hold(locks, path):
+        async with locks.exclusive(path):
+            await asyncio.sleep(0.05)
+
+    async def run(paths):
+        locks = AsyncPathLocks("storage")
+        start = time.perf_counter()
+        await asyncio.gather(*(hold(locks, path) for path in paths))
+        return time.perf_counter() - start
+
+    assert asyncio.run(run([os.path.join("storage", "a")] * 4)) >= 0.2
+    assert asyncio.run(run([os.path.join("storage", f"own_{i}") for i in range(4)])) < 0.15
+
+
+def test_server_stays_consistent_under_contention():
+    failures = []
+    bench_server(1, 8, failures)
+    assert not failures, "\n".join(failures)